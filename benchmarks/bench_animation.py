@@ -0,0 +1,99 @@
+# By Marco Riggirello and Antoine Venturini
+""" Time and memory of a 1k frames training animation: the notebooks
+pipeline (a png saved for every frame, then all of them read back in a
+list and written by `imageio.mimsave`), `make_gif` on the same pngs and
+`AnimationWriter` rendering the figures in memory, in worker threads or
+processes. Each mode runs in its own process, whose peak resident memory
+is reported along with the time spent by the submitting ("training")
+thread.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_animation
+"""
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure # pylint: disable=wrong-import-position
+import imageio # pylint: disable=wrong-import-position
+
+from src.plot_utils import AnimationWriter, make_gif # pylint: disable=wrong-import-position
+
+MODES = ("notebook", "make_gif", "threads", "processes")
+
+
+def plot_samples(samples):
+    """ A frame of the animation: scatter plot of the flow samples. """
+    figure = Figure(figsize=(3, 3), dpi=80)
+    axes = figure.add_subplot()
+    axes.scatter(samples[:, 0], samples[:, 1], s=1)
+    axes.set_xlim(-4, 4)
+    axes.set_ylim(-4, 4)
+    return figure
+
+
+def samples(step, n=1000):
+    """ Samples drifting over the "training" steps. """
+    rng = np.random.default_rng(step)
+    return rng.normal(size=(n, 2)) * (1 + step / 500) + np.sin(step / 50)
+
+
+def run(mode, frames, output, workdir):
+    """ Writes the animation, returns the seconds spent in the submitting thread. """
+    start = time.perf_counter()
+    if mode in ("notebook", "make_gif"):
+        names = []
+        for step in range(frames):
+            name = os.path.join(workdir, f"frame_{step}.png")
+            plot_samples(samples(step)).savefig(name)
+            names.append(name)
+        if mode == "make_gif":
+            make_gif(names, output, duration=.05)
+        else:
+            imageio.mimsave(output, [imageio.imread(name) for name in names], duration=.05)
+        return time.perf_counter() - start
+    with AnimationWriter(output, duration=.05, workers=2, processes=mode == "processes") as writer:
+        for step in range(frames):
+            writer.submit(plot_samples, samples(step))
+        submitted = time.perf_counter() - start
+    return submitted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--mode", choices=MODES, default=None,
+                        help="run a single mode (in this process)")
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        workdir = tempfile.mkdtemp(prefix="diglm_animation_")
+        output = os.path.join(workdir, "animation.gif")
+        start = time.perf_counter()
+        submitted = run(args.mode, args.frames, output, workdir)
+        total = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{args.mode:>9} | {total:>7.1f} | {submitted:>11.1f} | {peak:>12.0f} | "
+              f"{os.path.getsize(output) / 2**20:>7.1f}")
+        shutil.rmtree(workdir, ignore_errors=True)
+        return
+
+    print(f"{args.frames} frames")
+    print(f"{'mode':>9} | {'total s':>7} | {'submitter s':>11} | {'peak RSS MB':>12} | {'gif MB':>7}")
+    for mode in MODES:
+        subprocess.run([sys.executable, "-m", "benchmarks.bench_animation",
+                        "--frames", str(args.frames), "--mode", mode], check=True)
+
+
+if __name__ == "__main__":
+    main()
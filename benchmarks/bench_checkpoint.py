@@ -0,0 +1,61 @@
+# By Marco Riggirello and Antoine Venturini
+""" Save and load times of `checkpoint` files against `tf.train.Checkpoint`,
+for models with large `hidden_layers`: loading assigns the weights into an
+already built model, or reads only the glm head. The files are read
+back from the page cache.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_checkpoint
+"""
+import argparse
+import os
+import tempfile
+import timeit
+
+import tensorflow as tf
+
+from src import checkpoint
+from src.config import DiglmConfig
+
+
+def best(function, repeats):
+    return min(timeit.repeat(function, number=1, repeat=repeats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hidden-layers", nargs="+", default=["512,512", "2048,2048"])
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print("hidden layers |     MB |              format | save (s) | load (s) | head only (s)")
+    for hidden_layers in args.hidden_layers:
+        config = DiglmConfig(args.num_features, masks=[-5,-4,-3,-2,-1,1,2,3,4,5],
+                             spline_params=dict(nbins=32, hidden_layers=[
+                                 int(units) for units in hidden_layers.split(",")]))
+        model = config.build()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "model.diglm")
+            save = best(lambda: checkpoint.save(path, model, config), args.repeats)
+            load = best(lambda: checkpoint.load(path, model), args.repeats)
+            head = best(lambda: checkpoint.load(path, model, parts=("head",)), args.repeats)
+            size = os.path.getsize(path) / 2**20
+            print(f"{hidden_layers:>13} | {size:>6.1f} | {'diglm':>19} | {save:>8.3f} | {load:>8.3f} | {head:>13.4f}")
+
+            tf_checkpoint = tf.train.Checkpoint(flow=list(model.bijector.trainable_variables),
+                                                head=list(model.head_variables))
+            prefix = os.path.join(directory, "ckpt")
+            save = best(lambda: tf_checkpoint.write(prefix), args.repeats)
+            load = best(lambda: tf_checkpoint.read(prefix).assert_consumed(), args.repeats)
+            head_checkpoint = tf.train.Checkpoint(head=list(model.head_variables))
+            head = best(lambda: head_checkpoint.read(prefix).expect_partial(), args.repeats)
+            size = sum(os.path.getsize(os.path.join(directory, name))
+                       for name in os.listdir(directory) if name.startswith("ckpt")) / 2**20
+            print(f"{hidden_layers:>13} | {size:>6.1f} | {'tf.train.Checkpoint':>19} | {save:>8.3f} | "
+                  f"{load:>8.3f} | {head:>13.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# By Marco Riggirello and Antoine Venturini
+""" Cold start of a scoring worker: time to import the package, get a
+ready model and answer the first prediction (one event), each scenario
+in a fresh Python process.
+
+- `eager`: the notebook way, imports `spqr` and `diglm`, creates the
+  model (variables built by the constructor) and calls it eagerly;
+- `traced`: as `eager`, but the first prediction goes through a
+  `tf.function`, as needed for batched throughput;
+- `aot`: imports `serving` and restores with `InferenceEngine.load` the
+  function exported ahead of time by `InferenceEngine.export` (batch size 1
+  only: loading time grows with the number of exported functions);
+- `config`: only imports `config` and creates a `DiglmConfig`.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_cold_start
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+PRELUDE = """
+import json, sys, time
+start = time.perf_counter()
+"""
+
+SCENARIOS = {
+    "eager": """
+import numpy as np
+import tensorflow
+from src.config import DiglmConfig
+imported = time.perf_counter()
+model = DiglmConfig.from_json(sys.argv[1]).build()
+ready = time.perf_counter()
+model(np.zeros([1, model.num_features], np.float32))[0].numpy()
+""",
+    "traced": """
+import numpy as np
+import tensorflow as tf
+from src.config import DiglmConfig
+imported = time.perf_counter()
+model = DiglmConfig.from_json(sys.argv[1]).build()
+ready = time.perf_counter()
+tf.function(model.__call__)(np.zeros([1, model.num_features], np.float32))[0].numpy()
+""",
+    "aot": """
+import numpy as np
+from src.serving import InferenceEngine
+imported = time.perf_counter()
+engine = InferenceEngine.load(sys.argv[2])
+ready = time.perf_counter()
+engine.predict(np.zeros([1, 7], np.float32))
+""",
+    "config": """
+from src.config import DiglmConfig
+imported = time.perf_counter()
+config = DiglmConfig.from_json(sys.argv[1])
+ready = time.perf_counter()
+assert "tensorflow" not in sys.modules
+""",
+}
+
+REPORT = """
+done = time.perf_counter()
+print(json.dumps([imported - start, ready - imported, done - ready]))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    from src.config import DiglmConfig # pylint: disable=import-outside-toplevel
+    from src.serving import InferenceEngine # pylint: disable=import-outside-toplevel
+    config = DiglmConfig(7, masks=[-5,-4,-3,-2,-1,1,2,3,4,5],
+                         spline_params=dict(nbins=32, hidden_layers=[64,64,64]))
+    with tempfile.TemporaryDirectory() as path:
+        InferenceEngine(config.build(), buckets=(1,)).export(path, serving_default=False)
+        print("scenario | import (s) | model ready (s) | first prediction (s) | process (s)")
+        for name, scenario in SCENARIOS.items():
+            times = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, "-c", PRELUDE + scenario + REPORT,
+                                         config.to_json(), path],
+                                        check=True, capture_output=True, text=True).stdout
+                times.append(json.loads(output.splitlines()[-1]) + [time.perf_counter() - start])
+            imported, ready, first, process = min(times, key=lambda t: t[-1])
+            print(f"{name:>8} | {imported:>10.2f} | {ready:>15.2f} | {first:>20.2f} | {process:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
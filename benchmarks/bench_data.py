@@ -0,0 +1,49 @@
+# By Marco Riggirello and Antoine Venturini
+""" Ingest throughput of `data.csv_to_shards` and epoch throughput of
+`data.shards_dataset`, on a synthetic HIGGS-like gzipped CSV
+(one label and 28 feature columns).
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_data
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src import data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2**19)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--shard-rows", type=int, default=2**17)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "HIGGS.csv.gz")
+        rng = np.random.default_rng(0)
+        table = rng.normal(size=(args.rows, 29)).astype(np.float32)
+        table[:, 0] = rng.integers(0, 2, size=args.rows)
+        np.savetxt(csv_path, table, delimiter=",", fmt="%.18e")
+
+        start = time.perf_counter()
+        data.csv_to_shards(csv_path, os.path.join(tmp, "shards"), shard_rows=args.shard_rows)
+        elapsed = time.perf_counter() - start
+        print(f"ingest: {args.rows / elapsed:.0f} rows/s "
+              f"({os.path.getsize(csv_path) / elapsed / 1e6:.1f} MB/s of gzipped CSV)")
+
+        dataset = data.shards_dataset(os.path.join(tmp, "shards"), args.batch_size)
+        for epoch in range(2):
+            start = time.perf_counter()
+            rows = sum(int(batch["labels"].shape[0]) for batch in dataset)
+            elapsed = time.perf_counter() - start
+            print(f"epoch {epoch}: {rows / elapsed:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
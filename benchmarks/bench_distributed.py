@@ -0,0 +1,101 @@
+# By Marco Riggirello and Antoine Venturini
+""" Data-parallel training throughput of `DiglmTrainer` with
+`MirroredStrategy` over 1/2/4/8 logical CPU devices and with
+`MultiWorkerMirroredStrategy` over a local cluster of processes.
+The batch of each replica is fixed, the global batch grows with
+the number of replicas.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_distributed
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(replicas, multi_worker, batch_size, steps):
+    """ Trains in the current process and returns the samples/sec. """
+    # pylint: disable=import-outside-toplevel
+    import tensorflow as tf
+    from tensorflow_probability.python.glm import Bernoulli
+    from src.spqr import NeuralSplineFlow
+    from src.diglm import Diglm
+    from src.trainer import DiglmTrainer, logical_cpu_devices
+
+    if multi_worker:
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    else:
+        strategy = tf.distribute.MirroredStrategy(logical_cpu_devices(replicas))
+    global_batch = batch_size * strategy.num_replicas_in_sync
+    with strategy.scope():
+        nsf = NeuralSplineFlow(masks=[-5,-4,-3,-2,-1,1,2,3,4,5],
+                               spline_params=dict(nbins=32, hidden_layers=[64,64,64]))
+        d = Diglm(nsf, Bernoulli(), 7)
+        trainer = DiglmTrainer(d, tf.keras.optimizers.Adam(3e-4), scaling_const=1/7,
+                               steps_per_execution=8, jit_compile=False, strategy=strategy)
+    features = tf.random.normal([global_batch, 7], seed=0)
+    batch = {"features": features, "labels": tf.cast(features[:, :1] > 0, tf.int32)}
+    dataset = tf.data.Dataset.from_tensors(batch).repeat()
+    trainer.fit(dataset.take(8), verbose=False, eval_every=8)
+    start = time.perf_counter()
+    trainer.fit(dataset.take(steps), verbose=False, eval_every=steps)
+    return steps * global_batch / (time.perf_counter() - start)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def launch(replicas, multi_worker, args):
+    """ Runs a configuration in fresh processes and returns the samples/sec. """
+    command = [sys.executable, "-m", "benchmarks.bench_distributed", "--child",
+               "--replicas", str(replicas), "--batch-size", str(args.batch_size),
+               "--steps", str(args.steps)]
+    if not multi_worker:
+        out = subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True)
+        return float(out.stdout.split()[-1])
+    cluster = {"worker": [f"localhost:{free_port()}" for _ in range(replicas)]}
+    procs = []
+    for index in range(replicas):
+        env = dict(os.environ, TF_CONFIG=json.dumps(
+            {"cluster": cluster, "task": {"type": "worker", "index": index}}))
+        procs.append(subprocess.Popen(command + ["--multi-worker"], cwd=ROOT, env=env,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                      text=True))
+    outputs = [proc.communicate() for proc in procs]
+    for proc, (_, err) in zip(procs, outputs):
+        if proc.returncode:
+            raise RuntimeError(err)
+    return float(outputs[0][0].split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--steps", type=int, default=32)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--multi-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(run(args.replicas[0], args.multi_worker, args.batch_size, args.steps))
+        return
+    print("replicas | mirrored (samples/s) | multi-worker (samples/s)")
+    for replicas in args.replicas:
+        mirrored = launch(replicas, False, args)
+        multi_worker = launch(replicas, True, args)
+        print(f"{replicas:>8} | {mirrored:>20.0f} | {multi_worker:>24.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# By Marco Riggirello and Antoine Venturini
+""" Time of the outputs of an ensemble of `Diglm` models (the model of
+the HIGGS notebook), as a function of the ensemble size:
+
+- `eager loop`: `__call__` and `log_prob_parts` of each member, in a
+  Python loop, as in the notebooks;
+- `compiled loop`: a single `tf.function` looping over the members, each
+  running its flow once for the glm and the features log probability;
+- `ensemble`: `ensemble.DiglmEnsemble`, the stacked weights of all the
+  members evaluated together.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_ensemble
+"""
+import argparse
+import time
+
+import tensorflow as tf
+
+from src.ensemble import DiglmEnsemble
+from benchmarks.bench_trainer import make_model
+
+
+def timed(fn, repeats):
+    fn()  # tracing
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 5, 10])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--jit-compile", action="store_true")
+    args = parser.parse_args()
+
+    features = tf.random.normal([args.batch_size, args.num_features])
+    labels = tf.zeros([args.batch_size, 1])
+    members = [make_model(args.num_features) for _ in range(max(args.sizes))]
+
+    def member_outputs(model):
+        latents, ildj = model.latent_features_and_log_det_jacobian(features)
+        mean, variance, _ = model.glm(model.eta_from_latents(latents))
+        return mean, variance, model.features_log_prob_from_latents(latents, ildj)
+
+    print(f"{'members':>7} | {'eager loop ms':>13} | {'compiled loop ms':>16} | "
+          f"{'ensemble ms':>11} | speedup")
+    for size in args.sizes:
+        models = members[:size]
+        eager_ms = timed(lambda: [(model(features),
+                                   model.log_prob_parts({"features": features, "labels": labels}))
+                                  for model in models], max(args.repeats // 4, 1))
+        loop = tf.function(lambda: [member_outputs(model) for model in models],
+                           jit_compile=args.jit_compile)
+        loop_ms = timed(loop, args.repeats)
+        ensemble = DiglmEnsemble(models, jit_compile=args.jit_compile)
+        ensemble_ms = timed(lambda: ensemble(features), args.repeats)
+        print(f"{size:>7} | {eager_ms:>13.1f} | {loop_ms:>16.1f} | {ensemble_ms:>11.1f} | "
+              f"{loop_ms / ensemble_ms:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
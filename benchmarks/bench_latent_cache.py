@@ -0,0 +1,60 @@
+# By Marco Riggirello and Antoine Venturini
+""" Refit of the glm head of a `Diglm` with the flow frozen: head-only
+`DiglmTrainer` epochs over the features (the flow runs at every step)
+against epochs over the latents cached by `data.cache_latents`, on
+synthetic data. The one-off cost of writing the cache is reported too.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_latent_cache
+"""
+import argparse
+import tempfile
+import time
+
+import tensorflow as tf
+
+from src import data
+from src.trainer import DiglmTrainer
+from benchmarks.bench_trainer import make_model, make_data
+
+
+def epoch_time(trainer, dataset, epochs):
+    trainer.fit(dataset.take(1), verbose=False)  # tracing
+    start = time.perf_counter()
+    trainer.fit(dataset, epochs=epochs, eval_every=10**9, verbose=False)
+    return (time.perf_counter() - start) / epochs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2**17)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--epochs", type=int, default=3)
+    args = parser.parse_args()
+
+    d = make_model(args.num_features)
+    weight = 1. / args.num_features
+    train = make_data(args.rows, args.num_features)
+    dataset = tf.data.Dataset.from_tensor_slices(train).batch(args.batch_size, drop_remainder=True)
+
+    trainer = DiglmTrainer(d, tf.keras.optimizers.Adam(1e-2), scaling_const=weight,
+                           steps_per_execution=16, head_only=True)
+    features_time = epoch_time(trainer, dataset, args.epochs)
+    print(f"head refit on features: {features_time:.2f} s/epoch")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        shard_dir = data.cache_latents(d, dataset, cache_dir)
+        print(f"writing the latents cache: {time.perf_counter() - start:.2f} s")
+        cached = data.shards_dataset(shard_dir, args.batch_size, seed=0)
+        trainer = DiglmTrainer(d, tf.keras.optimizers.Adam(1e-2), scaling_const=weight,
+                               steps_per_execution=16, head_only=True)
+        cache_time = epoch_time(trainer, cached, args.epochs)
+        print(f"head refit on cached latents: {cache_time:.2f} s/epoch "
+              f"({features_time / cache_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
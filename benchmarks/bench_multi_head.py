@@ -0,0 +1,66 @@
+# By Marco Riggirello and Antoine Venturini
+""" Cost of a training step (loss and gradients) of a multi-head `Diglm`
+against one single head model per target, which runs the flow once per
+target. All the models share the flow of the HIGGS notebook.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_multi_head
+"""
+import argparse
+import time
+
+import tensorflow as tf
+from tensorflow_probability.python.glm import Bernoulli, Poisson
+
+from src.diglm import Diglm
+from benchmarks.bench_trainer import make_model
+
+
+def step_time(loss_fn, variables, repeats):
+    @tf.function
+    def step():
+        with tf.GradientTape() as tape:
+            loss = loss_fn()
+        return tape.gradient(loss, variables)
+    step()  # tracing
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    return (time.perf_counter() - start) / repeats * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--heads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    flow = make_model(args.num_features).bijector
+    features = tf.random.normal([args.batch_size, args.num_features])
+    print("heads | multi-head (ms/step) | separate models (ms/step)")
+    for num_heads in args.heads:
+        glms = {f"head_{i}": Bernoulli() if i % 2 == 0 else Poisson() for i in range(num_heads)}
+        labels = {name: tf.cast(features[:, i % args.num_features:][:, :1] > 0, tf.float32)
+                  for i, name in enumerate(glms)}
+
+        multi = Diglm(flow, glms, args.num_features)
+        value = {"features": features, "labels": labels}
+        multi_ms = step_time(lambda: -tf.reduce_mean(multi.weighted_log_prob(value)),
+                             multi.trainable_variables, args.repeats)
+
+        singles = {name: Diglm(flow, glm, args.num_features) for name, glm in glms.items()}
+        variables = [v for model in singles.values() for v in model.head_variables]
+        variables += flow.trainable_variables
+        separate_ms = step_time(
+            lambda: -tf.add_n([tf.reduce_mean(model.weighted_log_prob(
+                {"features": features, "labels": labels[name]}))
+                               for name, model in singles.items()]),
+            variables, args.repeats)
+        print(f"{num_heads:>5} | {multi_ms:>20.1f} | {separate_ms:>25.1f}")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,88 @@
+# By Marco Riggirello and Antoine Venturini
+""" Soak test of `online.OnlineTrainer`: a long stream of batches, with
+the update latency (median and 95th percentile, head only and flow
+updates) and the resident memory reported for consecutive windows of
+updates. Both should stay flat while the stream grows, as opposed to
+retraining from scratch on the whole history.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_online
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from src.config import DiglmConfig
+from src.online import OnlineTrainer
+
+
+def stream(batch_size, num_features, seed=0):
+    """ Unbounded stream of events, slowly drifting. """
+    rng = np.random.default_rng(seed)
+    step = 0
+    while True:
+        features = rng.normal(size=(batch_size, num_features)).astype(np.float32)
+        features[:, 1] += features[:, 0]**2 + np.sin(step / 1000)
+        labels = (features[:, :1] + features[:, 2:3] > 0).astype(np.int32)
+        step += 1
+        yield {"features": features, "labels": labels}
+
+
+def rss():
+    """ Resident memory (MB). """
+    with open("/proc/self/statm", encoding="utf-8") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--replay-size", type=int, default=256)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--window", type=int, default=2000)
+    parser.add_argument("--flow-every", type=int, default=10)
+    parser.add_argument("--checkpoint-every", type=int, default=500)
+    args = parser.parse_args()
+
+    config = DiglmConfig(args.num_features, masks=[-3, -2, -1, 1, 2, 3],
+                         spline_params=dict(nbins=16, hidden_layers=[32, 32]))
+    path = os.path.join(tempfile.mkdtemp(prefix="diglm_online_"), "online.diglm")
+    trainer = OnlineTrainer(config.build(), tf.keras.optimizers.Adam(1e-3),
+                            replay_size=args.replay_size, flow_every=args.flow_every,
+                            checkpoint_path=path, checkpoint_every=args.checkpoint_every,
+                            config=config, seed=0)
+    times = {True: [], False: []}
+    losses = []
+
+    def callback(update, loss, seconds):
+        # `update` counts from 1: the flow was updated if `update - 1` is a multiple
+        times[(update - 1) % args.flow_every == 0].append(seconds)
+        losses.append(loss)
+
+    print(f"{'updates':>7} | {'events':>9} | {'head p50 ms':>11} | {'head p95 ms':>11} | "
+          f"{'flow p50 ms':>11} | {'flow p95 ms':>11} | {'RSS MB':>6} | loss")
+    events = stream(args.batch_size, args.num_features)
+    start = time.perf_counter()
+    for _ in range(args.updates // args.window):
+        for key in times:
+            times[key].clear()
+        losses.clear()
+        trainer.fit_stream(events, max_updates=args.window, callback=callback)
+        head, flow = (np.asarray(times[key]) * 1e3 for key in (False, True))
+        print(f"{trainer.updates:>7} | {trainer.buffer.seen:>9} | "
+              f"{np.median(head):>11.2f} | {np.percentile(head, 95):>11.2f} | "
+              f"{np.median(flow):>11.2f} | {np.percentile(flow, 95):>11.2f} | "
+              f"{rss():>6.0f} | {np.mean(losses):.4f}")
+    print(f"{time.perf_counter() - start:.0f} s, "
+          f"{trainer.updates // args.checkpoint_every} checkpoints")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# By Marco Riggirello and Antoine Venturini
+""" Accuracy, latency and memory of the `NeuralSplineFlow` precisions
+(`SplineBlock.PRECISIONS`) for `Diglm` inference: drift of the features
+log probability and of the predicted mean with respect to float32, time
+of a compiled batch, bytes of the flow variables, anonymous resident
+memory of the loaded model, and sizes of its checkpoint and of the
+SavedModel exported by `serving.InferenceEngine`.
+
+A checkpoint is saved for each precision, then each precision runs in its
+own process, which loads its checkpoint and measures the rest.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_precision
+"""
+import argparse
+import ctypes
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from src import checkpoint
+from src.config import DiglmConfig
+from src.serving import InferenceEngine
+from src.spqr import SplineBlock
+
+
+def rss_anon():
+    """ Anonymous resident memory (MB), after returning the freed heap memory
+    to the system: memory-mapped files are not counted.
+    """
+    gc.collect()
+    ctypes.CDLL("libc.so.6").malloc_trim(0)
+    with open("/proc/self/status", encoding="utf-8") as status:
+        for line in status:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def size(path):
+    """ Size (MB) of a file or of a directory. """
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 2**20
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names) / 2**20
+
+
+def worker(precision, workdir, repeats):
+    """ Measures a precision, prints a JSON line and saves the outputs. """
+    features = np.load(os.path.join(workdir, "features.npy"))
+    tf.zeros([1]).numpy()  # runtime initialization
+    before = rss_anon()
+    path = os.path.join(workdir, precision)
+    model = checkpoint.load(path + ".diglm")
+    assert model.bijector.precision == precision
+    resident = rss_anon() - before
+    weights = sum(v.numpy().nbytes for v in model.bijector.variables) / 2**20
+    engine = InferenceEngine(model, buckets=(len(features),))
+    engine.export(path + "_savedmodel", serving_default=False)
+    outputs = engine.predict(features)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        engine.predict(features)
+    elapsed = (time.perf_counter() - start) / repeats * 1e3
+    np.savez(path + ".npz", log_prob=outputs["features_log_prob"], mean=outputs["mean"])
+    print(json.dumps(dict(ms=elapsed, weights=weights, resident=resident,
+                          checkpoint=size(path + ".diglm"),
+                          savedmodel=size(path + "_savedmodel"))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--hidden-layers", type=int, nargs="+", default=[512, 512])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--worker", choices=SplineBlock.PRECISIONS, default=None,
+                        help="measure a single precision (in this process)")
+    parser.add_argument("--workdir", default=None)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        worker(args.worker, args.workdir, args.repeats)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="diglm_precision_")
+    config = DiglmConfig(args.num_features, masks=[-5,-4,-3,-2,-1,1,2,3,4,5],
+                         spline_params=dict(nbins=32, hidden_layers=args.hidden_layers))
+    tf.random.set_seed(0)
+    model = config.build()
+    np.save(os.path.join(workdir, "features.npy"),
+            model.sample(args.batch_size, seed=0)["features"].numpy())
+    # int8 is the last one: its float32 kernels are released
+    for precision in SplineBlock.PRECISIONS:
+        model.set_precision(precision)
+        checkpoint.save(os.path.join(workdir, precision + ".diglm"), model, config)
+
+    print(f"{'precision':>9} | {'max |dlog_prob|':>15} | {'mean |dlog_prob|':>16} | "
+          f"{'max |dmean|':>11} | {'ms/batch':>8} | {'weights MB':>10} | {'resident MB':>11} | "
+          f"{'checkpoint MB':>13} | SavedModel MB")
+    reference = None
+    for precision in SplineBlock.PRECISIONS:
+        result = subprocess.run([sys.executable, "-m", "benchmarks.bench_precision",
+                                 "--worker", precision, "--workdir", workdir,
+                                 "--repeats", str(args.repeats)],
+                                check=True, capture_output=True, text=True)
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        outputs = np.load(os.path.join(workdir, precision + ".npz"))
+        if reference is None:
+            reference = outputs["log_prob"], outputs["mean"]
+        drift = np.abs(outputs["log_prob"] - reference[0])
+        mean_drift = np.abs(outputs["mean"] - reference[1]).max()
+        print(f"{precision:>9} | {drift.max():>15.2e} | {drift.mean():>16.2e} | "
+              f"{mean_drift:>11.2e} | {stats['ms']:>8.1f} | {stats['weights']:>10.2f} | "
+              f"{stats['resident']:>11.1f} | {stats['checkpoint']:>13.2f} | "
+              f"{stats['savedmodel']:.2f}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# By Marco Riggirello and Antoine Venturini
+""" Per-stage time of the `Diglm.weighted_log_prob` training step (forward
+and backward) of the HIGGS notebook model, from `profiling.profile_steps`,
+and overhead of the `profiling.StageProfiler` hook: step time unwrapped,
+wrapped but not profiled, and profiled.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_profiling
+"""
+import argparse
+import timeit
+
+import tensorflow as tf
+
+from src.profiling import StageProfiler, profile_steps
+from benchmarks.bench_trainer import make_model, make_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=4)
+    args = parser.parse_args()
+
+    d = make_model(args.num_features)
+    batch = make_data(args.batch_size, args.num_features)
+
+    @tf.function
+    def step(batch):
+        with tf.GradientTape() as tape:
+            loss = -tf.reduce_mean(d.weighted_log_prob(batch))
+        return tape.gradient(loss, d.trainable_variables)
+
+    print(profile_steps(step, batch, depth=args.depth).table())
+
+    functions = {"unwrapped step": step,
+                 "wrapped step, not profiled": StageProfiler(every=10**9).wrap(step),
+                 "profiled step": StageProfiler(every=1).wrap(step)}
+    best = dict.fromkeys(functions, float("inf"))
+    # interleaved rounds, the timings on a shared machine drift
+    for _ in range(args.rounds):
+        for name, function in functions.items():
+            best[name] = min([best[name]] + timeit.repeat(
+                lambda: tf.nest.map_structure(lambda t: t.numpy(), function(batch)),
+                number=1, repeat=args.repeats))
+    for name, seconds in best.items():
+        print(f"{name}: {seconds * 1e3:.2f} ms")
+
+if __name__ == "__main__":
+    main()
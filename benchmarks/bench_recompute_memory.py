@@ -0,0 +1,69 @@
+# By Marco Riggirello and Antoine Venturini
+""" Peak training memory of `NeuralSplineFlow` versus the number of
+coupling layers, with and without `recompute_grad`.
+
+Each configuration runs in a fresh process and reports the growth of
+the peak resident set size caused by the gradient steps.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_recompute_memory
+"""
+import argparse
+import multiprocessing
+import resource
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(num_layers, recompute, batch_size, num_features, queue):
+    # pylint: disable=import-outside-toplevel
+    import tensorflow as tf
+    from src.spqr import NeuralSplineFlow
+
+    masks = [(-1)**i * (num_features // 2) for i in range(num_layers)]
+    nsf = NeuralSplineFlow(masks=masks, recompute_grad=recompute,
+                           spline_params=dict(nbins=32))
+    x = tf.random.normal([batch_size, num_features])
+
+    @tf.function
+    def step(x):
+        with tf.GradientTape() as tape:
+            z, ildj = nsf.inverse_and_log_det_jacobian(x)
+            loss = tf.reduce_mean(tf.reduce_sum(z**2, axis=-1) / 2 - ildj)
+        return tape.gradient(loss, nsf.trainable_variables)
+
+    nsf.inverse_and_log_det_jacobian(x)
+    step.get_concrete_function(x)
+    before = _peak_rss_mb()
+    for _ in range(3):
+        step(x)
+    queue.put(_peak_rss_mb() - before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=8192)
+    parser.add_argument("--num-features", type=int, default=8)
+    parser.add_argument("--layers", type=int, nargs="+", default=[2, 5, 10, 20])
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    print("layers | standard (MB) | recompute (MB)")
+    for num_layers in args.layers:
+        row = []
+        for recompute in (False, True):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_measure,
+                               args=(num_layers, recompute, args.batch_size,
+                                     args.num_features, queue))
+            proc.start()
+            row.append(queue.get())
+            proc.join()
+        print(f"{num_layers:>6} | {row[0]:>13.0f} | {row[1]:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# By Marco Riggirello and Antoine Venturini
+""" Sampling throughput of `data.sample_to_shards` for several chunk sizes
+and numbers of worker threads, against the `sample_to_pandas` function of
+the HIGGS notebook (one eager `Diglm.sample` call converted to a DataFrame).
+The times of `sample_to_shards` include the tracing of the sampling function.
+The notebook function samples fewer events: with 2**20 of them it runs
+out of memory on a 6 GB machine.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_sample
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src import data
+from benchmarks.bench_trainer import make_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-samples", type=int, default=2**20)
+    parser.add_argument("--pandas-samples", type=int, default=2**18)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--chunk-sizes", type=int, nargs="+",
+                        default=[2**12, 2**14, 2**16])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    args = parser.parse_args()
+
+    d = make_model(args.num_features)
+
+    start = time.perf_counter()
+    sam = d.sample(args.pandas_samples)
+    dts = np.concatenate((sam['features'].numpy(),
+                          sam['labels'].numpy().astype('float32')), axis=1)
+    pd.DataFrame(dts)
+    print(f"sample_to_pandas: {args.pandas_samples / (time.perf_counter() - start):.0f} samples/s")
+
+    print("chunk size | workers | samples/s")
+    for chunk_size in args.chunk_sizes:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as shard_dir:
+                start = time.perf_counter()
+                data.sample_to_shards(d, args.num_samples, shard_dir, chunk_size=chunk_size,
+                                      shard_chunks=max(2**18 // chunk_size, 1),
+                                      num_workers=workers)
+                rate = args.num_samples / (time.perf_counter() - start)
+            print(f"{chunk_size:>10} | {workers:>7} | {rate:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,56 @@
+# By Marco Riggirello and Antoine Venturini
+""" Throughput of `Diglm.score_stream` against the notebook way of scoring
+events (eager `log_prob_parts` and `__call__` on each batch, keeping all the
+scores in memory), on synthetic data. The thresholds are calibrated on
+reference events with the streaming `QuantileSketch`, whose size is
+reported against the exact quantile.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_score_stream
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.bench_trainer import make_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--batches", type=int, default=32)
+    parser.add_argument("--num-features", type=int, default=7)
+    args = parser.parse_args()
+
+    d = make_model(args.num_features)
+    batches = [tf.random.normal([args.batch_size, args.num_features], seed=i)
+               for i in range(args.batches)]
+    labels = tf.zeros([args.batch_size, 1], tf.int32)
+    events = args.batch_size * args.batches
+
+    start = time.perf_counter()
+    log_probs, means = [], []
+    for features in batches:
+        log_probs.append(d.log_prob_parts({"features": features, "labels": labels})["features"])
+        means.append(d(features)[0])
+    threshold = np.quantile(np.concatenate(log_probs), .01)
+    print(f"notebook (eager, in memory): {events / (time.perf_counter() - start):.0f} events/s")
+
+    sketch = d.ood_sketch(batches[:1])  # tracing
+    start = time.perf_counter()
+    sketch = d.ood_sketch(batches)
+    print(f"ood_sketch: {events / (time.perf_counter() - start):.0f} events/s, "
+          f"{sum(len(level) for level in sketch._levels)} values kept for {sketch.count} events, "
+          f"1% quantile {sketch.quantile(.01):.3f} (exact {threshold:.3f})")
+
+    start = time.perf_counter()
+    flagged = sum(scores["ood"].sum() for scores in d.score_stream(batches, threshold=threshold))
+    print(f"score_stream: {events / (time.perf_counter() - start):.0f} events/s, "
+          f"{flagged / events:.2%} flagged")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
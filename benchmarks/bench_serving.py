@@ -0,0 +1,80 @@
+# By Marco Riggirello and Antoine Venturini
+""" Latency and throughput of single-event requests served by
+`serving.InferenceEngine`, for several micro-batch deadlines, against
+eager per-request calls of the model. A closed-loop load generator runs
+`--clients` threads, each sending a new request as soon as the previous
+one is answered.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_serving
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from src.serving import InferenceEngine
+from benchmarks.bench_trainer import make_model
+
+
+def load(request, events, clients, duration):
+    """ Runs the load generator and returns the latencies (ms) and the requests/s. """
+    latencies = [[] for _ in range(clients)]
+    stop = time.perf_counter() + duration
+
+    def client(index):
+        rng = np.random.default_rng(index)
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            request(events[rng.integers(len(events))])
+            latencies[index].append((time.perf_counter() - start) * 1e3)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = np.concatenate(latencies)
+    return latencies, len(latencies) / elapsed
+
+
+def report(name, latencies, throughput):
+    print(f"{name:>16} | {np.percentile(latencies, 50):>8.2f} | "
+          f"{np.percentile(latencies, 99):>8.2f} | {throughput:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.)
+    parser.add_argument("--max-wait-ms", type=float, nargs="+", default=[0., 1., 2., 5., 10.])
+    args = parser.parse_args()
+
+    d = make_model(args.num_features)
+    events = np.random.default_rng(0).normal(size=(4096, args.num_features)).astype(np.float32)
+
+    print("         serving | p50 (ms) | p99 (ms) | requests/s")
+
+    def eager(event):
+        features = event[None]
+        latents, ildj = d.latent_features_and_log_det_jacobian(features)
+        return d(features), d.features_log_prob_from_latents(latents, ildj)
+    eager(events[0])
+    report("eager", *load(eager, events, args.clients, args.duration))
+
+    for max_wait in args.max_wait_ms:
+        engine = InferenceEngine(d, max_wait=max_wait / 1e3)
+        engine.warmup()
+        with engine:
+            latencies, throughput = load(lambda event: engine.submit(event).result(),
+                                         events, args.clients, args.duration)
+        report(f"max_wait {max_wait:g} ms", latencies, throughput)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
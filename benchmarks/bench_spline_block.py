@@ -0,0 +1,85 @@
+# By Marco Riggirello and Antoine Venturini
+""" Forward+backward throughput of `SplineBlock` (single fused
+parameters layer) against the former block with three dense heads
+and per-call `Activation` layers.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_spline_block
+"""
+import argparse
+import timeit
+
+import tensorflow as tf
+from tensorflow.python.keras.layers import Activation, Dense
+from tensorflow.python.keras.activations import softmax, softplus
+
+from src.spqr import SplineBlock, fuse_spline_block_weights
+
+
+class ThreeHeadsSplineBlock(SplineBlock):
+    """ The previous `SplineBlock` layout, kept as reference.
+    """
+    def __init__(self, nunits, nbins, border, **kwargs):
+        super().__init__(nunits, nbins, border, **kwargs)
+        self._widths_layer = Dense(self._nunits * self._nbins, name="widths_layer")
+        self._heights_layer = Dense(self._nunits * self._nbins, name="heights_layer")
+        self._slopes_layer = Dense(self._nunits * self._nslopes, name="slopes_layer")
+
+    def call(self, units):
+        for layer in self._hidden_layers:
+            units = layer(units)
+        bin_scale = 2 * self._border - self._nbins * self._min_bin_gap
+        widths = tf.reshape(self._widths_layer(units), [-1, self._nunits, self._nbins])
+        widths = Activation(softmax)(widths) * bin_scale - self._min_bin_gap
+        heights = tf.reshape(self._heights_layer(units), [-1, self._nunits, self._nbins])
+        heights = Activation(softmax)(heights) * bin_scale - self._min_bin_gap
+        slopes = tf.reshape(self._slopes_layer(units), [-1, self._nunits, self._nslopes])
+        slopes = Activation(softplus)(slopes) + self._min_slope
+        return widths, heights, slopes
+
+    def get_weights(self):
+        weights = [w for layer in self._hidden_layers for w in layer.get_weights()]
+        for layer in (self._widths_layer, self._heights_layer, self._slopes_layer):
+            weights += layer.get_weights()
+        return weights
+
+
+def make_step(block, eager):
+    """ Forward and backward pass through the block.
+    """
+    def step(x):
+        with tf.GradientTape() as tape:
+            loss = sum(tf.reduce_sum(p) for p in block(x))
+        return tape.gradient(loss, block.trainable_variables)
+    return step if eager else tf.function(step)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--nunits", type=int, default=4)
+    parser.add_argument("--nbins", type=int, default=128)
+    parser.add_argument("--hidden-layers", type=int, nargs="+", default=[512, 512])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--eager", action="store_true")
+    args = parser.parse_args()
+
+    x = tf.random.normal([args.batch_size, args.nunits])
+    reference = ThreeHeadsSplineBlock(args.nunits, args.nbins, 4, hidden_layers=args.hidden_layers)
+    fused = SplineBlock(args.nunits, args.nbins, 4, hidden_layers=args.hidden_layers)
+    reference(x)
+    fused(x)
+    fused.set_weights(fuse_spline_block_weights(reference.get_weights()))
+    drift = max(float(tf.reduce_max(tf.abs(a - b))) for a, b in zip(reference(x), fused(x)))
+    print(f"max parameter difference: {drift:.2e}")
+
+    for name, block in [("fused", fused), ("three_heads", reference)]:
+        step = make_step(block, args.eager)
+        step(x)
+        best = min(timeit.repeat(lambda: step(x), number=1, repeat=args.repeats))
+        print(f"{name:>12}: {best * 1e3:.2f} ms/step, {args.batch_size / best:.0f} samples/s")
+
+
+if __name__ == "__main__":
+    main()
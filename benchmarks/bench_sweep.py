@@ -0,0 +1,71 @@
+# By Marco Riggirello and Antoine Venturini
+""" Throughput of `sweep.SweepRunner`: configurations completed per hour
+on the cores of this machine, training all of them for `--max-steps`
+and with early stopping by successive halving from `--min-steps`, on
+synthetic data written once to memory-mapped shards.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_sweep
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from src.data import arrays_to_shards
+from src.sweep import SweepRunner, grid
+
+
+def make_shards(shard_dir, rows, num_features, seed):
+    rng = np.random.default_rng(seed)
+    features = rng.normal(size=(rows, num_features)).astype(np.float32)
+    features[:, 1] += features[:, 0]**2
+    labels = (features[:, :1] + features[:, 2:3] > 0).astype(np.int32)
+    arrays_to_shards({"features": features, "labels": labels}, shard_dir)
+    return shard_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--max-steps", type=int, default=1215)
+    parser.add_argument("--min-steps", type=int, default=135)
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="diglm_sweep_")
+    train_dir = make_shards(os.path.join(workdir, "train"), 2**17, args.num_features, 0)
+    validation_dir = make_shards(os.path.join(workdir, "validation"), 2**14, args.num_features, 1)
+    configs = grid(args.num_features,
+                   masks=[[-3, -2, -1, 1, 2, 3], [-5, -4, -3, -2, -1, 1, 2, 3, 4, 5]],
+                   nbins=[8, 32], hidden_layers=[[32, 32], [64, 64, 64]])
+
+    print(f"{len(configs)} configurations, cpu count {os.cpu_count()}")
+    print(f"{'early stopping':>14} | {'workers':>7} | {'trainings':>9} | {'steps':>6} | "
+          f"{'seconds':>7} | {'configs/hour':>12} | best val_loss")
+    for min_steps in (None, args.min_steps):
+        store = os.path.join(workdir, f"store_{min_steps}")
+        runner = SweepRunner(store, train_dir, validation_dir, workers=args.workers,
+                             threads_per_worker=args.threads_per_worker,
+                             batch_size=args.batch_size)
+        start = time.perf_counter()
+        results = runner.run(configs, args.max_steps, min_steps, eta=args.eta, verbose=False)
+        seconds = time.perf_counter() - start
+        trainings = runner.results()
+        steps = sum(result["steps"] for result in results)
+        print(f"{'yes' if min_steps else 'no':>14} | {runner.workers:>7} | {len(trainings):>9} | "
+              f"{steps:>6} | {seconds:>7.1f} | {len(configs) / seconds * 3600:>12.1f} | "
+              f"{results[0]['val_loss']:.4f}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
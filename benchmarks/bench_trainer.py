@@ -0,0 +1,94 @@
+# By Marco Riggirello and Antoine Venturini
+""" Training throughput of `DiglmTrainer` against the hand written loop
+of the HIGGS notebook (one `tf.function` call per batch, eager validation
+loss and accuracy after every step), on synthetic data.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_trainer
+"""
+import argparse
+import time
+
+import tensorflow as tf
+from tensorflow_probability.python.glm import Bernoulli
+
+from src.spqr import NeuralSplineFlow
+from src.diglm import Diglm
+from src.trainer import DiglmTrainer
+
+
+def make_model(num_features):
+    """ The model of the HIGGS notebook. """
+    nsf = NeuralSplineFlow(masks=[-5,-4,-3,-2,-1,1,2,3,4,5],
+                           spline_params=dict(nbins=32, hidden_layers=[64,64,64]))
+    return Diglm(nsf, Bernoulli(), num_features)
+
+
+def make_data(n, num_features):
+    features = tf.random.normal([n, num_features])
+    return {"features": features, "labels": tf.cast(features[:, :1] > 0, tf.int32)}
+
+
+def notebook_loop(d, dataset, val_dict, test_dict, weight):
+    """ The training loop of the HIGGS notebook. """
+    optimizer = tf.keras.optimizers.Adam(3e-4)
+
+    @tf.function
+    def train_step(target_sample):
+        with tf.GradientTape() as tape:
+            loss = -tf.reduce_mean(d.weighted_log_prob(target_sample, scaling_const=weight))
+        variables = tape.watched_variables()
+        gradients = tape.gradient(loss, variables)
+        optimizer.apply_gradients(zip(gradients, variables))
+        return loss
+
+    accuracy = tf.keras.metrics.BinaryAccuracy()
+    steps = 0
+    for batch in dataset:
+        train_step(batch)
+        -tf.reduce_mean(d.weighted_log_prob(val_dict, scaling_const=weight))
+        accuracy.reset_state()
+        accuracy.update_state(test_dict["labels"], d(test_dict["features"])[0])
+        accuracy.result().numpy()
+        steps += 1
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--steps", type=int, default=64)
+    parser.add_argument("--num-features", type=int, default=7)
+    parser.add_argument("--steps-per-execution", type=int, default=16)
+    parser.add_argument("--eval-every", type=int, default=32)
+    args = parser.parse_args()
+
+    weight = 1. / args.num_features
+    train = make_data(args.batch_size * args.steps, args.num_features)
+    dataset = tf.data.Dataset.from_tensor_slices(train).batch(args.batch_size, drop_remainder=True)
+    val_dict = make_data(args.batch_size, args.num_features)
+    test_dict = make_data(args.batch_size * 8, args.num_features)
+
+    d = make_model(args.num_features)
+    notebook_loop(d, dataset.take(1), val_dict, test_dict, weight)  # tracing
+    start = time.perf_counter()
+    steps = notebook_loop(d, dataset, val_dict, test_dict, weight)
+    print(f"notebook loop: {steps / (time.perf_counter() - start):.2f} steps/s")
+
+    for jit_compile in (False, True):
+        d = make_model(args.num_features)
+        trainer = DiglmTrainer(d, tf.keras.optimizers.Adam(3e-4), scaling_const=weight,
+                               steps_per_execution=args.steps_per_execution,
+                               jit_compile=jit_compile)
+        trainer.fit(dataset.take(args.steps_per_execution), validation_data=test_dict,
+                    eval_every=args.eval_every, verbose=False)  # tracing
+        start = time.perf_counter()
+        history = trainer.fit(dataset, validation_data=test_dict,
+                              eval_every=args.eval_every, verbose=False)
+        print(f"DiglmTrainer (jit_compile={jit_compile}): "
+              f"{history['step'][-1] / (time.perf_counter() - start):.2f} steps/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# By Marco Riggirello and Antoine Venturini
+""" Forward and inverse latency of the rational quadratic spline
+versus the number of bins: free bins (`RationalQuadraticSpline`)
+against uniform bins (`UniformRationalQuadraticSpline`) on the x side
+(fast forward, i.e. sampling) and on the y side (fast inverse, which
+`Diglm` runs for latents, log probabilities, training and serving).
+The inverse is timed together with its log-det-jacobian, as in
+`NeuralSplineFlow.inverse_and_log_det_jacobian`.
+
+Run from the repository root with::
+
+    python -m benchmarks.bench_uniform_spline
+"""
+import argparse
+import timeit
+
+import tensorflow as tf
+from tensorflow_probability.python.bijectors import RationalQuadraticSpline
+
+from src.spqr import UniformRationalQuadraticSpline
+
+SPLINES = ("free", "uniform x", "uniform y")
+
+
+def make_splines(nbins, batch_size, nunits, border=4.):
+    """ Free and uniform bins splines with the same random sizes and slopes.
+    """
+    heights = tf.nn.softmax(tf.random.normal([batch_size, nunits, nbins])) * 2 * border
+    widths = tf.nn.softmax(tf.random.normal([batch_size, nunits, nbins])) * 2 * border
+    slopes = tf.nn.softplus(tf.random.normal([batch_size, nunits, nbins - 1])) + 1e-3
+    return {
+        "free": lambda: RationalQuadraticSpline(widths, heights, slopes, range_min=-border),
+        "uniform x": lambda: UniformRationalQuadraticSpline(heights, slopes, range_min=-border,
+                                                            uniform_side="x"),
+        "uniform y": lambda: UniformRationalQuadraticSpline(widths, slopes, range_min=-border,
+                                                            uniform_side="y")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--nunits", type=int, default=4)
+    parser.add_argument("--nbins", type=int, nargs="+", default=[8, 32, 128, 512])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    x = tf.random.normal([args.batch_size, args.nunits]) * 2
+    print(f"{'nbins':>5} | {'direction':>9} | " + " | ".join(f"{name + ' ms':>11}" for name in SPLINES))
+    for nbins in args.nbins:
+        timings = {}
+        for name, make in make_splines(nbins, args.batch_size, args.nunits).items():
+            forward = tf.function(lambda x, make=make: make().forward(x))
+            inverse = tf.function(lambda y, make=make: (
+                make().inverse(y), make().inverse_log_det_jacobian(y, event_ndims=1)))
+            for direction, fn in (("forward", forward), ("inverse", inverse)):
+                fn(x)
+                timings[name, direction] = min(
+                    timeit.repeat(lambda fn=fn: fn(x), number=1, repeat=args.repeats)) * 1e3
+        for direction in ("forward", "inverse"):
+            print(f"{nbins:>5} | {direction:>9} | " +
+                  " | ".join(f"{timings[name, direction]:>11.3f}" for name in SPLINES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# By Marco Riggirello and Antoine Venturini
+""" Compares results of `benchmarks.suite` against a baseline and flags
+the regressions: cases whose time (median of the runs) grew by more than
+their tolerance. Exits with status 1 if any case regressed, so it can gate
+a TensorFlow/TFP upgrade or a change of the model code.
+
+The tolerance of a case is `--threshold`, or the one given for it with
+`--tolerance CASE=VALUE`, raised to the relative spread of its runs in
+either file: a change within the run-to-run noise is not flagged.
+
+Timings depend on the machine, so no baseline is stored in the repository:
+record one with `benchmarks.suite` at the reference revision, on the
+machine that runs the check. Run from the repository root with::
+
+    python -m benchmarks.suite --output baseline.json
+    # ... change the code or upgrade TensorFlow ...
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.compare baseline.json results.json
+"""
+import argparse
+import json
+import sys
+
+
+def key(result):
+    """ Identifies a result by its case and configuration. """
+    return result["case"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(baseline, results, threshold=.2, tolerances=None):
+    """ Returns `(case, params, baseline ms, new ms, ratio, tolerance, status)`
+    rows, with status `regression`, `improvement`, `ok`, `new` or `missing`.
+    `tolerances` maps case names to their relative tolerance, instead of
+    `threshold`.
+    """
+    tolerances = tolerances or {}
+    old = {key(result): result for result in baseline["results"]}
+    new = {key(result): result for result in results["results"]}
+    rows = []
+    for case, params in list(old) + [k for k in new if k not in old]:
+        before, after = old.get((case, params)), new.get((case, params))
+        if before is None or after is None:
+            rows.append((case, params, before and before["ms"], after and after["ms"], None, None,
+                         "new" if before is None else "missing"))
+            continue
+        tolerance = max(tolerances.get(case, threshold), before["spread"], after["spread"])
+        ratio = after["ms"] / before["ms"]
+        status = ("regression" if ratio > 1 + tolerance else
+                  "improvement" if ratio < 1 / (1 + tolerance) else "ok")
+        rows.append((case, params, before["ms"], after["ms"], ratio, tolerance, status))
+    return rows
+
+
+def parse_tolerance(value):
+    """ Parses a `CASE=VALUE` tolerance argument. """
+    case, _, tolerance = value.partition("=")
+    try:
+        return case, float(tolerance)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected CASE=VALUE, not {value}") from None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("results")
+    parser.add_argument("--threshold", type=float, default=.2)
+    parser.add_argument("--tolerance", type=parse_tolerance, action="append", default=[],
+                        metavar="CASE=VALUE", help="tolerance of a case, instead of the threshold")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    with open(args.results, encoding="utf-8") as file:
+        results = json.load(file)
+    for name in ("tensorflow", "tensorflow_probability", "cpu_count", "processor"):
+        before, after = baseline["environment"].get(name), results["environment"].get(name)
+        if before != after:
+            print(f"warning: {name} differs from the baseline ({before} -> {after})")
+    for name, data in (("baseline", baseline), ("results", results)):
+        if data["runs"] < 3:
+            print(f"warning: the {name} have {data['runs']} runs, too few to estimate the noise")
+
+    rows = compare(baseline, results, args.threshold, dict(args.tolerance))
+    print(f"{'case':>24} | {'baseline ms':>11} | {'new ms':>8} | {'ratio':>5} | "
+          f"{'tolerance':>9} | status | params")
+    for case, params, before, after, ratio, tolerance, status in rows:
+        before = "-" if before is None else f"{before:.2f}"
+        after = "-" if after is None else f"{after:.2f}"
+        ratio = "-" if ratio is None else f"{ratio:.2f}"
+        tolerance = "-" if tolerance is None else f"{tolerance:.0%}"
+        print(f"{case:>24} | {before:>11} | {after:>8} | {ratio:>5} | {tolerance:>9} | "
+              f"{status} | {params}")
+    regressions = sum(row[-1] == "regression" for row in rows)
+    print(f"{regressions} regressions over {len(rows)} cases")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
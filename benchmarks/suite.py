@@ -0,0 +1,156 @@
+# By Marco Riggirello and Antoine Venturini
+""" Benchmark suite of the flow, the glm head and the full `Diglm`
+pipeline, on CPU and synthetic data. For every configuration it times
+the compiled
+
+- `flow_forward` and `flow_inverse_and_log_det` (the fused inverse and
+  inverse log-det-jacobian used by `Diglm`) of the `NeuralSplineFlow`,
+- `weighted_log_prob_grad`: `Diglm.weighted_log_prob` forward and backward,
+- `call`: `Diglm.__call__`,
+- `sample`: `Diglm.sample`,
+
+and writes the results as JSON, to be compared against a baseline
+recorded on the same machine with `benchmarks.compare`.
+
+Every case is timed in `--runs` independent runs of `--repeats` calls,
+interleaved with the other cases so that a slow period of the machine is
+spread over all of them. A run keeps the minimum time of its calls; the
+result is the median of the runs, with their relative spread as an
+estimate of the noise.
+
+Configurations vary one parameter at a time around a base configuration
+(batch size 1024, 7 features, 32 bins, hidden layers 64,64,64 and the
+masks of the HIGGS notebook), on the values given on the command line.
+Masks are given by name: `notebook` (-5,...,-1,1,...,5, restricted to the
+number of features), `alternating` (two pairs of half masks) or `splitsN`
+(the `splits` argument of `NeuralSplineFlow`).
+
+Run from the repository root with::
+
+    python -m benchmarks.suite --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import timeit
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_probability as tfp
+from tensorflow_probability.python.glm import Bernoulli
+
+from src.spqr import NeuralSplineFlow
+from src.diglm import Diglm
+
+BASE = dict(batch_size=1024, num_features=7, nbins=32, hidden_layers="64,64,64", masks="notebook")
+
+CASES = ("flow_forward", "flow_inverse_and_log_det", "weighted_log_prob_grad", "call", "sample")
+
+
+def flow_arguments(masks, num_features):
+    """ `NeuralSplineFlow` arguments of a named masks configuration. """
+    if masks == "notebook":
+        return dict(masks=[m for m in range(-5, 6) if m != 0 and abs(m) < num_features])
+    if masks == "alternating":
+        return dict(masks=[num_features // 2, -(num_features // 2)] * 2)
+    if masks.startswith("splits"):
+        return dict(splits=int(masks[len("splits"):]))
+    raise ValueError(f"Unknown masks configuration {masks}.")
+
+
+def configurations(args):
+    """ The base configuration followed by the one-parameter variations. """
+    configs = [dict(BASE)]
+    for key in BASE:
+        for value in getattr(args, key):
+            config = dict(BASE, **{key: value})
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+
+def make_cases(config):
+    """ The compiled functions of every case, with their arguments. """
+    hidden_layers = [int(units) for units in config["hidden_layers"].split(",")]
+    nsf = NeuralSplineFlow(**flow_arguments(config["masks"], config["num_features"]),
+                           spline_params=dict(nbins=config["nbins"], hidden_layers=hidden_layers))
+    d = Diglm(nsf, Bernoulli(), config["num_features"])
+    features = tf.random.normal([config["batch_size"], config["num_features"]], seed=0)
+    value = {"features": features, "labels": tf.cast(features[:, :1] > 0, tf.int32)}
+
+    def weighted_log_prob_grad(value):
+        with tf.GradientTape() as tape:
+            loss = -tf.reduce_mean(d.weighted_log_prob(value))
+        return tape.gradient(loss, d.trainable_variables)
+
+    return {
+        "flow_forward": (tf.function(nsf.forward), features),
+        "flow_inverse_and_log_det": (tf.function(nsf.inverse_and_log_det_jacobian), features),
+        "weighted_log_prob_grad": (tf.function(weighted_log_prob_grad), value),
+        "call": (tf.function(d.__call__), features),
+        "sample": (tf.function(lambda seed: d.sample(config["batch_size"], seed=seed)),
+                   tf.constant([0, 0])),
+    }
+
+
+def run_case(function, argument, repeats):
+    """ Traces the function, then returns the minimum time (ms) of `repeats` calls. """
+    tf.nest.map_structure(lambda t: t.numpy(), function(argument))
+    times = timeit.repeat(lambda: tf.nest.map_structure(lambda t: t.numpy(), function(argument)),
+                          number=1, repeat=repeats)
+    return 1e3 * min(times)
+
+
+def environment():
+    """ Versions and machine the results were obtained with. """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(tensorflow=tf.__version__, tensorflow_probability=tfp.__version__,
+                python=platform.python_version(), machine=platform.machine(),
+                processor=platform.processor(), cpu_count=os.cpu_count(), commit=commit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, nargs="*", default=[256, 4096])
+    parser.add_argument("--num-features", dest="num_features", type=int, nargs="*", default=[4, 16])
+    parser.add_argument("--nbins", type=int, nargs="*", default=[8, 128])
+    parser.add_argument("--hidden-layers", dest="hidden_layers", nargs="*", default=["512,512"])
+    parser.add_argument("--masks", nargs="*", default=["alternating", "splits2"])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    configs = [(config, make_cases(config)) for config in configurations(args)]
+    runs_ms = {}
+    for run in range(args.runs):
+        for config, cases in configs:
+            for name in args.cases:
+                ms = run_case(*cases[name], args.repeats)
+                runs_ms.setdefault((name, json.dumps(config)), []).append(ms)
+                print(f"run {run + 1}/{args.runs} {name:>24} {json.dumps(config)}: {ms:.2f} ms")
+
+    results = []
+    for config, _ in configs:
+        for name in args.cases:
+            times = runs_ms[name, json.dumps(config)]
+            ms = float(np.median(times))
+            results.append(dict(case=name, params=config, ms=ms, runs_ms=times,
+                                spread=(max(times) - min(times)) / ms,
+                                events_per_s=config["batch_size"] / ms * 1e3))
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(dict(environment=environment(), repeats=args.repeats, runs=args.runs,
+                       results=results), file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+""" Module with a compact, versioned file format for Diglm models """
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"DIGLMCKP"
+FORMAT_VERSION = 1
+PARTS = ("flow", "head")
+_ALIGNMENT = 64
+# magic, format version and header length
+_PREAMBLE = struct.Struct("<8sIQ")
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _part_variables(model, part):
+    """ Variables of a part of the model: the variables of the bijector
+    (`flow`), including the int8 kernels of a quantized one, or the glm
+    coefficients and intercepts (`head`).
+    """
+    if part == "flow":
+        return list(model.bijector.variables)
+    if part == "head":
+        return list(model.head_variables)
+    raise ValueError(f"part must be one of {PARTS}, not {part}.")
+
+
+def save(path, model, config):
+    """ Saves a model in a single file: a JSON header with the format
+    version, the architecture and the index of the variables, followed by
+    the values of all the variables in one flat buffer, each aligned
+    to 64 bytes so that it can be memory-mapped.
+
+    :param path: Path of the file.
+    :type path: str or Path.like object
+    :param model: The model.
+    :type model: diglm.Diglm
+    :param config: Architecture of the model. The current precision of the
+        bijector (see `spqr.NeuralSplineFlow.set_precision`) is saved in its
+        `spline_params`, so that e.g. an int8 model is loaded as such.
+    :type config: config.DiglmConfig
+    """
+    config = config.to_dict()
+    precision = getattr(model.bijector, "precision", "float32")
+    if precision != config["spline_params"].get("precision", "float32"):
+        config["spline_params"] = dict(config["spline_params"], precision=precision)
+    variables, offset = [], 0
+    arrays = []
+    for part in PARTS:
+        for variable in _part_variables(model, part):
+            array = np.asarray(variable.numpy())
+            variables.append(dict(part=part, name=variable.name, shape=list(array.shape),
+                                  dtype=array.dtype.str, offset=offset))
+            arrays.append((offset, array))
+            offset = _align(offset + array.nbytes)
+    header = json.dumps(dict(version=FORMAT_VERSION, config=config,
+                             variables=variables, size=offset)).encode()
+    data_offset = _align(_PREAMBLE.size + len(header))
+    with open(path, "wb") as file:
+        file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        file.write(header)
+        for start, array in arrays:
+            file.seek(data_offset + start)
+            file.write(array.tobytes())
+        file.truncate(data_offset + offset)
+
+
+def read_header(path):
+    """ Reads the header of a file written by :func:`save`.
+
+    :param path: Path of the file.
+    :type path: str or Path.like object
+    :return: Header with the `version`, the `config` dictionary (see
+        `config.DiglmConfig.to_dict`), the index of the `variables`
+        and the `offset` of the buffer in the file.
+    :rtype: dict
+    :raises: ValueError
+    """
+    with open(path, "rb") as file:
+        magic, version, length = _PREAMBLE.unpack(file.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a Diglm checkpoint.")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {version}, "
+                             f"only versions up to {FORMAT_VERSION} can be read.")
+        header = json.loads(file.read(length))
+    header["offset"] = _align(_PREAMBLE.size + length)
+    return header
+
+
+def load(path, model=None, parts=PARTS):
+    """ Loads a model saved by :func:`save`. The file is memory-mapped and
+    each variable is assigned directly from its view of the buffer, with no
+    intermediate copy.
+
+    :param path: Path of the file.
+    :type path: str or Path.like object
+    :param model: Model whose variables are assigned, defaults to `None`: a new
+        model is built from the saved architecture.
+    :type model: diglm.Diglm, optional
+    :param parts: Parts of the model to load, `"flow"` (bijector) and/or
+        `"head"` (glm), defaults to both. E.g. `("flow",)` loads a pretrained
+        flow under a new glm head.
+    :type parts: tuple(str), optional
+    :return: The model.
+    :rtype: diglm.Diglm
+    :raises: ValueError
+    """
+    header = read_header(path)
+    if model is None:
+        # pylint: disable=import-outside-toplevel
+        from .config import DiglmConfig
+        model = DiglmConfig.from_dict(header["config"]).build()
+    buffer = np.memmap(path, dtype=np.uint8, mode="r", offset=header["offset"],
+                       shape=(header["size"],))
+    for part in parts:
+        entries = [entry for entry in header["variables"] if entry["part"] == part]
+        variables = _part_variables(model, part)
+        if len(entries) != len(variables):
+            raise ValueError(f"The {part} of the model has {len(variables)} variables, "
+                             f"{len(entries)} are saved in {path}.")
+        for entry, variable in zip(entries, variables):
+            dtype = np.dtype(entry["dtype"])
+            if list(variable.shape) != entry["shape"] or dtype != variable.dtype.as_numpy_dtype:
+                raise ValueError(f"Variable {variable.name} of shape {variable.shape} does not "
+                                 f"match the saved {entry['name']} of shape {entry['shape']}.")
+            size = dtype.itemsize * int(np.prod(entry["shape"]))
+            view = buffer[entry["offset"]:entry["offset"] + size].view(dtype)
+            variable.assign(view.reshape(entry["shape"]))
+    return model
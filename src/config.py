@@ -0,0 +1,124 @@
+""" Module with the architecture configuration of Diglm models.
+It does not import TensorFlow, which is loaded only to build the model.
+"""
+import json
+
+
+class DiglmConfig:
+    """ Architecture of a :class:`diglm.Diglm` with a
+    :class:`spqr.NeuralSplineFlow` bijector, as plain Python values:
+    it can be created, compared and serialized without loading
+    TensorFlow, e.g. by short-lived workers before deciding which
+    model to load.
+
+    :param num_features: Dimensions of features space.
+    :type num_features: int
+    :param glm: Name of the `tensorflow_probability.glm` family (e.g. `"Bernoulli"`),
+        or dictionary of the family names of named glm heads, defaults to `"Bernoulli"`.
+    :type glm: str or dict(str), optional
+    :param masks: Masks of the coupling layers, see :class:`spqr.NeuralSplineFlow`.
+    :type masks: list[int], optional
+    :param splits: Number of splits, alternative to `masks`.
+    :type splits: int, optional
+    :param spline_params: Parameters of `spqr.SplineInitializer`, defaults to `{}`.
+    :type spline_params: dict, optional
+    :param recompute_grad: See :class:`spqr.NeuralSplineFlow`, defaults to `False`.
+    :type recompute_grad: bool, optional
+    :param shared_conditioner: See :class:`spqr.NeuralSplineFlow`, defaults to `False`.
+    :type shared_conditioner: bool, optional
+    :param embedding_units: See :class:`spqr.NeuralSplineFlow`, defaults to `8`.
+    :type embedding_units: int, optional
+    :raises: ValueError
+    """
+    def __init__(self,
+                 num_features,
+                 glm="Bernoulli",
+                 masks=None,
+                 splits=None,
+                 spline_params=None,
+                 recompute_grad=False,
+                 shared_conditioner=False,
+                 embedding_units=8):
+        """ Constructor method.
+        """
+        if (masks is None) == (splits is None):
+            raise ValueError("You must specify `splits` OR `masks`, not both.")
+        self.num_features = int(num_features)
+        self.glm = dict(glm) if isinstance(glm, dict) else glm
+        self.masks = None if masks is None else [int(mask) for mask in masks]
+        self.splits = None if splits is None else int(splits)
+        self.spline_params = dict(spline_params or {})
+        self.recompute_grad = bool(recompute_grad)
+        self.shared_conditioner = bool(shared_conditioner)
+        self.embedding_units = int(embedding_units)
+
+    def to_dict(self):
+        """ The configuration as a dictionary of JSON serializable values.
+
+        :return: The configuration.
+        :rtype: dict
+        """
+        return dict(num_features=self.num_features, glm=self.glm, masks=self.masks,
+                    splits=self.splits, spline_params=self.spline_params,
+                    recompute_grad=self.recompute_grad,
+                    shared_conditioner=self.shared_conditioner,
+                    embedding_units=self.embedding_units)
+
+    @classmethod
+    def from_dict(cls, config):
+        """ Configuration from the dictionary returned by :meth:`to_dict`.
+
+        :param config: The dictionary.
+        :type config: dict
+        :return: The configuration.
+        :rtype: DiglmConfig
+        """
+        return cls(**config)
+
+    def to_json(self):
+        """ The configuration as a JSON string.
+
+        :rtype: str
+        """
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, string):
+        """ Configuration from the JSON string returned by :meth:`to_json`.
+
+        :param string: The JSON string.
+        :type string: str
+        :rtype: DiglmConfig
+        """
+        return cls.from_dict(json.loads(string))
+
+    def __eq__(self, other):
+        return isinstance(other, DiglmConfig) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        arguments = ", ".join(f"{key}={value!r}" for key, value in self.to_dict().items()
+                              if value is not None)
+        return f"DiglmConfig({arguments})"
+
+    def build(self):
+        """ Imports TensorFlow and creates the model, with all its variables.
+
+        :return: The model.
+        :rtype: diglm.Diglm
+        """
+        # pylint: disable=import-outside-toplevel
+        from tensorflow_probability.python import glm as glm_families
+        from .spqr import NeuralSplineFlow
+        from .diglm import Diglm
+        nsf = NeuralSplineFlow(splits=self.splits,
+                               masks=self.masks,
+                               spline_params=self.spline_params,
+                               recompute_grad=self.recompute_grad,
+                               shared_conditioner=self.shared_conditioner,
+                               embedding_units=self.embedding_units,
+                               num_features=self.num_features)
+        if isinstance(self.glm, dict):
+            glm = {name: getattr(glm_families, family)() for name, family in self.glm.items()}
+        else:
+            glm = getattr(glm_families, self.glm)()
+        return Diglm(nsf, glm, self.num_features)
@@ -0,0 +1,557 @@
+""" Module with out-of-core dataset utilities """
+import os
+import json
+import queue
+import shutil
+import hashlib
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+MANIFEST = 'manifest.json'
+
+
+def csv_to_shards(csv_path,
+                  shard_dir,
+                  label_column=0,
+                  feature_columns=None,
+                  shard_rows=2**20,
+                  chunk_rows=2**16):
+    """
+    Converts a (gzipped) CSV file, like the HIGGS dataset, into `.npy` shards
+    of float32 features and int32 labels. The CSV is read in chunks, so memory
+    usage does not depend on the file size. The conversion is done only once:
+    the `manifest.json` file describing the shards is written last and, if it
+    already exists, nothing is done.
+
+    :param csv_path: name of the CSV file (without header).
+    :type csv_path: str or Path.like object
+    :param shard_dir: directory where shards are written.
+    :type shard_dir: str or Path.like object
+    :param label_column: Optional (Default=0). Index of the labels column.
+    :type label_column: int
+    :param feature_columns: Optional (Default=None). Indices of the feature columns,
+        all the columns but the labels one if None.
+    :type feature_columns: list[int]
+    :param shard_rows: Optional (Default=2**20). Number of rows in each shard.
+    :type shard_rows: int
+    :param chunk_rows: Optional (Default=2**16). Number of rows parsed at a time.
+    :type chunk_rows: int
+    :return: The manifest of the shards.
+    :rtype: dict
+    """
+    manifest_path = os.path.join(shard_dir, MANIFEST)
+    if os.path.isfile(manifest_path):
+        logging.info('Shards in %s exist.', shard_dir)
+        with open(manifest_path, encoding='utf-8') as infile:
+            return json.load(infile)
+
+    writer = _ShardWriter(shard_dir, ('features', 'labels'), shard_rows)
+    reader = pd.read_csv(csv_path, header=None, dtype=np.float32,
+                         chunksize=chunk_rows, engine='c')
+    for chunk in reader:
+        if feature_columns is None:
+            feature_columns = [c for c in range(chunk.shape[1]) if c != label_column]
+        values = chunk.to_numpy()
+        writer.append(features=values[:, feature_columns],
+                      labels=values[:, [label_column]].astype(np.int32))
+    return writer.close(num_features=len(feature_columns),
+                        label_column=label_column,
+                        feature_columns=list(feature_columns))
+
+
+def arrays_to_shards(arrays, shard_dir, shard_rows=2**20):
+    """
+    Writes in-memory arrays, e.g. a dictionary of `features` and `labels`,
+    into `.npy` shards that can be memory-mapped (see :func:`open_shards`)
+    and read by :func:`shards_dataset`. As for :func:`csv_to_shards`,
+    nothing is done if the manifest already exists.
+
+    :param arrays: Dictionary of arrays with the same number of rows.
+    :type arrays: dict(numpy.ndarray)
+    :param shard_dir: directory where shards are written.
+    :type shard_dir: str or Path.like object
+    :param shard_rows: Optional (Default=2**20). Number of rows in each shard.
+    :type shard_rows: int
+    :return: The manifest of the shards.
+    :rtype: dict
+    """
+    manifest_path = os.path.join(shard_dir, MANIFEST)
+    if os.path.isfile(manifest_path):
+        logging.info('Shards in %s exist.', shard_dir)
+        return _read_manifest(shard_dir)
+
+    writer = _ShardWriter(shard_dir, tuple(arrays), shard_rows)
+    writer.append(**{column: np.asarray(array) for column, array in arrays.items()})
+    return writer.close()
+
+
+class _ShardWriter:
+    """ Writes rows of named arrays into `.npy` shards of `shard_rows` rows,
+    buffering at most one shard in memory. The manifest is written last, by
+    :meth:`close`.
+    """
+    def __init__(self, shard_dir, columns, shard_rows):
+        self._shard_dir = shard_dir
+        self._columns = tuple(columns)
+        self._shard_rows = shard_rows
+        self._buffers = {column: [] for column in self._columns}
+        self._buffered = 0
+        self._shards = []
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def append(self, **arrays):
+        """ Appends rows, given as one array for each column. """
+        rows = len(arrays[self._columns[0]])
+        start = 0
+        while start < rows:
+            take = min(rows - start, self._shard_rows - self._buffered)
+            for column in self._columns:
+                self._buffers[column].append(
+                    np.ascontiguousarray(arrays[column][start:start + take]))
+            start += take
+            self._buffered += take
+            if self._buffered == self._shard_rows:
+                self._write_shard()
+
+    def _write_shard(self):
+        index = len(self._shards)
+        shard = {'rows': self._buffered}
+        for column in self._columns:
+            shard[column] = f'{column}_{index:05d}.npy'
+            tmp = os.path.join(self._shard_dir, 'tmp_' + shard[column])
+            np.save(tmp, np.concatenate(self._buffers[column]))
+            os.replace(tmp, os.path.join(self._shard_dir, shard[column]))
+            self._buffers[column].clear()
+        self._shards.append(shard)
+        self._buffered = 0
+
+    def close(self, **info):
+        """ Writes the last shard and the manifest, with the additional `info`. """
+        if self._buffered:
+            self._write_shard()
+        manifest = {'num_rows': sum(shard['rows'] for shard in self._shards),
+                    'columns': list(self._columns),
+                    **info,
+                    'shards': self._shards}
+        manifest_path = os.path.join(self._shard_dir, MANIFEST)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as outfile:
+            json.dump(manifest, outfile, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        return manifest
+
+
+def _read_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST), encoding='utf-8') as infile:
+        manifest = json.load(infile)
+    manifest.setdefault('columns', ['features', 'labels'])
+    return manifest
+
+
+def open_shards(shard_dir):
+    """
+    Opens the shards written by :func:`csv_to_shards` (or :func:`cache_latents`)
+    as read-only memory maps.
+
+    :param shard_dir: directory containing the shards.
+    :type shard_dir: str or Path.like object
+    :return: List of (features, labels) memory mapped arrays, or of the arrays
+        of the `columns` listed in the manifest.
+    :rtype: list[tuple(numpy.memmap)]
+    """
+    manifest = _read_manifest(shard_dir)
+    return [tuple(np.load(os.path.join(shard_dir, shard[column]), mmap_mode='r')
+                  for column in manifest['columns'])
+            for shard in manifest['shards']]
+
+
+def shards_dataset(shard_dir,
+                   batch_size,
+                   shuffle_buffer=2**16,
+                   cycle_length=4,
+                   drop_remainder=True,
+                   seed=None):
+    """
+    `tf.data.Dataset` of batches read from the shards written by :func:`csv_to_shards`.
+
+    Shards are read by TensorFlow, without Python, in contiguous windows of `shuffle_buffer`
+    rows, interleaving `cycle_length` shards in parallel. The rows of each window are
+    shuffled and split in batches, the order of shards and batches is shuffled too. Each
+    element is a dictionary `{'features': float32 [batch_size, num_features], 'labels':
+    int32 [batch_size, 1]}`, as expected by `Diglm.weighted_log_prob`. Shards written by
+    :func:`cache_latents` give dictionaries of `latents`, `log_det_jacobian` and `labels`
+    instead.
+
+    .. note::
+        Batches never mix rows from different shards: with `drop_remainder`, the last
+        `rows % batch_size` rows of each shard are dropped.
+
+    :param shard_dir: directory containing the shards.
+    :type shard_dir: str or Path.like object
+    :param batch_size: Number of rows in each batch.
+    :type batch_size: int
+    :param shuffle_buffer: Optional (Default=2**16). Rows shuffled together,
+        no shuffling if 0.
+    :type shuffle_buffer: int
+    :param cycle_length: Optional (Default=4). Number of shards read in parallel.
+    :type cycle_length: int
+    :param drop_remainder: Optional (Default=True). Whether smaller batches are dropped.
+    :type drop_remainder: bool
+    :param seed: Optional (Default=None). Seed of the shuffling.
+    :type seed: int
+    :return: The dataset.
+    :rtype: tensorflow.data.Dataset
+    :raises: ValueError
+    """
+    columns = _read_manifest(shard_dir)['columns']
+    shards = open_shards(shard_dir)
+    if not shards:
+        raise ValueError(f'No shards in {shard_dir}.')
+    window = max(shuffle_buffer // batch_size, 1) * batch_size
+    dtypes = [tf.as_dtype(array.dtype) for array in shards[0]]
+    row_shapes = [list(array.shape[1:]) for array in shards[0]]
+    row_bytes = [array.itemsize * int(np.prod(array.shape[1:])) for array in shards[0]]
+    # each window is a fixed length record of the .npy files, after their header;
+    # the last rows of a shard are a shorter record, read separately
+    rows = [len(arrays[0]) for arrays in shards]
+    full_rows = [n - n % window for n in rows]
+    params = tf.data.Dataset.from_tensor_slices((
+        tf.range(len(shards), dtype=tf.int64),
+        tf.constant([[array.filename for array in arrays] for arrays in shards]),
+        tf.constant([[array.offset for array in arrays] for arrays in shards], dtype=tf.int64),
+        tf.constant(full_rows, dtype=tf.int64),
+        tf.constant([n - full for n, full in zip(rows, full_rows)], dtype=tf.int64)))
+    # one generator for each shard: the shards read in parallel never
+    # draw from a shared one, so the shuffling depends only on the seed
+    rngs = [np.random.default_rng(sequence)
+            for sequence in np.random.SeedSequence(seed).spawn(len(shards))]
+
+    def window_seeds(index):
+        # Python only draws the seed of each window, the rows are shuffled by TensorFlow
+        yield from rngs[index].integers(2**62, size=(-(-rows[index] // window), 2))
+
+    def read_column(path, offset, full, tail, column):
+        windows = tf.data.FixedLengthRecordDataset(
+            path, window * row_bytes[column], header_bytes=offset,
+            footer_bytes=tail * row_bytes[column])
+        # without tail rows the body of the file is empty, and no record is read
+        last = tf.data.FixedLengthRecordDataset(
+            path, tf.maximum(tail * row_bytes[column], 1),
+            header_bytes=offset + full * row_bytes[column])
+        return windows.concatenate(last).map(
+            lambda record: tf.reshape(tf.io.decode_raw(record, dtypes[column]),
+                                      [-1] + row_shapes[column]))
+
+    def split_batches(*arrays):
+        full = tf.shape(arrays[0])[0] // batch_size * batch_size
+        batches = tf.data.Dataset.from_tensor_slices(tuple(
+            tf.reshape(array[:full], [-1, batch_size] + shape)
+            for array, shape in zip(arrays, row_shapes)))
+        if drop_remainder:
+            return batches
+        remainder = tf.data.Dataset.from_tensors(tuple(array[full:] for array in arrays))
+        return batches.concatenate(remainder.filter(lambda *a: tf.shape(a[0])[0] > 0))
+
+    def shuffle_rows(arrays, window_seed):
+        order = tf.argsort(tf.random.stateless_uniform(tf.shape(arrays[0])[:1], window_seed))
+        return tuple(tf.gather(array, order) for array in arrays)
+
+    def shard_batches(index, paths, offsets, full, tail):
+        windows = tf.data.Dataset.zip(tuple(
+            read_column(paths[column], offsets[column], full, tail, column)
+            for column in range(len(columns))))
+        if shuffle_buffer:
+            seeds = tf.data.Dataset.from_generator(
+                window_seeds, args=(index,), output_signature=tf.TensorSpec([2], tf.int64))
+            windows = tf.data.Dataset.zip((windows, seeds)).map(shuffle_rows)
+        return windows.flat_map(split_batches)
+
+    dataset = params
+    if shuffle_buffer:
+        dataset = dataset.shuffle(len(shards), seed=seed)
+    dataset = dataset.interleave(shard_batches,
+                                 cycle_length=cycle_length,
+                                 num_parallel_calls=tf.data.AUTOTUNE,
+                                 deterministic=seed is not None)
+    if shuffle_buffer:
+        dataset = dataset.shuffle(max(shuffle_buffer // batch_size, 1) * cycle_length, seed=seed)
+    dataset = dataset.map(lambda *arrays: dict(zip(columns, arrays)),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def bijector_hash(bijector):
+    """
+    Hash of the class and of the variables (names, shapes and values) of a bijector,
+    which changes whenever its weights do. It also hashes other modules with
+    `variables`, e.g. a `Diglm` model.
+
+    :param bijector: The bijector, e.g. a :class:`spqr.NeuralSplineFlow`.
+    :type bijector: tensorflow_probability.bijectors.Bijector
+    :return: The first 16 hex digits of the sha256 digest.
+    :rtype: str
+    """
+    digest = hashlib.sha256(type(bijector).__name__.encode())
+    for variable in bijector.variables:
+        value = np.asarray(variable.numpy())
+        digest.update(f'{variable.name}{value.shape}{value.dtype}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _latents_cache_hash(shard_dir):
+    """ :func:`bijector_hash` of the cache written by :func:`cache_latents`
+    in `shard_dir`, None if it is not one. """
+    try:
+        return _read_manifest(shard_dir).get('bijector_hash')
+    except (OSError, ValueError):
+        return None
+
+
+def _dataset_fingerprint(dataset):
+    """ Hash of the cardinality and of the first batch of a dataset of dictionaries. """
+    digest = hashlib.sha256(str(int(dataset.cardinality())).encode())
+    for batch in dataset.take(1):
+        for name in sorted(batch):
+            value = np.ascontiguousarray(batch[name].numpy())
+            digest.update(f'{name}{value.shape}{value.dtype}'.encode())
+            digest.update(value.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def cache_latents(model,
+                  dataset,
+                  cache_dir,
+                  shard_rows=2**20,
+                  name=None):
+    """
+    Caches the latent features of a (frozen) flow, to refit or score only the glm
+    of a `Diglm` model. The features of each batch are transformed by the inverse
+    bijector, together with the inverse log-det-jacobian, and written to `.npy` shards
+    in the `cache_dir/<hash>-<dataset>` directory, where `<hash>` is the
+    :func:`bijector_hash` of the model bijector and `<dataset>` identifies the dataset,
+    so that e.g. the training and validation sets can share `cache_dir`.
+    If the shards for the current weights and dataset already exist nothing is done,
+    while caches of other weights are removed: only the subdirectories whose manifest
+    has a `bijector_hash`, other files in `cache_dir` are kept.
+
+    The shards are read by :func:`shards_dataset`, which yields dictionaries of
+    `latents`, `log_det_jacobian` and `labels` accepted by `Diglm.weighted_log_prob`
+    and by :class:`trainer.DiglmTrainer` with `head_only=True`.
+
+    .. note::
+        Without a `name`, the dataset is identified by its cardinality and its first
+        batch, so it must be read in the same order each time (e.g. not shuffled).
+
+    :param model: The model.
+    :type model: diglm.Diglm
+    :param dataset: Dataset of dictionaries of features and labels batches.
+    :type dataset: tensorflow.data.Dataset
+    :param cache_dir: directory of the caches.
+    :type cache_dir: str or Path.like object
+    :param shard_rows: Optional (Default=2**20). Number of rows in each shard.
+    :type shard_rows: int
+    :param name: Optional (Default=None). Name identifying the dataset, e.g. `'train'`,
+        a hash of its cardinality and first batch if None.
+    :type name: str
+    :return: The directory of the shards.
+    :rtype: str
+    """
+    key = bijector_hash(model.bijector)
+    if name is None:
+        dataset_key = _dataset_fingerprint(dataset)
+    else:
+        dataset_key = hashlib.sha256(str(name).encode()).hexdigest()[:16]
+    shard_dir = os.path.join(cache_dir, f'{key}-{dataset_key}')
+    if os.path.isfile(os.path.join(shard_dir, MANIFEST)):
+        logging.info('Latents cache %s exists.', shard_dir)
+        return shard_dir
+    if os.path.isdir(cache_dir):
+        for stale in os.listdir(cache_dir):
+            stale_dir = os.path.join(cache_dir, stale)
+            stale_key = _latents_cache_hash(stale_dir)
+            # only the caches written by this function, for other weights, are removed
+            if stale_key is not None and stale_key != key:
+                logging.info('Removing stale latents cache %s.', stale)
+                shutil.rmtree(stale_dir)
+
+    transform = tf.function(model.latent_features_and_log_det_jacobian)
+    writer = _ShardWriter(shard_dir, ('latents', 'log_det_jacobian', 'labels'), shard_rows)
+    for batch in dataset:
+        latents, log_det_jacobian = transform(batch['features'])
+        writer.append(latents=latents.numpy(),
+                      log_det_jacobian=log_det_jacobian.numpy(),
+                      labels=batch['labels'].numpy())
+    writer.close(num_features=model.num_features, bijector_hash=key, dataset=dataset_key)
+    return shard_dir
+
+
+def sample_to_shards(model,
+                     num_samples,
+                     shard_dir,
+                     chunk_size=2**16,
+                     shard_chunks=16,
+                     seed=0,
+                     num_workers=1,
+                     queue_size=4):
+    """
+    Samples features and labels from a `Diglm` model into `.npy` shards, with bounded
+    memory. Samples are drawn by a compiled function in chunks of `chunk_size` events,
+    chunk `i` with the stateless seed `(seed, i)`, so the result does not depend on
+    `num_workers` nor on interruptions. `num_workers` threads draw chunks concurrently
+    and put them in a queue of at most `queue_size` chunks. The chunks are written
+    from the queue straight into memory mapped shards of `shard_chunks` chunks.
+
+    A shard is renamed to its final name when it is complete. If the function
+    is interrupted and called again, the complete shards are kept and the
+    sampling resumes from the others. The sampling parameters and the
+    :func:`bijector_hash` of the model are written in `progress.json` before
+    sampling, and in the manifest, which is written last so that the shards can
+    be read by :func:`shards_dataset`. Resuming with other parameters or another
+    model raises an error, instead of mixing their samples. Multi-head labels
+    are written as `labels_<head>` columns.
+
+    :param model: The model.
+    :type model: diglm.Diglm
+    :param num_samples: Number of events.
+    :type num_samples: int
+    :param shard_dir: directory where shards are written.
+    :type shard_dir: str or Path.like object
+    :param chunk_size: Optional (Default=2**16). Number of events sampled at a time.
+    :type chunk_size: int
+    :param shard_chunks: Optional (Default=16). Number of chunks in each shard.
+    :type shard_chunks: int
+    :param seed: Optional (Default=0). Seed of the sampling.
+    :type seed: int
+    :param num_workers: Optional (Default=1). Number of threads sampling chunks.
+    :type num_workers: int
+    :param queue_size: Optional (Default=4). Maximum number of chunks waiting to be written.
+    :type queue_size: int
+    :return: The manifest of the shards.
+    :rtype: dict
+    :raises: ValueError
+    """
+    params = {'num_rows': num_samples,
+              'seed': seed,
+              'chunk_size': chunk_size,
+              'shard_chunks': shard_chunks,
+              'model_hash': bijector_hash(model)}
+
+    def check(path):
+        with open(path, encoding='utf-8') as infile:
+            written = json.load(infile)
+        mismatched = sorted(key for key, value in params.items() if written.get(key) != value)
+        if mismatched:
+            raise ValueError(f'The shards in {shard_dir} were sampled with other '
+                             f'{", ".join(mismatched)}.')
+        return written
+
+    manifest_path = os.path.join(shard_dir, MANIFEST)
+    if os.path.isfile(manifest_path):
+        logging.info('Shards in %s exist.', shard_dir)
+        return check(manifest_path)
+    os.makedirs(shard_dir, exist_ok=True)
+    progress_path = os.path.join(shard_dir, 'progress.json')
+    # without a progress file, shards left in the directory are not trusted
+    resume = os.path.isfile(progress_path)
+    if resume:
+        check(progress_path)
+    else:
+        with open(progress_path, 'w', encoding='utf-8') as outfile:
+            json.dump(params, outfile, indent=1)
+
+    def flatten(value):
+        labels = value['labels']
+        if isinstance(labels, dict):
+            return {'features': value['features'],
+                    **{f'labels_{name}': head for name, head in labels.items()}}
+        return {'features': value['features'], 'labels': labels}
+
+    @tf.function
+    def sample(chunk_seed):
+        return flatten(model.sample(chunk_size, seed=chunk_seed))
+
+    specs = sample.get_concrete_function(tf.TensorSpec([2], tf.int32)).structured_outputs
+    columns = list(specs)
+    num_chunks = -(-num_samples // chunk_size)
+    shards = []
+    for index in range(-(-num_chunks // shard_chunks)):
+        first = index * shard_chunks * chunk_size
+        shard = {'rows': min(shard_chunks * chunk_size, num_samples - first)}
+        shard.update({column: f'{column}_{index:05d}.npy' for column in columns})
+        shards.append(shard)
+
+    def complete(shard):
+        return resume and all(os.path.isfile(os.path.join(shard_dir, shard[column])) for column in columns)
+
+    todo = [chunk for chunk in range(num_chunks) if not complete(shards[chunk // shard_chunks])]
+    remaining = {index: -(-shard['rows'] // chunk_size) for index, shard in enumerate(shards)
+                 if not complete(shard)}
+    chunks = queue.Queue(maxsize=queue_size)
+    next_chunk = iter(todo)
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            while not stop.is_set():
+                with lock:
+                    chunk = next(next_chunk, None)
+                if chunk is None:
+                    return
+                arrays = sample(tf.constant([seed, chunk], dtype=tf.int32))
+                chunks.put((chunk, {key: value.numpy() for key, value in arrays.items()}))
+        except Exception as err: # pylint: disable=broad-except
+            chunks.put((None, err))
+
+    workers = [threading.Thread(target=produce, daemon=True) for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    memmaps = {}
+    try:
+        for _ in todo:
+            chunk, arrays = chunks.get()
+            if chunk is None:
+                raise arrays
+            index = chunk // shard_chunks
+            shard = shards[index]
+            if index not in memmaps:
+                memmaps[index] = {
+                    column: np.lib.format.open_memmap(
+                        os.path.join(shard_dir, 'tmp_' + shard[column]), mode='w+',
+                        dtype=specs[column].dtype.as_numpy_dtype,
+                        shape=(shard['rows'], *specs[column].shape[1:]))
+                    for column in columns}
+            start = (chunk % shard_chunks) * chunk_size
+            for column, memmap in memmaps[index].items():
+                rows = memmap[start:start + chunk_size]
+                rows[:] = arrays[column][:len(rows)]
+            remaining[index] -= 1
+            if not remaining[index]:
+                for column, memmap in memmaps.pop(index).items():
+                    memmap.flush()
+                    del memmap
+                    os.replace(os.path.join(shard_dir, 'tmp_' + shard[column]),
+                               os.path.join(shard_dir, shard[column]))
+                logging.info('Shard %d of %d written.', index + 1, len(shards))
+    finally:
+        stop.set()
+        # unblock the workers waiting on a full queue
+        while any(worker.is_alive() for worker in workers):
+            try:
+                chunks.get(timeout=.1)
+            except queue.Empty:
+                pass
+
+    manifest = {'num_rows': num_samples,
+                'columns': columns,
+                'num_features': model.num_features,
+                **params,
+                'shards': shards}
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as outfile:
+        json.dump(manifest, outfile, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
@@ -1,10 +1,86 @@
 """
 Diglm: Deeply Invertible Generalized Linear Model
 """
-from tensorflow import Variable, ones, zeros, expand_dims
+from collections.abc import Mapping
+
+import numpy as np
+from tensorflow import Variable, ones, zeros, expand_dims, convert_to_tensor, float32, split, add_n, function, name_scope, TensorSpec
+from tensorflow.data import Dataset, AUTOTUNE
+from tensorflow.linalg import matvec
 from tensorflow_probability.python.distributions import Independent, JointDistributionNamed, MultivariateNormalDiag, TransformedDistribution
 from tensorflow_probability.python.glm import compute_predicted_linear_response
 
+class QuantileSketch:
+    """ Streaming quantile sketch with bounded memory, made of compactors
+    as in the KLL sketch of Karnin, Lang and Liberty. Values are added to the
+    first level; when a level holds more than `capacity` values they are
+    sorted and every other one (with a random offset) is promoted to the next
+    level, where each value stands for twice as many. The memory is
+    `O(capacity * log(count / capacity))` and the rank error of the quantiles
+    is of order `1 / capacity`.
+
+    :param capacity: Maximum number of values in each level, defaults to `1024`.
+    :type capacity: int, optional
+    :param seed: Seed of the compactions, defaults to `None`.
+    :type seed: int, optional
+    """
+    def __init__(self, capacity=1024, seed=None):
+        """ Constructor method.
+        """
+        self._capacity = capacity
+        self._levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+        self._count = 0
+
+    @property
+    def count(self):
+        """ Number of values added
+        """
+        return self._count
+
+    def update(self, values):
+        """ Adds values to the sketch.
+
+        :param values: The values.
+        :type values: numpy.ndarray
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self._count += values.size
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            level += 1
+            if len(items) <= self._capacity:
+                continue
+            items = np.sort(items)
+            odd = len(items) % 2
+            self._levels[level - 1] = items[len(items) - odd:]
+            promoted = items[self._rng.integers(2):len(items) - odd:2]
+            if level == len(self._levels):
+                self._levels.append(np.empty(0))
+            self._levels[level] = np.concatenate([self._levels[level], promoted])
+
+    def quantile(self, q):
+        """ Estimated quantiles of the values added.
+
+        :param q: Quantile(s), between `0` and `1`.
+        :type q: float or numpy.ndarray
+        :return: The quantile(s).
+        :rtype: float or numpy.ndarray
+        :raises: ValueError
+        """
+        if not self._count:
+            raise ValueError("The quantiles of an empty QuantileSketch are not defined.")
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(items), 2.**level)
+                                  for level, items in enumerate(self._levels)])
+        order = np.argsort(values)
+        ranks = np.cumsum(weights[order])
+        index = np.searchsorted(ranks, np.asarray(q) * ranks[-1])
+        return values[order][np.minimum(index, len(values) - 1)]
+
+
 class Diglm(JointDistributionNamed):
     """ Deep Invertible Generalized Linear Model using `tensorflow_probability`.
     This class implements the model described by Nalisnick et al. in 
@@ -16,9 +92,15 @@ class Diglm(JointDistributionNamed):
     :param bijector: Bijector with learnable parameters
         for the invertible tranformation.
     :type bijector: tensorflow_probability.bijectors.Bijector
-    :param glm: Generalized linear model.
-    :type glm: tensorflow_probability.glm.ExponentialFamily
-    :param num_feature: Dimensions of features space.
+    :param glm: Generalized linear model, or dictionary of named glm heads.
+        All the heads are computed from the same latent features, each
+        with its own coefficients and intercept; the labels are then
+        dictionaries with the same keys.
+    :type glm: tensorflow_probability.glm.ExponentialFamily or dict
+    :param num_feature: Dimensions of features space. If the bijector has a
+        `build` method, like :class:`spqr.NeuralSplineFlow`, it is called with
+        this value to create the bijector variables together with the glm ones
+        (e.g. inside a `tf.distribute` strategy scope).
     :type num_features: int
     :param **kwargs: Other arguments for `JointDitributionNamed`.
     :type **kwargs: optional
@@ -31,18 +113,26 @@ class Diglm(JointDistributionNamed):
                  **kwargs):
         self._bijector = bijector
         self._glm = glm
+        self._heads = dict(glm) if isinstance(glm, Mapping) else None
         self._num_features = num_features
-        self._beta = Variable(ones([self.num_features]), trainable=True, name="glm_beta")
-        self._beta_0 = Variable(0., trainable=True, name="glm_beta_0")
+        if hasattr(bijector, "build"):
+            bijector.build(num_features)
+        if self._heads is None:
+            self._beta = Variable(ones([self.num_features]), trainable=True, name="glm_beta")
+            self._beta_0 = Variable(0., trainable=True, name="glm_beta_0")
+        else:
+            self._beta = Variable(ones([self.num_features, len(self._heads)]),
+                                  trainable=True, name="glm_beta")
+            self._beta_0 = Variable(zeros([len(self._heads)]), trainable=True, name="glm_beta_0")
+        self._base_distribution = MultivariateNormalDiag(
+            loc=zeros([self.num_features]),
+            scale_diag=ones([self.num_features])
+        )
         model = {
             "features": TransformedDistribution(
-                distribution=MultivariateNormalDiag(
-                    loc=zeros([self.num_features]),
-                    scale_diag=ones([self.num_features])
-                ),
+                distribution=self._base_distribution,
                 bijector=self.bijector),
-            "labels": lambda features: Independent(self.glm.as_distribution(self.eta_from_features(features)),
-                                                   reinterpreted_batch_ndims=1)
+            "labels": lambda features: self._labels_distribution(self.eta_from_features(features))
         }
         super().__init__(model, name=name, **kwargs)
 
@@ -54,16 +144,56 @@ class Diglm(JointDistributionNamed):
 
     @property
     def glm(self):
-        """ Generalized Linear Model
+        """ Generalized Linear Model, or dictionary of named ones
         """
         return self._glm
 
+    @property
+    def heads(self):
+        """ Names of the glm heads, `None` for a single glm
+        """
+        return None if self._heads is None else tuple(self._heads)
+
     @property
     def num_features(self):
         """ Number of features
         """
         return self._num_features
 
+    @property
+    def trainable_variables(self):
+        """ Trainable variables of the glm (`glm_beta`, `glm_beta_0`)
+        followed by those of the bijector.
+
+        The bijector variables are not found by the default `tf.Module`
+        search, which only sees the tensor components of composite
+        distributions and bijectors.
+        """
+        return (self._beta, self._beta_0) + tuple(self.bijector.trainable_variables)
+
+    @property
+    def head_variables(self):
+        """ Variables of the glm (`glm_beta`, `glm_beta_0`), the only ones
+        trained when the bijector is frozen.
+        """
+        return (self._beta, self._beta_0)
+
+    @property
+    def variables(self):
+        """ Variables of the glm followed by those of the bijector.
+        """
+        return (self._beta, self._beta_0) + tuple(self.bijector.variables)
+
+    def set_precision(self, precision):
+        """ Sets the compute precision of the conditioner networks of the
+        bijector, see :meth:`spqr.NeuralSplineFlow.set_precision`. The glm
+        and the log probabilities are always evaluated in float32.
+
+        :param precision: One of `spqr.SplineBlock.PRECISIONS`.
+        :type precision: str
+        """
+        self.bijector.set_precision(precision)
+
     def latent_features(self, features):
         """ Compute latent variables from features.
 
@@ -72,7 +202,60 @@ class Diglm(JointDistributionNamed):
         :return: Transformed feature in latent space.
         :rtype: tensorflow.Tensor
         """
-        return self.bijector.inverse(features)
+        with name_scope("flow"):
+            return self.bijector.inverse(features)
+
+    def latent_features_and_log_det_jacobian(self, features):
+        """ Compute latent variables from features together with
+        the inverse log-det-jacobian of the bijector, running the
+        inverse transformation only once.
+
+        If the bijector exposes an `inverse_and_log_det_jacobian` method
+        (as :class:`spqr.NeuralSplineFlow` does) it is used, otherwise
+        `inverse` and `inverse_log_det_jacobian` are called separately.
+
+        :param features: Model features.
+        :type features: tensorflow.Tensor
+        :return: Transformed features in latent space and
+            inverse log-det-jacobian.
+        :rtype: tuple(tensorflow.Tensor)
+        """
+        features = convert_to_tensor(features, dtype_hint=float32)
+        fused = getattr(self.bijector, "inverse_and_log_det_jacobian", None)
+        with name_scope("flow"):
+            if fused is not None:
+                return fused(features)
+            return (self.bijector.inverse(features),
+                    self.bijector.inverse_log_det_jacobian(features, event_ndims=1))
+
+    def eta_from_latents(self, latents):
+        """ Compute predicted linear response from
+        features already transformed in latent space.
+        With several glm heads, the responses of all the heads
+        are computed by a single matrix multiplication.
+
+        :param latents: Latent features.
+        :type latents: tensorflow.Tensor
+        :return: Predicted linear response, with one entry
+            for each head in the last dimension.
+        :rtype: tensorflow.Tensor
+        """
+        with name_scope("glm"):
+            if self._heads is None:
+                return compute_predicted_linear_response(expand_dims(latents, axis=-2),
+                                                         self._beta,
+                                                         offset=self._beta_0)
+            return matvec(self._beta, latents, transpose_a=True) + self._beta_0
+
+    def _labels_distribution(self, eta):
+        """ Distribution of the labels given the predicted linear response.
+        """
+        if self._heads is None:
+            return Independent(self.glm.as_distribution(eta), reinterpreted_batch_ndims=1)
+        etas = split(eta, len(self._heads), axis=-1)
+        return JointDistributionNamed({
+            name: Independent(head.as_distribution(head_eta), reinterpreted_batch_ndims=1)
+            for (name, head), head_eta in zip(self._heads.items(), etas)})
 
     def eta_from_features(self, features):
         """ Compute predicted linear response transforming
@@ -83,32 +266,212 @@ class Diglm(JointDistributionNamed):
         :return: Predicted linear response.
         :rtype: tensorflow.Tensor
         """
-        return compute_predicted_linear_response(expand_dims(self.latent_features(features), axis=-2),
-                                                 self._beta,
-                                                 offset=self._beta_0)
+        return self.eta_from_latents(self.latent_features(features))
+
+    def features_log_prob_from_latents(self, latents, log_det_jacobian):
+        """ Log probability of the features from their latents and
+        the inverse log-det-jacobian of the bijector.
+
+        :param latents: Latent features.
+        :type latents: tensorflow.Tensor
+        :param log_det_jacobian: Inverse log-det-jacobian of the bijector.
+        :type log_det_jacobian: tensorflow.Tensor
+        :return: Features log probability.
+        :rtype: tensorflow.Tensor
+        """
+        with name_scope("features_log_prob"):
+            return self._base_distribution.log_prob(latents) + log_det_jacobian
+
+    def log_prob_parts_from_latents(self, latents, log_det_jacobian, labels, head_weights=None):
+        """ Log probability of features and labels from features already
+        transformed in latent space, e.g. read from the cache written by
+        `data.cache_latents`: the bijector is not applied.
+
+        :param latents: Latent features.
+        :type latents: tensorflow.Tensor
+        :param log_det_jacobian: Inverse log-det-jacobian of the bijector.
+        :type log_det_jacobian: tensorflow.Tensor
+        :param labels: Labels, or dictionary of the labels of each glm head.
+        :type labels: tensorflow.Tensor or dict(tensorflow.Tensor)
+        :param head_weights: Weights of the log probabilities of the glm heads
+            summed in the labels term, defaults to `None` (all ones).
+        :type head_weights: dict(float), optional
+        :return: Dictionary of features and labels log probabilities.
+        :rtype: dict(tensorflow.Tensor)
+        :raises: ValueError
+        """
+        if head_weights is not None:
+            unknown = sorted(set(head_weights) - set(self._heads or ()))
+            if unknown:
+                raise ValueError(f"Unknown glm heads in head_weights: {unknown}, "
+                                 f"the heads are {list(self._heads or ())}.")
+        eta = self.eta_from_latents(latents)
+        with name_scope("labels_log_prob"):
+            labels_dist = self._labels_distribution(eta)
+            if head_weights is None or self._heads is None:
+                labels_lp = labels_dist.log_prob(labels)
+            else:
+                heads_lp = labels_dist.log_prob_parts(labels)
+                labels_lp = add_n([head_weights.get(name, 1.) * heads_lp[name]
+                                   for name in self._heads])
+        return {
+            "features": self.features_log_prob_from_latents(latents, log_det_jacobian),
+            "labels": labels_lp
+        }
+
+    def _fused_log_prob_parts(self, value):
+        """ Features and labels log probabilities computed
+        from a single pass of the (inverse) bijector.
+        """
+        latents, ildj = self.latent_features_and_log_det_jacobian(value["features"])
+        return self.log_prob_parts_from_latents(latents, ildj, value["labels"])
 
-    def weighted_log_prob(self, value, scaling_const=.1):
+    def log_prob_parts(self, *args, **kwargs):
+        """ Log probability of features and labels. The bijector
+        is applied only once to compute both terms.
+
+        :param value: Dictionary of (a batch of) features and labels.
+        :type value: dict(tensorflow.Tensor)
+        :return: Dictionary of features and labels log probabilities.
+        :rtype: dict(tensorflow.Tensor)
+        """
+        name = kwargs.pop("name", "log_prob_parts")
+        value = self._resolve_value(*args, **kwargs)
+        with self._name_and_control_scope(name):
+            return self._fused_log_prob_parts(value)
+
+    def _log_prob(self, value):
+        lpp = self._fused_log_prob_parts(value)
+        return lpp["features"] + lpp["labels"]
+
+    def weighted_log_prob(self, value, scaling_const=.1, head_weights=None):
         """ Weighted objective function as described in
         Nalisnik et al.
 
-        :param value: Dictionary of (a batch of) features and labels.
+        :param value: Dictionary of (a batch of) features and labels, or of
+            `latents`, `log_det_jacobian` and `labels` as cached by `data.cache_latents`.
         :type value: dict(tensorflow.Tensor)
         :param scaling_const: The scaling constant of the modified
             objective, defaults to `0.1`
         :type scaling_const: float
+        :param head_weights: Weights of the log probabilities of the glm heads,
+            by name, defaults to `None` (all ones).
+        :type head_weights: dict(float), optional
         :return: Weighted objective.
         :rtype: tensorflow.Tensor
+        :raises: ValueError
         """
-        lpp = self.log_prob_parts(value)
+        if "latents" in value:
+            latents, ildj = value["latents"], value["log_det_jacobian"]
+        else:
+            latents, ildj = self.latent_features_and_log_det_jacobian(value["features"])
+        lpp = self.log_prob_parts_from_latents(latents, ildj, value["labels"],
+                                               head_weights=head_weights)
         return lpp["labels"] + scaling_const * lpp["features"]
 
+    def _score_batch(self, features):
+        latents, ildj = self.latent_features_and_log_det_jacobian(features)
+        eta = self.eta_from_latents(latents)
+        scores = {"log_prob": self.features_log_prob_from_latents(latents, ildj)}
+        if self._heads is None:
+            scores["mean"] = self.glm(eta)[0]
+        else:
+            for (name, head), head_eta in zip(self._heads.items(),
+                                              split(eta, len(self._heads), axis=-1)):
+                scores["mean_" + name] = head(head_eta)[0]
+        return scores
+
+    def _scores(self, batches, prefetch):
+        """ Dataset of the scores of the feature batches, computed by a compiled
+        function in the `tf.data` pipeline.
+        """
+        if not isinstance(batches, Dataset):
+            iterable = batches
+            batches = Dataset.from_generator(
+                lambda: iter(iterable),
+                output_signature=TensorSpec([None, self.num_features], float32))
+        if isinstance(batches.element_spec, dict):
+            batches = batches.map(lambda value: value["features"])
+        if getattr(self, "_score_function", None) is None:
+            self._score_function = function(
+                self._score_batch,
+                input_signature=[TensorSpec([None, self.num_features], float32)])
+        return batches.map(self._score_function).prefetch(prefetch)
+
+    def ood_sketch(self, reference, capacity=1024, seed=None):
+        """ Fits a :class:`QuantileSketch` of the features log probability
+        on a stream of reference (in-distribution) events.
+
+        :param reference: Batches of reference features, or a dataset of them
+            (or of dictionaries of features and labels).
+        :type reference: iterable or tensorflow.data.Dataset
+        :param capacity: Capacity of the sketch, defaults to `1024`.
+        :type capacity: int, optional
+        :param seed: Seed of the sketch, defaults to `None`.
+        :type seed: int, optional
+        :return: The sketch.
+        :rtype: QuantileSketch
+        """
+        sketch = QuantileSketch(capacity, seed)
+        for scores in self._scores(reference, AUTOTUNE):
+            sketch.update(scores["log_prob"].numpy())
+        return sketch
+
+    def score_stream(self,
+                     batches,
+                     threshold=None,
+                     reference=None,
+                     quantile=.01,
+                     prefetch=AUTOTUNE):
+        """ Scores a stream of feature batches for novelty, with bounded memory.
+        Batches are scored by a compiled function as they are read, while
+        the next ones are prefetched.
+
+        Events are flagged as out-of-distribution when their features log
+        probability is below `threshold`. If it is not given it is calibrated
+        on the `reference` events as their `quantile` quantile, estimated by
+        :meth:`ood_sketch`: a fraction `quantile` of in-distribution
+        events is then flagged.
+
+        :param batches: Batches of features, or a dataset of them
+            (or of dictionaries of features and labels).
+        :type batches: iterable or tensorflow.data.Dataset
+        :param threshold: Log probability threshold, defaults to `None`.
+        :type threshold: float, optional
+        :param reference: Batches of reference features, used if `threshold`
+            is `None`, defaults to `None` (no flags).
+        :type reference: iterable or tensorflow.data.Dataset, optional
+        :param quantile: Fraction of reference events below the threshold,
+            defaults to `0.01`.
+        :type quantile: float, optional
+        :param prefetch: Number of batches scored ahead, defaults to `tf.data.AUTOTUNE`.
+        :type prefetch: int, optional
+        :return: Generator of dictionaries with the features `log_prob`, the
+            predicted `mean` (`mean_<head>` for each glm head) and the `ood` flags
+            of each batch.
+        :rtype: generator(dict(numpy.ndarray))
+        """
+        if threshold is None and reference is not None:
+            threshold = float(self.ood_sketch(reference).quantile(quantile))
+        for scores in self._scores(batches, prefetch):
+            scores = {key: value.numpy() for key, value in scores.items()}
+            if threshold is not None:
+                scores["ood"] = scores["log_prob"] < threshold
+            yield scores
+
     def __call__(self, features):
         """ Applies the (inverse) bijector and computes
         `mean(r)`, `var(mean)`, `d/dr mean(r)` via glm.
 
         :param features: Model features.
         :type features: tensorflow.Tensor
-        :return: Mean, variance and derivative.
-        :rtype: list[tensorflow.Tensor]
+        :return: Mean, variance and derivative, or a dictionary
+            of them for each glm head.
+        :rtype: list[tensorflow.Tensor] or dict(list[tensorflow.Tensor])
         """
-        return self.glm(self.eta_from_features(features))
+        eta = self.eta_from_features(features)
+        with name_scope("glm"):
+            if self._heads is None:
+                return self.glm(eta)
+            return {name: head(head_eta) for (name, head), head_eta
+                    in zip(self._heads.items(), split(eta, len(self._heads), axis=-1))}
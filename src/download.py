@@ -1,57 +1,234 @@
 """ Module with download_file function """
 import os
 import sys
+import json
+import time
+import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import URLRequired, MissingSchema, InvalidSchema, InvalidURL
 
 
-def download_file(url, filename):
+class _Progress:
+    """ Thread safe download progress bar, redrawn at most
+    once every `interval` seconds.
+    """
+    def __init__(self, total, done=0, interval=0.5):
+        self._total = total
+        self._done = done
+        self._interval = interval
+        self._last = 0.
+        self._lock = threading.Lock()
+
+    def update(self, nbytes, force=False):
+        """ Adds `nbytes` to the downloaded bytes and redraws
+        the progress bar if enough time has passed.
+        """
+        with self._lock:
+            self._done += nbytes
+            now = time.monotonic()
+            if not force and now - self._last < self._interval:
+                return
+            self._last = now
+            if self._total:
+                sys.stdout.write(f'Download progress:{self._done * 100 / self._total:.0f}% \r')
+            else:
+                sys.stdout.write(f'Downloaded:{self._done / 1e6:.0f} MB \r')
+            sys.stdout.flush()
+
+
+def sha256sum(filename, chunk_size=2**20):
+    """
+    Computes the sha256 hex digest of a file, reading it in chunks.
+
+    :param filename: name of the file.
+    :type filename: str or Path.like object
+    :param chunk_size: Optional (Default=1 MiB). Bytes read at a time.
+    :type chunk_size: int
+    :return: The hex digest.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _download_sequential(session, url, part, file_size, chunk_size, progress):
+    """ Downloads (or resumes) the whole file into `part`. `file_size` is the
+    size reported by the server, 0 if unknown. """
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    if file_size and offset > file_size:
+        # the file shrank on the server since the partial download
+        logging.info('The partial file is larger than the remote one, restarting.')
+        os.remove(part)
+        offset = 0
+    progress.update(offset)
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with session.get(url, headers=headers, stream=True) as response:
+        stale = bool(offset) and response.status_code == 416
+        if stale and offset == file_size:
+            # the partial file is already complete
+            return
+        if not stale:
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                logging.info('Server refused to resume the download, restarting.')
+                progress.update(-offset)
+                offset = 0
+            with open(part, 'ab' if offset else 'wb') as newfile:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    newfile.write(chunk)
+                    progress.update(len(chunk))
+    if stale:
+        # the remote file changed: the partial file cannot be resumed
+        logging.info('The partial file does not match the remote one, restarting.')
+        progress.update(-offset)
+        os.remove(part)
+        _download_sequential(session, url, part, file_size, chunk_size, progress)
+
+
+def _download_segments(session, url, part, file_size, num_segments, chunk_size, progress):
+    """ Downloads (or resumes) the file into `part` with `num_segments`
+    parallel range requests. The bytes completed in each segment are
+    stored in a `.json` file next to `part` to allow resuming.
+    """
+    state_file = part + '.json'
+    bounds = [file_size * i // num_segments for i in range(num_segments + 1)]
+    segments = [[start, start, end] for start, end in zip(bounds[:-1], bounds[1:])]
+    state = None
+    if os.path.isfile(state_file) and os.path.isfile(part):
+        with open(state_file, encoding='utf-8') as infile:
+            state = json.load(infile)
+    if state is not None and state['size'] == file_size:
+        segments = state['segments']
+    else:
+        # a new download, or the file changed size on the server: start over
+        with open(part, 'wb') as newfile:
+            newfile.truncate(file_size)
+    progress.update(sum(pos - start for start, pos, _ in segments))
+
+    lock = threading.Lock()
+    last_save = [time.monotonic()]
+
+    def save_state(force=False):
+        with lock:
+            if not force and time.monotonic() - last_save[0] < 1.:
+                return
+            last_save[0] = time.monotonic()
+            snapshot = [list(segment) for segment in segments]
+            os.fsync(fd)
+            with open(state_file + '.tmp', 'w', encoding='utf-8') as outfile:
+                json.dump({'size': file_size, 'segments': snapshot}, outfile)
+            os.replace(state_file + '.tmp', state_file)
+
+    def fetch(segment):
+        _, pos, end = segment
+        if pos >= end:
+            return
+        headers = {'Range': f'bytes={pos}-{end - 1}'}
+        with session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError('Server does not support range requests.')
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                os.pwrite(fd, chunk, segment[1])
+                segment[1] += len(chunk)
+                progress.update(len(chunk))
+                save_state()
+
+    fd = os.open(part, os.O_WRONLY)
+    try:
+        with ThreadPoolExecutor(max_workers=num_segments) as pool:
+            for future in [pool.submit(fetch, segment) for segment in segments]:
+                future.result()
+    finally:
+        save_state(force=True)
+        os.close(fd)
+    os.remove(state_file)
+
+
+def download_file(url,
+                  filename,
+                  sha256=None,
+                  num_segments=1,
+                  chunk_size=2**20):
     """
     Function handling download of file objects from URL addresses.
-    
+
+    Data is written to a `<filename>.part` file, which is renamed to
+    `filename` only when the download is complete (and, if `sha256` is given,
+    verified). An interrupted download is resumed from the partial file
+    when the server supports HTTP range requests, otherwise it restarts.
+
     :param url: URL address from where to download.
     :type url: str
     :param filename: name of the downloaded file
     :type filename: str or Path.like object
+    :param sha256: Optional (Default=None). Expected sha256 hex digest of the file.
+    :type sha256: str
+    :param num_segments: Optional (Default=1). Number of parallel range requests,
+        used only if the server supports them and reports the file size.
+    :type num_segments: int
+    :param chunk_size: Optional (Default=1 MiB). Bytes written at a time.
+    :type chunk_size: int
     :raise URLRequired: if "url" is invalid
-    :raise MissingSchema: if "url" is invalid 
+    :raise MissingSchema: if "url" is invalid
     :raise InvalidSchema: if "url" is invalid
     :raise InvalidURL: if "url" is invalid
+    :raise ValueError: if the downloaded file does not match `sha256`.
     :return: None
- 
+
     """
+    filename = os.fspath(filename)
+    part = filename + '.part'
 
     # check if file already exists
     if os.path.isfile(filename):
-        logging.info('File %s exists.', filename)
-        return
+        if sha256 is None or sha256sum(filename) == sha256:
+            logging.info('File %s exists.', filename)
+            return
+        logging.warning('File %s does not match the sha256, downloading it again.', filename)
+        os.remove(filename)
 
     # create directory and download the file
-    try:
-        os.makedirs(os.path.dirname(os.path.abspath(filename)))
-    except FileExistsError:
-        pass
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
 
-    # check if URL is valid
-    try:
-        response = requests.get(url, stream=True)
-    except (URLRequired, MissingSchema, InvalidSchema, InvalidURL) as err:
-        raise err
-
-    with open(filename, 'wb') as newfile:
-        step_size = 1000000
-        file_size = int(response.headers['Content-length'])
-        logging.info('File size: %3f MB', (file_size * 1e6))
-        for step, chunk in enumerate(
-                    response.iter_content(chunk_size=step_size)):
-            sys.stdout.flush()
-            newfile.write(chunk)
-            progress = (step * step_size * 100 / file_size)
-            sys.stdout.write(f'Download progress:{progress:.0f}% \r')
-    if os.path.isfile(filename):
-        logging.info('File %s downloaded succesfully', filename)
-    else:
-        logging.error('The file could not be downloaded :( \nTry to download it manually.')
-    return
+    with requests.Session() as session:
+        session.mount('http://', HTTPAdapter(pool_maxsize=num_segments))
+        session.mount('https://', HTTPAdapter(pool_maxsize=num_segments))
+
+        # check if URL is valid
+        try:
+            response = session.head(url, allow_redirects=True)
+        except (URLRequired, MissingSchema, InvalidSchema, InvalidURL) as err:
+            raise err
+        # servers not answering to HEAD requests are downloaded sequentially
+        headers = response.headers if response.ok else {}
+        file_size = int(headers.get('Content-Length', 0))
+        accept_ranges = headers.get('Accept-Ranges', 'none') == 'bytes'
+        logging.info('File size: %3f MB', (file_size / 1e6))
+
+        progress = _Progress(file_size)
+        if num_segments > 1 and accept_ranges and file_size:
+            _download_segments(session, response.url, part, file_size,
+                               num_segments, chunk_size, progress)
+        else:
+            if os.path.isfile(part + '.json'):
+                # left by a segmented download, not resumable sequentially
+                os.remove(part + '.json')
+                os.remove(part)
+            _download_sequential(session, response.url, part, file_size, chunk_size, progress)
+        progress.update(0, force=True)
+        sys.stdout.write('\n')
+
+    if sha256 is not None and sha256sum(part) != sha256:
+        os.remove(part)
+        raise ValueError(f'The file downloaded from {url} does not match the sha256.')
+    os.replace(part, filename)
+    logging.info('File %s downloaded succesfully', filename)
@@ -0,0 +1,197 @@
+"""
+Ensembles of Diglm models evaluated in a single batched graph
+"""
+from math import log
+
+from tensorflow import (Module, TensorSpec, Variable, broadcast_to, einsum, float32, function,
+                        name_scope, shape, split, stack, zeros)
+from tensorflow.math import reduce_logsumexp, reduce_mean, reduce_variance
+
+from .spqr import NeuralSplineFlow, _coupling_inverse_and_log_det_jacobian, _rational_quadratic_spline
+
+
+def _structure(member):
+    """ Everything that must be equal for the weights of two
+    models to be stacked.
+    """
+    flow = member.bijector
+    glms = {"": member.glm} if member.heads is None else member.glm
+    return (member.num_features,
+            tuple((name, type(glm)) for name, glm in glms.items()),
+            [(layer._masked_size, layer._reverse_mask) # pylint: disable=protected-access
+             for layer in flow.bijectors],
+            sorted(flow._spline_params.items()), # pylint: disable=protected-access
+            [tuple(v.shape) for v in member.trainable_variables])
+
+
+class DiglmEnsemble(Module):
+    """ Ensemble of structurally identical :class:`diglm.Diglm` models
+    (same :class:`spqr.NeuralSplineFlow` masks and spline parameters, same
+    glm heads), e.g. trained independently from different initializations,
+    evaluated by a single compiled function instead of a loop over the members.
+
+    The weights of the members are stacked along a leading ensemble axis:
+    the conditioner networks of each coupling layer run as batched matrix
+    multiplications, the splines of all the members are evaluated together
+    and the glm linear responses are computed by a single `einsum`.
+
+    The members are copied at construction: call :meth:`refresh` after
+    training them further. The conditioners always run in float32, int8
+    members are not supported.
+
+    :param members: The models.
+    :type members: list[diglm.Diglm]
+    :param jit_compile: Whether the function is compiled with XLA, defaults to `False`.
+    :type jit_compile: bool, optional
+    :raises: ValueError
+    """
+    def __init__(self, members, jit_compile=False):
+        """ Constructor method.
+        """
+        super().__init__(name="diglm_ensemble")
+        members = list(members)
+        if not members:
+            raise ValueError("An ensemble needs at least one member.")
+        for member in members:
+            flow = member.bijector
+            if not isinstance(flow, NeuralSplineFlow) or \
+                    flow._shared_conditioner: # pylint: disable=protected-access
+                raise ValueError("Members must have a NeuralSplineFlow bijector "
+                                 "with a conditioner network per coupling layer.")
+            if flow.precision == "int8":
+                raise ValueError("Members must have float32 kernels, not int8 ones.")
+        structure = _structure(members[0])
+        if any(_structure(member) != structure for member in members[1:]):
+            raise ValueError("Members must have the same architecture.")
+        self._members = members
+        self._model = members[0]
+        self._weights = [Variable(stack(values), trainable=False)
+                         for values in zip(*(self._member_weights(m) for m in members))]
+        self._function = function(self._outputs,
+                                  input_signature=[TensorSpec([None, self.num_features], float32)],
+                                  jit_compile=jit_compile)
+
+    @property
+    def members(self):
+        """ The models of the ensemble
+        """
+        return tuple(self._members)
+
+    @property
+    def size(self):
+        """ Number of members
+        """
+        return len(self._members)
+
+    @property
+    def num_features(self):
+        """ Number of features
+        """
+        return self._model.num_features
+
+    @property
+    def heads(self):
+        """ Names of the glm heads, `None` for a single glm
+        """
+        return self._model.heads
+
+    @staticmethod
+    def _member_weights(member):
+        """ Variables of a member, in the order of the stacked weights:
+        kernels and biases of the dense layers of each coupling layer,
+        then `glm_beta` and `glm_beta_0`.
+        """
+        weights = []
+        for layer in member.bijector.bijectors:
+            block = layer._bijector_fn._nn # pylint: disable=protected-access
+            for dense in block._hidden_layers + [block._params_layer]: # pylint: disable=protected-access
+                weights += [dense.kernel, dense.bias]
+        return weights + list(member.head_variables)
+
+    def refresh(self):
+        """ Copies again the current weights of the members.
+        """
+        for stacked, values in zip(self._weights,
+                                   zip(*(self._member_weights(m) for m in self._members))):
+            stacked.assign(stack(values))
+
+    def _conditioner(self, block, units, weights):
+        """ Spline parameters of a coupling layer for all the members:
+        `units` have shape `[size, batch, inputs]`, each kernel `[size, inputs, outputs]`.
+        """
+        layers = block._hidden_layers + [block._params_layer] # pylint: disable=protected-access
+        for dense, kernel, bias in zip(layers, weights[0::2], weights[1::2]):
+            units = units @ kernel + bias[:, None, :]
+            if dense is not block._params_layer: # pylint: disable=protected-access
+                units = dense.activation(units)
+        return units
+
+    def _latents_and_log_det_jacobian(self, features):
+        y = broadcast_to(features, [self.size, shape(features)[0], self.num_features])
+        ildj = zeros(shape(y)[:-1], dtype=y.dtype)
+        weights = iter(self._weights)
+        for layer in self._model.bijector.bijectors:
+            block = layer._bijector_fn._nn # pylint: disable=protected-access
+            layer_weights = [next(weights) for _ in range(2 * len(block._hidden_layers) + 2)] # pylint: disable=protected-access
+            masked_size = layer._masked_size # pylint: disable=protected-access
+            y0 = y[..., masked_size:] if layer._reverse_mask else y[..., :masked_size] # pylint: disable=protected-access
+            with name_scope(layer.name):
+                with name_scope("conditioner"):
+                    params = block._split_params( # pylint: disable=protected-access
+                        self._conditioner(block, y0, layer_weights),
+                        self.num_features - abs(masked_size))
+                spline = _rational_quadratic_spline(params, block._border, # pylint: disable=protected-access
+                                                    block._uniform_bins) # pylint: disable=protected-access
+                y, layer_ildj = _coupling_inverse_and_log_det_jacobian(layer, y, spline)
+            ildj = ildj + layer_ildj
+        return y, ildj
+
+    def _outputs(self, features):
+        with name_scope("flow"):
+            latents, ildj = self._latents_and_log_det_jacobian(features)
+        beta, beta_0 = self._weights[-2:]
+        with name_scope("glm"):
+            if self.heads is None:
+                glms = {"": self._model.glm}
+                etas = [(einsum("mbf,mf->mb", latents, beta) + beta_0[:, None])[..., None]]
+            else:
+                glms = self._model.glm
+                etas = split(einsum("mbf,mfh->mbh", latents, beta) + beta_0[:, None, :],
+                             len(self.heads), axis=-1)
+        log_prob = self._model.features_log_prob_from_latents(latents, ildj)
+        outputs = {
+            "member_features_log_prob": log_prob,
+            # density of the mixture of the members
+            "features_log_prob": reduce_logsumexp(log_prob, axis=0) - log(self.size)
+        }
+        for (name, glm), eta in zip(glms.items(), etas):
+            suffix = name and "_" + name
+            mean, variance, _ = glm(eta)
+            outputs["member_mean" + suffix] = mean
+            outputs["member_variance" + suffix] = variance
+            outputs["mean" + suffix] = reduce_mean(mean, axis=0)
+            # law of total variance: spread of each member plus disagreement between them
+            outputs["variance" + suffix] = reduce_mean(variance, axis=0) + \
+                reduce_variance(mean, axis=0)
+        return outputs
+
+    def __call__(self, features):
+        """ Outputs of all the members and of the ensemble, for a batch of features.
+
+        - `member_mean`, `member_variance`: glm mean and variance of each member,
+          as returned by `Diglm.__call__`, of shape `[size, batch, 1]`.
+        - `member_features_log_prob`: features log probability of each member,
+          of shape `[size, batch]`.
+        - `mean`, `variance`: mean of the members means and total variance
+          (mean of the variances plus variance of the means), of shape `[batch, 1]`.
+        - `features_log_prob`: log probability of the mixture of the members, of
+          shape `[batch]`.
+
+        With several glm heads, the glm outputs are suffixed by `_<head>`.
+
+        :param features: Model features, of shape `[batch, num_features]`.
+        :type features: tensorflow.Tensor
+        :return: Dictionary of outputs.
+        :rtype: dict(tensorflow.Tensor)
+        """
+        return self._function(features)
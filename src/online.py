@@ -0,0 +1,252 @@
+""" Module with online training of Diglm models on streams of events """
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+
+class ReservoirBuffer:
+    """ Uniform sample of fixed size of all the events added so far
+    (reservoir sampling): memory does not grow with the stream, and old
+    events are replayed with the same probability as recent ones.
+
+    :param capacity: Maximum number of events, defaults to `2**16`.
+    :type capacity: int, optional
+    :param seed: Seed of the sampling, defaults to `None`.
+    :type seed: int, optional
+    """
+    def __init__(self, capacity=2**16, seed=None):
+        """ Constructor method.
+        """
+        self._capacity = capacity
+        self._rng = np.random.default_rng(seed)
+        self._structure = None
+        self._arrays = None
+        self._seen = 0
+
+    @property
+    def size(self):
+        """ Number of events in the buffer
+        """
+        return min(self._seen, self._capacity)
+
+    @property
+    def seen(self):
+        """ Number of events added so far
+        """
+        return self._seen
+
+    def add(self, batch):
+        """ Adds a batch of events: each of the `seen` events so far is kept
+        in the buffer with probability `capacity / seen`.
+
+        :param batch: Dictionary of arrays with the same number of rows,
+            e.g. `features` and `labels` (a dictionary of the labels of each
+            glm head for multi-head models).
+        :type batch: dict(numpy.ndarray)
+        """
+        values = [np.asarray(value) for value in tf.nest.flatten(batch)]
+        rows = len(values[0])
+        if self._arrays is None:
+            # the nesting of the batches, without keeping their arrays
+            self._structure = tf.nest.map_structure(lambda _: None, batch)
+            self._arrays = [np.empty((self._capacity,) + value.shape[1:], dtype=value.dtype)
+                            for value in values]
+        index = self._seen + np.arange(rows)
+        # the i-th event replaces a random slot with probability capacity / (i + 1)
+        slots = np.where(index < self._capacity, index, self._rng.integers(0, index + 1))
+        keep = slots < self._capacity
+        for array, value in zip(self._arrays, values):
+            array[slots[keep]] = value[keep]
+        self._seen += rows
+
+    def sample(self, size):
+        """ Random events of the buffer, drawn with replacement.
+
+        :param size: Number of events.
+        :type size: int
+        :return: Dictionary of arrays of `size` rows, nested as the batches added.
+        :rtype: dict(numpy.ndarray)
+        """
+        rows = self._rng.integers(0, self.size, size)
+        return tf.nest.pack_sequence_as(self._structure, [array[rows] for array in self._arrays])
+
+
+class OnlineTrainer:
+    """ Online training of a :class:`diglm.Diglm` on an unbounded stream of
+    batches, with constant time and memory per update.
+
+    Each incoming batch is added to a :class:`ReservoirBuffer`, and the
+    model is updated on the batch concatenated to `replay_size` events
+    replayed from the buffer, which limits the drift towards the most
+    recent events. The glm head (`glm_beta`, `glm_beta_0`) is updated at
+    every batch, with the flow frozen: the latents are computed without
+    gradients, so it costs a forward pass of the flow. The flow and the
+    head are updated together only every `flow_every` batches.
+
+    Every `checkpoint_every` updates the model is written to
+    `checkpoint_path` (see `checkpoint.save`), atomically: a serving
+    process can reload it at any time, e.g. with
+    `serving.InferenceEngine.reload`.
+
+    :param model: The model.
+    :type model: diglm.Diglm
+    :param optimizer: Optimizer of the flow and head updates.
+    :type optimizer: tensorflow.keras.optimizers.Optimizer
+    :param head_optimizer: Optimizer of the head only updates, defaults to
+        `None`: a new optimizer with the configuration of `optimizer`.
+    :type head_optimizer: tensorflow.keras.optimizers.Optimizer, optional
+    :param scaling_const: Scaling constant of `Diglm.weighted_log_prob`, defaults to `0.1`.
+    :type scaling_const: float, optional
+    :param buffer_size: Capacity of the replay buffer, defaults to `2**16`.
+    :type buffer_size: int, optional
+    :param replay_size: Number of replayed events in each update, defaults to `256`.
+    :type replay_size: int, optional
+    :param flow_every: Number of batches between updates of the flow, defaults to `10`.
+    :type flow_every: int, optional
+    :param checkpoint_path: Path of the checkpoint, defaults to `None` (no checkpoints).
+    :type checkpoint_path: str, optional
+    :param checkpoint_every: Number of updates between checkpoints, defaults to `100`.
+    :type checkpoint_every: int, optional
+    :param config: Architecture of the model, saved in the checkpoint, required
+        with `checkpoint_path`.
+    :type config: config.DiglmConfig, optional
+    :param seed: Seed of the replay sampling, defaults to `None`.
+    :type seed: int, optional
+    :raises: ValueError
+    """
+    def __init__(self,
+                 model,
+                 optimizer,
+                 head_optimizer=None,
+                 scaling_const=.1,
+                 buffer_size=2**16,
+                 replay_size=256,
+                 flow_every=10,
+                 checkpoint_path=None,
+                 checkpoint_every=100,
+                 config=None,
+                 seed=None):
+        """ Constructor method.
+        """
+        if checkpoint_path is not None and config is None:
+            raise ValueError("A `config` is required to write checkpoints.")
+        self._model = model
+        self._optimizer = optimizer
+        self._head_optimizer = head_optimizer or optimizer.__class__.from_config(
+            optimizer.get_config())
+        self._scaling_const = scaling_const
+        self._buffer = ReservoirBuffer(buffer_size, seed)
+        self._replay_size = replay_size
+        self._flow_every = flow_every
+        self._checkpoint_path = checkpoint_path
+        self._checkpoint_every = checkpoint_every
+        self._config = config
+        self._updates = 0
+        # optimizer variables are created outside of the compiled steps
+        if hasattr(optimizer, "build"):
+            self._optimizer.build(model.trainable_variables)
+            self._head_optimizer.build(model.head_variables)
+        # batches of any size are served by a single trace
+        self._flow_step = tf.function(self._flow_and_head_step, experimental_relax_shapes=True)
+        self._head_step = tf.function(self._head_only_step, experimental_relax_shapes=True)
+
+    @property
+    def model(self):
+        """ The model
+        """
+        return self._model
+
+    @property
+    def buffer(self):
+        """ The replay buffer
+        """
+        return self._buffer
+
+    @property
+    def updates(self):
+        """ Number of updates so far
+        """
+        return self._updates
+
+    def _loss(self, batch):
+        return -tf.reduce_mean(self._model.weighted_log_prob(batch,
+                                                             scaling_const=self._scaling_const))
+
+    def _flow_and_head_step(self, batch):
+        variables = self._model.trainable_variables
+        with tf.GradientTape() as tape:
+            loss = self._loss(batch)
+        self._optimizer.apply_gradients(zip(tape.gradient(loss, variables), variables))
+        return loss
+
+    def _head_only_step(self, batch):
+        latents, ildj = self._model.latent_features_and_log_det_jacobian(batch["features"])
+        batch = {"latents": tf.stop_gradient(latents),
+                 "log_det_jacobian": tf.stop_gradient(ildj),
+                 "labels": batch["labels"]}
+        variables = self._model.head_variables
+        with tf.GradientTape() as tape:
+            loss = self._loss(batch)
+        self._head_optimizer.apply_gradients(zip(tape.gradient(loss, variables), variables))
+        return loss
+
+    def update(self, batch):
+        """ Updates the model on a batch and the replayed events, then
+        adds the batch to the replay buffer.
+
+        :param batch: Dictionary of `features` and `labels`, or of the
+            dictionary of the labels of each glm head for multi-head models.
+        :type batch: dict(numpy.ndarray) or dict(tensorflow.Tensor)
+        :return: The training loss of the update.
+        :rtype: float
+        """
+        batch = tf.nest.map_structure(np.asarray, batch)
+        train_batch = batch
+        if self._buffer.size:
+            replay = self._buffer.sample(self._replay_size)
+            train_batch = tf.nest.map_structure(lambda value, replayed:
+                                                np.concatenate([value, replayed]),
+                                                batch, replay)
+        self._buffer.add(batch)
+        step = self._flow_step if self._updates % self._flow_every == 0 else self._head_step
+        loss = float(step(train_batch))
+        self._updates += 1
+        if self._checkpoint_path is not None and self._updates % self._checkpoint_every == 0:
+            self.checkpoint()
+        return loss
+
+    def checkpoint(self):
+        """ Writes the model to `checkpoint_path`, atomically: the file is
+        written next to it and then renamed.
+        """
+        from .checkpoint import save # pylint: disable=import-outside-toplevel
+        save(self._checkpoint_path + ".tmp", self._model, self._config)
+        os.replace(self._checkpoint_path + ".tmp", self._checkpoint_path)
+
+    def fit_stream(self, stream, max_updates=None, callback=None):
+        """ Updates the model on each batch of a stream, until it is
+        exhausted or `max_updates` updates are done.
+
+        :param stream: Iterable of dictionaries of `features` and `labels`,
+            e.g. a generator or a `tf.data.Dataset`.
+        :type stream: iterable
+        :param max_updates: Maximum number of updates, defaults to `None` (no limit).
+        :type max_updates: int, optional
+        :param callback: Function called after each update with the update
+            number, the loss and the update time (seconds), defaults to `None`.
+        :type callback: callable, optional
+        :return: The number of updates done.
+        :rtype: int
+        """
+        done = 0
+        for batch in stream:
+            if max_updates is not None and done >= max_updates:
+                break
+            start = time.perf_counter()
+            loss = self.update(batch)
+            done += 1
+            if callback is not None:
+                callback(self._updates, loss, time.perf_counter() - start)
+        return done
@@ -1,8 +1,213 @@
 """ Module with plot utilities """
 import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import imageio
+from PIL import GifImagePlugin, Image
+
+
+def figure_to_array(figure, close=True):
+    """ Renders a matplotlib figure in memory, with no intermediate file.
+
+    :param figure: The figure, created by `pyplot` or as a `matplotlib.figure.Figure`.
+    :type figure: matplotlib.figure.Figure
+    :param close: Optional (Default=True). If True, the figure is closed
+        (and released by `pyplot`) after rendering.
+    :type close: bool
+    :return: The RGB image of the figure, of shape `[height, width, 3]`.
+    :rtype: numpy.ndarray
+    """
+    canvas = figure.canvas
+    if not hasattr(canvas, "buffer_rgba"):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg # pylint: disable=import-outside-toplevel
+        canvas = FigureCanvasAgg(figure)
+    canvas.draw()
+    image = np.array(canvas.buffer_rgba())[..., :3]
+    if close:
+        import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+        plt.close(figure)
+    return image
+
+
+def _frame_array(frame):
+    """ RGB image of a frame given as a file name, a matplotlib figure or an image.
+    """
+    if isinstance(frame, (str, os.PathLike)):
+        frame = imageio.imread(frame)
+    elif hasattr(frame, "canvas"):
+        return figure_to_array(frame)
+    frame = np.asarray(frame)
+    if frame.ndim == 2:
+        frame = np.stack([frame] * 3, axis=-1)
+    return frame[..., :3]
+
+
+def _render(function, args):
+    """ Renders a frame in a worker of :class:`AnimationWriter`.
+    """
+    return _frame_array(function(*args))
+
+
+class _GifEncoder:
+    """ Writes an animated gif one frame at a time: each frame is
+    quantized to its own 256 colors palette and appended to the file,
+    so that only the current frame is held in memory.
+    """
+    def __init__(self, path, duration, loop):
+        self._file = open(path, "wb") # pylint: disable=consider-using-with
+        self._duration = int(round(duration * 1000))
+        self._loop = loop
+        self._size = None
+
+    def append_data(self, frame):
+        image = Image.fromarray(np.ascontiguousarray(frame, dtype=np.uint8)).convert("RGB")
+        image = image.quantize(256, method=Image.Quantize.FASTOCTREE)
+        if self._size is None:
+            self._size = image.size
+            # the first frame palette is the global one
+            header, _ = GifImagePlugin.getheader(image, info=dict(loop=self._loop))
+            self._file.write(b"".join(header))
+            data = GifImagePlugin.getdata(image, duration=self._duration)
+        elif image.size != self._size:
+            raise ValueError(f"All the frames must have size {self._size}, not {image.size}.")
+        else:
+            data = GifImagePlugin.getdata(image, duration=self._duration, include_color_table=True)
+        self._file.write(b"".join(data))
+
+    def close(self):
+        if self._size is not None:
+            self._file.write(b";")
+        self._file.close()
+
+
+class AnimationWriter:
+    """ Streaming writer of animations (e.g. of the distribution learned
+    during training): frames are appended one at a time, so memory does
+    not grow with the number of frames, and are rendered by a pool of
+    workers, off the thread that submits them.
+
+    Frames can be file names, images (`numpy` arrays) or matplotlib figures,
+    rendered in memory with no intermediate file. Gif files are encoded
+    frame by frame, other formats (e.g. `.mp4`) are written with
+    `imageio.get_writer`.
+
+    Rendering functions run concurrently in worker threads (unless
+    `processes` is True) and should not use the current figure of `pyplot`:
+    create the figure as a `matplotlib.figure.Figure` instead.
+
+    Example::
+
+        def plot_samples(samples):
+            figure = Figure()
+            figure.add_subplot().scatter(samples[:, 0], samples[:, 1], s=1)
+            return figure
+
+        with AnimationWriter("spqr.gif", duration=0.3) as writer:
+            for epoch in range(epochs):
+                train(epoch)
+                writer.submit(plot_samples, nsf_distribution.sample(1000).numpy())
+
+    :param output: Name of the output file.
+    :type output: str
+    :param duration: Optional (Default=0.5). Time interval (in seconds) between frames.
+    :type duration: float
+    :param loop: Optional (Default=0). Number of loops of a gif, `0` loops forever.
+    :type loop: int
+    :param workers: Optional (Default=2). Number of workers rendering the
+        submitted frames.
+    :type workers: int
+    :param processes: Optional (Default=False). If True, frames are rendered in
+        worker processes instead of threads: the rendering functions and their
+        arguments must then be picklable (e.g. module level functions).
+    :type processes: bool
+    :param max_pending: Optional (Default=`2 * workers`). Maximum number of frames
+        submitted and not yet written: :meth:`submit` blocks when it is reached.
+    :type max_pending: int
+    """
+    def __init__(self,
+                 output,
+                 duration=0.5,
+                 loop=0,
+                 workers=2,
+                 processes=False,
+                 max_pending=None):
+        """ Constructor method.
+        """
+        if os.path.splitext(output)[1].lower() == ".gif":
+            self._writer = _GifEncoder(output, duration, loop)
+        else:
+            self._writer = imageio.get_writer(output, mode="I", fps=1. / duration)
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self._executor = executor(max_workers=workers)
+        self._pending = queue.Queue(maxsize=max_pending or 2 * workers)
+        self._error = None
+        self._frames = 0
+        self._thread = threading.Thread(target=self._write_frames, daemon=True)
+        self._thread.start()
+
+    @property
+    def frames(self):
+        """ Number of frames written so far.
+        """
+        return self._frames
+
+    def _write_frames(self):
+        """ Writes the rendered frames in order of submission.
+        """
+        while True:
+            future = self._pending.get()
+            if future is None:
+                return
+            try:
+                if self._error is None:
+                    self._writer.append_data(future.result())
+                    self._frames += 1
+            except Exception as error: # pylint: disable=broad-except
+                self._error = error
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, function, *args):
+        """ Renders `function(*args)` in a worker and appends the result (a
+        matplotlib figure, an image or a file name) as the next frame.
+
+        :param function: The rendering function.
+        :type function: callable
+        """
+        self._check()
+        self._pending.put(self._executor.submit(_render, function, args))
+
+    def append(self, frame):
+        """ Appends a frame: a file name, an image or a matplotlib figure
+        (rendered immediately, in the calling thread).
+
+        :param frame: The frame.
+        :type frame: str, numpy.ndarray or matplotlib.figure.Figure
+        """
+        self._check()
+        future = Future()
+        future.set_result(_frame_array(frame))
+        self._pending.put(future)
+
+    def close(self):
+        """ Waits for the submitted frames to be written and closes the file.
+        """
+        self._pending.put(None)
+        self._thread.join()
+        self._executor.shutdown()
+        self._writer.close()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 def make_gif(input_im,
@@ -11,6 +216,7 @@ def make_gif(input_im,
              keep_im=False):
     """
     Function to create a gif out of a list of figures.
+    Frames are read and appended one at a time (see :class:`AnimationWriter`).
 
     :param input_im: file names of images to compose the animated gif.
     :type input_im: list[str]
@@ -21,17 +227,17 @@ def make_gif(input_im,
     :param keep_im: Optional (Default=False). If True, the images used to create the gif are kept in memory; otherwise they are deleted.
     :type keep_im: bool
     :raise OSError: Incorrect file(s) name.
-    
+
     """
 
     # Check for correct paths
-    path_bool = np.array([os.path.exists(os.path.abspath(im))
-                          for im in input_im])
-    if not path_bool.any():
-        raise OSError
+    missing = [im for im in input_im if not os.path.exists(os.path.abspath(im))]
+    if missing:
+        raise OSError(f"Missing images: {missing}")
 
-    fig_list = [imageio.imread(fig) for fig in input_im]
-    imageio.mimsave(output_gif, fig_list, duration=duration)
+    with AnimationWriter(output_gif, duration=duration) as writer:
+        for fig in input_im:
+            writer.submit(_frame_array, fig)
     # Eliminating images to save space
     if not keep_im:
         for fig in input_im:
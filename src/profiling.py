@@ -0,0 +1,260 @@
+""" Module with per-stage profiling of Diglm models """
+import glob
+import os
+import re
+import shutil
+import tempfile
+
+import tensorflow as tf
+
+_COUPLING_LAYER = re.compile(r"coupling_layer_\d+")
+_UNIQUIFIED = re.compile(r"_\d+$")
+
+
+class StageStats:
+    """ Time and op counts of the stages of a model, aggregated over
+    several profiled steps.
+
+    The stage of an op is given by its name scopes among `STAGES`
+    (and `coupling_layer_{i}`), truncated to the first `depth` ones:
+    `spqr.NeuralSplineFlow` runs each coupling layer in a
+    `coupling_layer_{i}` scope, with the `conditioner` network and the
+    `spline` evaluation in nested scopes (the masking is left in the
+    coupling layer scope), and `diglm.Diglm` runs its `flow`, `glm`,
+    `features_log_prob` and `labels_log_prob` stages in scopes of these
+    names. The ops of the backward pass are reported in separate
+    `backward` stages, the ops outside of any stage in `(other)`.
+
+    :param depth: Number of name scope components of a stage, defaults to `3`.
+    :type depth: int, optional
+    """
+    STAGES = ("flow", "glm", "features_log_prob", "labels_log_prob", "conditioner", "spline")
+
+    def __init__(self, depth=3):
+        """ Constructor method.
+        """
+        self._depth = depth
+        self._stages = {}
+        self._steps = 0
+        self._peak_memory = None
+
+    @property
+    def steps(self):
+        """ Number of profiled steps
+        """
+        return self._steps
+
+    @property
+    def peak_memory(self):
+        """ Peak memory (bytes) allocated during a profiled step, `None`
+        if the device does not report it
+        """
+        return self._peak_memory
+
+    def stage(self, op_name):
+        """ Stage of an op of the given (full) name.
+
+        :param op_name: Op name, with its name scopes.
+        :type op_name: str
+        :return: The stage.
+        :rtype: str
+        """
+        backward = False
+        stages = []
+        for scope in op_name.split("/"):
+            if _COUPLING_LAYER.fullmatch(scope):
+                stages.append(scope)
+            elif scope in ("gradient_tape", "gradients"):
+                backward = True
+            # scopes entered again in the same graph are uniquified as `glm_1`
+            elif _UNIQUIFIED.sub("", scope) in self.STAGES:
+                stages.append(_UNIQUIFIED.sub("", scope))
+        stage = "/".join(stages[:self._depth]) or "(other)"
+        return f"{stage} (backward)" if backward else stage
+
+    def add_trace(self, logdir, num_steps=1):
+        """ Adds the ops of the last profiler trace written in `logdir`.
+
+        :param logdir: Directory of the profiler trace.
+        :type logdir: str
+        :param num_steps: Number of steps in the trace, defaults to `1`.
+        :type num_steps: int, optional
+        """
+        for op_name, seconds in _trace_ops(logdir):
+            stage = self.stage(op_name)
+            ops, total = self._stages.get(stage, (0, 0.))
+            self._stages[stage] = (ops + 1, total + seconds)
+        self._steps += num_steps
+
+    def add_peak_memory(self, peak_memory):
+        """ Updates the peak memory of a step.
+
+        :param peak_memory: Peak memory (bytes).
+        :type peak_memory: int
+        """
+        self._peak_memory = max(self._peak_memory or 0, peak_memory)
+
+    def summary(self):
+        """ Time and ops per step of each stage, slowest first.
+
+        :return: Dictionary of `(ops, seconds)` per step of each stage.
+        :rtype: dict(tuple)
+        """
+        steps = max(self._steps, 1)
+        return {stage: (ops / steps, seconds / steps) for stage, (ops, seconds)
+                in sorted(self._stages.items(), key=lambda item: -item[1][1])}
+
+    def table(self):
+        """ Per-stage table of the time and ops per step.
+
+        :return: The table.
+        :rtype: str
+        """
+        summary = self.summary()
+        total = sum(seconds for _, seconds in summary.values()) or 1.
+        width = max([len(stage) for stage in summary] + [5])
+        lines = [f"{'stage':<{width}} | {'ms/step':>8} | {'share':>6} | {'ops/step':>8}"]
+        for stage, (ops, seconds) in summary.items():
+            lines.append(f"{stage:<{width}} | {seconds * 1e3:>8.3f} | "
+                         f"{seconds / total:>6.1%} | {ops:>8.1f}")
+        if self._peak_memory is not None:
+            lines.append(f"peak memory: {self._peak_memory / 2**20:.1f} MB")
+        return "\n".join(lines)
+
+
+class StageProfiler:
+    """ Profiling hook: wraps a step function so that one call every
+    `every` runs under the TensorFlow profiler and its ops are added
+    to :attr:`stats`. The other calls only increment a counter, and
+    the name scopes of the stages have no cost at run time.
+
+    It can be given to `trainer.DiglmTrainer.fit`, where a call
+    runs up to `steps_per_execution` steps, all counted in the per-step
+    statistics (create the trainer with `jit_compile=False`: XLA
+    clusters hide the name scopes).
+
+    :param every: Number of calls between profiled ones, defaults to `100`.
+    :type every: int, optional
+    :param depth: Number of name scope components of a stage, defaults to `3`.
+    :type depth: int, optional
+    :param logdir: Directory of the profiler traces, to be kept e.g. for
+        TensorBoard, defaults to `None` (temporary directories).
+    :type logdir: str, optional
+    :param device: Device whose peak memory is recorded, defaults to `"CPU:0"`.
+    :type device: str, optional
+    """
+    def __init__(self, every=100, depth=3, logdir=None, device="CPU:0"):
+        """ Constructor method.
+        """
+        self._every = every
+        self._logdir = logdir
+        self._device = device
+        self._calls = 0
+        self.stats = StageStats(depth)
+
+    def profile(self, function, *args, num_steps=1, steps=None):
+        """ Calls `function(*args)` `num_steps` times under the profiler
+        and adds their ops to :attr:`stats`.
+
+        :param function: The function.
+        :type function: callable
+        :param num_steps: Number of calls, defaults to `1`.
+        :type num_steps: int, optional
+        :param steps: Function of the result of a call returning the number of
+            steps it ran, defaults to `None` (one step per call).
+        :type steps: callable, optional
+        :return: The result of the last call.
+        """
+        logdir = self._logdir or tempfile.mkdtemp(prefix="diglm_profile_")
+        try:
+            tf.config.experimental.reset_memory_stats(self._device)
+            track_memory = True
+        # reset_memory_stats only exists from TensorFlow 2.9
+        except (AttributeError, ValueError):
+            track_memory = False
+        executed = 0
+        tf.profiler.experimental.start(logdir)
+        try:
+            for _ in range(num_steps):
+                result = function(*args)
+                tf.nest.map_structure(lambda t: t.numpy() if hasattr(t, "numpy") else t, result)
+                executed += 1 if steps is None else int(steps(result))
+        finally:
+            tf.profiler.experimental.stop()
+        self.stats.add_trace(logdir, executed)
+        if track_memory:
+            self.stats.add_peak_memory(tf.config.experimental.get_memory_info(self._device)["peak"])
+        if self._logdir is None:
+            shutil.rmtree(logdir, ignore_errors=True)
+        return result
+
+    def wrap(self, function, steps=None):
+        """ Returns the function profiled once every `every` calls.
+
+        :param function: The step function.
+        :type function: callable
+        :param steps: Function of the result of a call returning the number of
+            steps it ran, defaults to `None` (one step per call).
+        :type steps: callable, optional
+        :return: The wrapped function.
+        :rtype: callable
+        """
+        def wrapped(*args, **kwargs):
+            self._calls += 1
+            if self._calls % self._every:
+                return function(*args, **kwargs)
+            return self.profile(lambda: function(*args, **kwargs), steps=steps)
+        return wrapped
+
+
+def profile_steps(function, *args, num_steps=10, depth=3, logdir=None, device="CPU:0"):
+    """ Calls `function(*args)` once to trace it, then `num_steps` times
+    under the TensorFlow profiler, and returns the time of each stage.
+
+    Example::
+
+        stats = profile_steps(tf.function(model.weighted_log_prob), batch)
+        print(stats.table())
+
+    :param function: The step function, e.g. a `tf.function`.
+    :type function: callable
+    :param num_steps: Number of profiled steps, defaults to `10`.
+    :type num_steps: int, optional
+    :param depth: Number of name scope components of a stage, defaults to `3`.
+    :type depth: int, optional
+    :param logdir: Directory of the profiler traces, defaults to `None` (temporary).
+    :type logdir: str, optional
+    :param device: Device whose peak memory is recorded, defaults to `"CPU:0"`.
+    :type device: str, optional
+    :return: Per-stage statistics of the steps.
+    :rtype: StageStats
+    """
+    function(*args)
+    profiler = StageProfiler(depth=depth, logdir=logdir, device=device)
+    profiler.profile(function, *args, num_steps=num_steps)
+    return profiler.stats
+
+
+def _trace_ops(logdir):
+    """ Yields the name and duration (seconds) of the TensorFlow ops
+    executed on the host in the last profiler trace of `logdir`.
+    """
+    try:
+        from tensorflow.tsl.profiler.protobuf import xplane_pb2 # pylint: disable=import-outside-toplevel
+    except ImportError:
+        from tensorflow.core.profiler.protobuf import xplane_pb2 # pylint: disable=import-outside-toplevel
+    paths = glob.glob(os.path.join(logdir, "plugins", "profile", "*", "*.xplane.pb"))
+    if not paths:
+        return
+    space = xplane_pb2.XSpace()
+    with open(max(paths, key=os.path.getmtime), "rb") as file:
+        space.ParseFromString(file.read())
+    for plane in space.planes:
+        if not plane.name.startswith("/host:"):
+            continue
+        for line in plane.lines:
+            for event in line.events:
+                metadata = plane.event_metadata[event.metadata_id]
+                # op events are named "scope/name:type" and displayed as their type
+                if metadata.display_name and ":" in metadata.name:
+                    yield metadata.name.rsplit(":", 1)[0], event.duration_ps * 1e-12
@@ -0,0 +1,301 @@
+""" Module with a batched inference engine for Diglm models """
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import tensorflow as tf
+
+
+class InferenceEngine:
+    """ Compiled, batched inference for :class:`diglm.Diglm`.
+
+    Requests are served by `tf.function`s traced once for each batch size in
+    `buckets`. A batch is padded to the smallest bucket holding it, and batches
+    larger than the largest bucket are split, so nothing is retraced while
+    serving. Each call runs the flow once. It returns the glm outputs of
+    `Diglm.__call__` (`mean`, `variance`, `grad_mean`, suffixed by `_<head>`
+    for multi-head models) and the `features_log_prob` of
+    `Diglm.log_prob_parts`, e.g. to flag out-of-distribution events.
+
+    A serving process can hot-swap the weights of a model trained online
+    (see `online.OnlineTrainer`) with :meth:`reload`: each batch is served
+    entirely by the old or by the new weights.
+
+    Single events submitted concurrently by threads (:meth:`submit`) or
+    coroutines (:meth:`predict_async`) are coalesced into micro-batches.
+    A batch runs as soon as it fills the largest bucket, or when its oldest
+    request has waited `max_wait` seconds.
+
+    :param model: The model.
+    :type model: diglm.Diglm
+    :param buckets: Batch sizes of the compiled functions, defaults to `(1, 8, 64, 512)`.
+    :type buckets: tuple(int), optional
+    :param max_wait: Maximum time (in seconds) a request waits for others to be
+        batched with, defaults to `0.002`.
+    :type max_wait: float, optional
+    :param jit_compile: Whether the functions are compiled with XLA, defaults to `False`.
+    :type jit_compile: bool, optional
+    """
+    def __init__(self,
+                 model,
+                 buckets=(1, 8, 64, 512),
+                 max_wait=0.002,
+                 jit_compile=False):
+        """ Constructor method.
+        """
+        self._setup(model, model.num_features, max_wait)
+        self._buckets = tuple(sorted(buckets))
+        self._infer = tf.function(self._infer_batch, jit_compile=jit_compile)
+        self._functions = {bucket: self._infer.get_concrete_function(self._spec(bucket))
+                           for bucket in self._buckets}
+
+    def _setup(self, model, num_features, max_wait, saved=None):
+        """ State of the engines created by the constructor and by :meth:`load`,
+        without the compiled functions.
+        """
+        self._model = model
+        self._num_features = num_features
+        self._max_wait = max_wait
+        self._saved = saved
+        self._infer = None
+        self._functions = {}
+        self._buckets = ()
+        self._lock = threading.Lock()
+        self._reloaded = None
+        self._queue = queue.Queue()
+        self._worker = None
+        # not self._lock: close joins a worker that needs it to serve the last batch
+        self._worker_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, max_wait=0.002):
+        """ Engine serving the functions of a SavedModel written by :meth:`export`.
+        The functions are restored already traced: neither the model nor its
+        Python code are needed, and nothing is traced again.
+
+        :param path: Directory of the SavedModel.
+        :type path: str or Path.like object
+        :param max_wait: Maximum time (in seconds) a request waits for others to be
+            batched with, defaults to `0.002`.
+        :type max_wait: float, optional
+        :return: The engine.
+        :rtype: InferenceEngine
+        """
+        saved = tf.saved_model.load(str(path))
+        functions = {int(name[len("batch_"):]): function
+                     for name, function in saved.signatures.items()
+                     if name.startswith("batch_")}
+        spec = functions[min(functions)].structured_input_signature[1]["features"]
+        engine = cls.__new__(cls)
+        engine._setup(None, spec.shape[-1], max_wait, saved)
+        engine._functions = functions
+        engine._buckets = tuple(sorted(functions))
+        return engine
+
+    @property
+    def buckets(self):
+        """ Batch sizes of the compiled functions
+        """
+        return self._buckets
+
+    def _spec(self, batch_size):
+        return tf.TensorSpec([batch_size, self._num_features], tf.float32, name="features")
+
+    def _infer_batch(self, features):
+        latents, ildj = self._model.latent_features_and_log_det_jacobian(features)
+        eta = self._model.eta_from_latents(latents)
+        outputs = {"features_log_prob": self._model.features_log_prob_from_latents(latents, ildj)}
+        if self._model.heads is None:
+            glms, etas = {"": self._model.glm}, [eta]
+        else:
+            glms, etas = self._model.glm, tf.split(eta, len(self._model.heads), axis=-1)
+        for (name, glm), head_eta in zip(glms.items(), etas):
+            suffix = name and "_" + name
+            mean, variance, grad_mean = glm(head_eta)
+            outputs["mean" + suffix] = mean
+            outputs["variance" + suffix] = variance
+            outputs["grad_mean" + suffix] = grad_mean
+        return outputs
+
+    def warmup(self):
+        """ Runs each compiled function once, so that the first requests
+        do not pay for graph optimizations and memory allocations.
+
+        :return: Time (seconds) spent warming up.
+        :rtype: float
+        """
+        start = time.perf_counter()
+        for bucket, function in self._functions.items():
+            function(features=tf.zeros([bucket, self._num_features]))
+        return time.perf_counter() - start
+
+    def predict(self, features):
+        """ Computes the outputs of a batch of events.
+
+        :param features: Features, of shape `[batch_size, num_features]`.
+        :type features: numpy.ndarray or tensorflow.Tensor
+        :return: Dictionary of outputs, each of length `batch_size` (possibly 0).
+        :rtype: dict(numpy.ndarray)
+        """
+        features = np.asarray(features, dtype=np.float32)
+        if not features.size:
+            features = features.reshape(0, self._num_features)
+        largest = self._buckets[-1]
+        chunks = []
+        # an empty batch runs the smallest bucket, for the keys and shapes of the outputs
+        for start in range(0, max(len(features), 1), largest):
+            chunk = features[start:start + largest]
+            bucket = next(b for b in self._buckets if b >= len(chunk))
+            padded = np.zeros([bucket, features.shape[1]], dtype=np.float32)
+            padded[:len(chunk)] = chunk
+            with self._lock:
+                outputs = self._functions[bucket](features=tf.constant(padded))
+            chunks.append({key: value.numpy()[:len(chunk)] for key, value in outputs.items()})
+        return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+    def reload(self, path, force=False):
+        """ Assigns to the model the weights of a checkpoint written by
+        `checkpoint.save`, if the file changed since the last reload.
+        Requests are not served while the weights are assigned.
+
+        :param path: Path of the checkpoint.
+        :type path: str or Path.like object
+        :param force: Whether the checkpoint is loaded even if it did not change,
+            defaults to `False`.
+        :type force: bool, optional
+        :return: Whether the weights were reloaded.
+        :rtype: bool
+        :raises: ValueError
+        """
+        if self._model is None:
+            raise ValueError("The weights of a loaded SavedModel cannot be reloaded.")
+        from .checkpoint import load # pylint: disable=import-outside-toplevel
+        stat = os.stat(path)
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if version == self._reloaded and not force:
+            return False
+        with self._lock:
+            load(path, self._model)
+        self._reloaded = version
+        return True
+
+    def start(self):
+        """ Starts the thread running the micro-batches. It is started by the
+        first :meth:`submit` if needed.
+        """
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._serve, daemon=True)
+                self._worker.start()
+
+    def close(self):
+        """ Serves the pending requests and stops the micro-batching thread.
+        """
+        with self._worker_lock:
+            if self._worker is not None:
+                self._queue.put(None)
+                self._worker.join()
+                self._worker = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, features):
+        """ Submits a single event to be served in a micro-batch.
+
+        :param features: Features of the event, of shape `[num_features]`.
+        :type features: numpy.ndarray
+        :return: Future of the dictionary of outputs of the event.
+        :rtype: concurrent.futures.Future
+        :raises: ValueError
+        """
+        # checked here, so that a malformed event fails only for its caller
+        # and not for the whole micro-batch it would be stacked into
+        features = np.asarray(features, dtype=np.float32)
+        if features.shape != (self._num_features,):
+            raise ValueError(f"An event must have shape ({self._num_features},), "
+                             f"got {features.shape}.")
+        self.start()
+        future = Future()
+        self._queue.put((time.monotonic(), features, future))
+        return future
+
+    async def predict_async(self, features):
+        """ Coroutine version of :meth:`submit`.
+
+        :param features: Features of the event, of shape `[num_features]`.
+        :type features: numpy.ndarray
+        :return: Dictionary of outputs of the event.
+        :rtype: dict(numpy.ndarray)
+        :raises: ValueError
+        """
+        return await asyncio.wrap_future(self.submit(features))
+
+    def _serve(self):
+        largest = self._buckets[-1]
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = request[0] + self._max_wait
+            while len(batch) < largest:
+                try:
+                    request = self._queue.get(timeout=max(deadline - time.monotonic(), 0.))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+            # requests cancelled while queued (e.g. by a timeout of predict_async)
+            # are dropped, the others cannot be cancelled anymore
+            batch = [request for request in batch if request[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outputs = self.predict(np.stack([features for _, features, _ in batch]))
+            except Exception as err: # pylint: disable=broad-except
+                for _, _, future in batch:
+                    future.set_exception(err)
+                continue
+            for index, (_, _, future) in enumerate(batch):
+                future.set_result({key: value[index] for key, value in outputs.items()})
+
+    def export(self, path, buckets=None, serving_default=True):
+        """ Saves the compiled functions as a SavedModel, with a `batch_<size>`
+        signature for each bucket and a `serving_default` one accepting any
+        batch size. It can be served again by :meth:`load`.
+
+        Loading restores every function of the SavedModel, so that a
+        worker starts faster when only the buckets it uses are exported.
+
+        :param path: Directory of the SavedModel.
+        :type path: str or Path.like object
+        :param buckets: Buckets to export, defaults to `None` (all of them).
+        :type buckets: tuple(int), optional
+        :param serving_default: Whether the `serving_default` signature is
+            exported, defaults to `True`.
+        :type serving_default: bool, optional
+        """
+        buckets = self._buckets if buckets is None else buckets
+        signatures = {f"batch_{bucket}": self._functions[bucket] for bucket in buckets}
+        if self._model is None:
+            module = self._saved
+            if serving_default:
+                signatures["serving_default"] = self._saved.signatures["serving_default"]
+        else:
+            module = tf.Module()
+            module.model_variables = list(self._model.variables)
+            if serving_default:
+                signatures["serving_default"] = self._infer.get_concrete_function(self._spec(None))
+        tf.saved_model.save(module, str(path), signatures=signatures)
@@ -1,8 +1,17 @@
 # Marco Riggirello & Antoine Venturini
-from tensorflow import expand_dims, reshape, Module
-from tensorflow.python.keras.layers import Layer, Dense, Activation
-from tensorflow.python.keras.activations import softmax, softplus
-from tensorflow_probability.python.bijectors import RealNVP, Chain, RationalQuadraticSpline
+from collections import namedtuple
+
+import numpy as np
+from tensorflow import (broadcast_dynamic_shape, broadcast_to, cast, clip_by_value, concat,
+                        convert_to_tensor, cumsum, expand_dims, floor, gather, int64, ones_like,
+                        reshape, searchsorted, split, sqrt, where, zeros, zeros_like, shape, TensorShape,
+                        float32, int8, matmul, name_scope, recompute_grad, stack, unstack,
+                        Module, Variable)
+from tensorflow.math import log
+from tensorflow.random import normal as random_normal
+from tensorflow.nn import softmax, softplus
+from tensorflow.python.keras.layers import Layer, Dense
+from tensorflow_probability.python.bijectors import Bijector, RealNVP, Chain, RationalQuadraticSpline
 
 
 class SplineBlock(Layer):
@@ -26,16 +35,31 @@ class SplineBlock(Layer):
     :type min_bin_gap: float, optional
     :param min_slope: Mimimum spline slope in each bin, defaults to `1e-3`.
     :type min_slope: float, optional
+    :param uniform_bins: If `True` or `"y"` (or `"x"`), the bins have fixed, equal
+        sizes on the y (or x) side, and only the sizes on the other side and
+        the slopes are learned, defaults to `False`.
+        See :class:`UniformRationalQuadraticSpline`.
+    :type uniform_bins: bool or str, optional
+    :param precision: Compute precision of the dense layers, one of `PRECISIONS`,
+        defaults to `"float32"`. See :meth:`set_precision`.
+    :type precision: str, optional
+    :raises: ValueError
     """
+    PRECISIONS = ("float32", "bfloat16", "int8")
+
     def __init__(self,
                  nunits,
                  nbins,
                  border,
                  hidden_layers=[512,512],
                  min_bin_gap=1e-3,
-                 min_slope=1e-3):
+                 min_slope=1e-3,
+                 uniform_bins=False,
+                 precision="float32"):
         """ Constructor method.
         """
+        if uniform_bins not in (False, True, "x", "y"):
+            raise ValueError(f"uniform_bins must be a bool, \"x\" or \"y\", not {uniform_bins}.")
         super().__init__(name="spline_block")
         self._nunits = nunits
         self._nbins = nbins
@@ -43,21 +67,150 @@ class SplineBlock(Layer):
         self._border = border
         self._min_bin_gap = min_bin_gap
         self._min_slope = min_slope
+        self._uniform_bins = uniform_bins
+        self._nwidths = 0 if uniform_bins else nbins
         self._hidden_layers = [
             Dense(n,activation="relu",name=f"spqr_nn_layer_{i}")
             for i,n in enumerate(hidden_layers)
         ]
-        self._widths_layer = Dense(self._nunits * self._nbins, name="widths_layer")
-        self._heights_layer = Dense(self._nunits * self._nbins, name="heights_layer")
-        self._slopes_layer = Dense(self._nunits * self._nslopes, name="slopes_layer")
+        self._params_layer = Dense(self._nunits * (self._nwidths + self._nbins + self._nslopes),
+                                   name="spline_params_layer")
+        self._precision = "float32"
+        self._pending_precision = precision
+
+    @property
+    def precision(self):
+        """ Compute precision of the dense layers.
+        """
+        return self._precision
+
+    def set_precision(self, precision):
+        """ Sets the compute precision of the dense layers, the spline
+        parameters are always returned in float32.
+
+        - `"float32"`: full precision.
+        - `"bfloat16"`: inputs and (float32) weights are cast to bfloat16
+          before each matrix multiplication.
+        - `"int8"`: post-training quantization of the current weights.
+          The dense layers are replaced by layers with int8 (non trainable)
+          kernels and one float32 scale per output unit, see
+          :func:`quantize_weights`, dequantized after each matrix
+          multiplication. The float32 layers are released: the int8 ones are
+          the only kernels kept in memory, saved by `checkpoint.save` and
+          exported by `serving.InferenceEngine.export`. The conversion is one
+          way, the precision of an int8 block cannot be changed again.
+
+        Functions already traced keep the previous precision (and the
+        variables they use).
+
+        :param precision: One of `PRECISIONS`.
+        :type precision: str
+        :raises: ValueError
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"precision must be one of {self.PRECISIONS}, not {precision}.")
+        if not self.built:
+            self._pending_precision = precision
+            return
+        if self._precision == "int8" and precision != "int8":
+            raise ValueError("The float32 kernels of an int8 SplineBlock are released, "
+                             "load the float32 weights in a new model instead.")
+        if precision == "int8" and self._precision != "int8":
+            # assigning the attributes replaces the float32 layers in the tracked
+            # variables and checkpoint dependencies, nothing else refers to them
+            self._hidden_layers = [_Int8Dense(layer) for layer in self._hidden_layers]
+            self._params_layer = _Int8Dense(self._params_layer)
+        self._precision = precision
+
+    def build(self, input_shape):
+        """ Creates the variables of the dense layers.
+
+        :param input_shape: Shape of the input tensor.
+        :type input_shape: tensorflow.TensorShape
+        """
+        units = input_shape[-1]
+        for layer in self._hidden_layers:
+            layer.build((None, units))
+            units = layer.units
+        self._params_layer.build((None, units))
+        super().build(input_shape)
+        self.set_precision(self._pending_precision)
+
+    def hidden_units(self, units):
+        """ Applies the hidden dense layers with the current precision.
+
+        :param units: Input tensor.
+        :type units: tensorflow.Tensor
+        :return: The output of the last hidden layer.
+        :rtype: tensorflow.Tensor
+        """
+        if self._precision in ("float32", "int8"):
+            for layer in self._hidden_layers:
+                units = layer(units)
+            return units
+        units = cast(units, self._precision)
+        for layer in self._hidden_layers:
+            units = layer.activation(matmul(units, cast(layer.kernel, self._precision))
+                                     + cast(layer.bias, self._precision))
+        return units
+
+    def _params_layer_outputs(self, units, splines=None):
+        """ Applies the parameters dense layer with the current precision,
+        computing only the outputs of the given `splines` (all by default).
+        """
+        if splines is None and self._precision in ("float32", "int8"):
+            return self._params_layer(units)
+        kernel = self._params_layer.kernel
+        scale = self._params_layer.scale if self._precision == "int8" else None
+        bias = self._params_layer.bias
+        if splines is not None:
+            select = lambda w: reshape(gather(reshape(w, concat([shape(w)[:-1], [self._nunits, -1]],
+                                                                axis=0)),
+                                              splines, axis=-2),
+                                       concat([shape(w)[:-1], [-1]], axis=0))
+            kernel, bias = select(kernel), select(bias)
+            scale = None if scale is None else select(scale)
+        if self._precision == "int8":
+            return matmul(units, cast(kernel, float32)) * scale + bias
+        if self._precision == "float32":
+            return matmul(units, kernel) + bias
+        return cast(matmul(units, cast(kernel, self._precision)) + cast(bias, self._precision),
+                    float32)
+
+    def _dense_stack(self, units):
+        """ Applies the hidden and parameters dense layers with the current precision.
+        """
+        return self._params_layer_outputs(self.hidden_units(units))
+
+    def spline_params(self, units, splines=None):
+        """ Spline parameters from the output of :meth:`hidden_units`, only
+        for the given `splines`, e.g. those transformed by a coupling layer
+        when the network is shared by several layers (see :class:`SharedSplineTrunk`).
+
+        :param units: Output of the hidden layers.
+        :type units: tensorflow.Tensor
+        :param splines: Indices of the splines, defaults to `None` (all).
+        :type splines: list[int], optional
+        :return: The widths, heights and slopes, as returned by :meth:`call`.
+        :rtype: tuple(tensorflow.Tensor)
+        """
+        if units.shape.rank == 1:
+            params = self._params_layer_outputs(expand_dims(units, axis=0), splines)[0]
+        else:
+            params = self._params_layer_outputs(units, splines)
+        return self._split_params(params, self._nunits if splines is None else len(splines))
 
     def call(self, units):
         """ Returns the units tensor transformed by the neural network.
 
+        A single dense layer computes all the spline parameters, laid out as
+        `[widths, heights, slopes]` for each unit, which are then split
+        into widths, heights and slopes.
+
         :param units: Input tensor.
         :type units: tensorflow.Tensor
         :return: One tensor for bin x coordinates (widths), one for y coordinates
-            (heights) and one for slopes.
+            (heights) and one for slopes. With uniform bins, only heights and slopes.
         :rtype: tensorflow.Tensor
         """
         if units.shape.rank == 1:
@@ -65,36 +218,279 @@ class SplineBlock(Layer):
             adjust_rank = lambda x: x[0]
         else:
             adjust_rank = lambda x: x
-        for layer in self._hidden_layers:
-            units = layer(units)
-
-        widths = adjust_rank(self._widths_layer(units))
-        widths = reshape(widths,
-                         widths
-                         .shape[:-1]
-                         .concatenate((self._nunits, self._nbins)))
-        widths = Activation(softmax)(widths)
-        widths = widths * (2 * self._border - self._nbins * self._min_bin_gap ) - self._min_bin_gap
+        return self._split_params(adjust_rank(self._dense_stack(units)), self._nunits)
 
-        heights = adjust_rank(self._heights_layer(units))
-        heights = reshape(heights,
-                          heights
-                          .shape[:-1]
-                          .concatenate((self._nunits, self._nbins)))
-        heights = Activation(softmax)(heights)
-        heights = heights * (2 * self._border - self._nbins * self._min_bin_gap ) - self._min_bin_gap
+    def _split_params(self, params, nunits):
+        """ Splits the output of the parameters layer into the widths,
+        heights and slopes of `nunits` splines.
+        """
+        params = reshape(params,
+                         concat([shape(params)[:-1],
+                                 [nunits, self._nwidths + self._nbins + self._nslopes]],
+                                axis=0))
+        widths, heights, slopes = split(params,
+                                        [self._nwidths, self._nbins, self._nslopes],
+                                        axis=-1)
 
-        slopes = adjust_rank(self._slopes_layer(units))
-        slopes = reshape(slopes,
-                         slopes
-                         .shape[:-1]
-                         .concatenate((self._nunits, self._nslopes)))
-        slopes = Activation(softplus)(slopes)
+        slopes = softplus(slopes)
         slopes = slopes + self._min_slope
 
+        if self._uniform_bins:
+            # sizes sum up to 2 * border, the span of the uniform bins range
+            sizes = softmax(heights, axis=-1)
+            sizes = sizes * (2 * self._border - self._nbins * self._min_bin_gap) + self._min_bin_gap
+            return sizes, slopes
+
+        widths = softmax(widths, axis=-1)
+        widths = widths * (2 * self._border - self._nbins * self._min_bin_gap ) - self._min_bin_gap
+
+        heights = softmax(heights, axis=-1)
+        heights = heights * (2 * self._border - self._nbins * self._min_bin_gap ) - self._min_bin_gap
+
         return widths, heights, slopes
 
 
+def fuse_spline_block_weights(weights):
+    """ Converts the weights of a :class:`SplineBlock` with separate widths,
+    heights and slopes dense layers (as returned by `get_weights`) to the
+    layout of the single fused parameters layer.
+
+    :param weights: Weights of the hidden layers followed by kernel and bias
+        of the widths, heights and slopes layers.
+    :type weights: list[numpy.ndarray]
+    :return: Weights to be loaded with `SplineBlock.set_weights`.
+    :rtype: list[numpy.ndarray]
+    """
+    hidden, heads = list(weights[:-6]), weights[-6:]
+    # widths have nunits * nbins outputs, slopes nunits * (nbins - 1)
+    nunits = heads[1].shape[-1] - heads[5].shape[-1]
+    kernel = np.concatenate([np.reshape(k, k.shape[:-1] + (nunits, -1)) for k in heads[0::2]],
+                            axis=-1)
+    bias = np.concatenate([np.reshape(b, (nunits, -1)) for b in heads[1::2]], axis=-1)
+    return hidden + [np.reshape(kernel, kernel.shape[:-2] + (-1,)), np.reshape(bias, -1)]
+
+
+def quantize_weights(kernel):
+    """ Symmetric int8 post-training quantization of a dense layer kernel,
+    with one scale for each output unit: `kernel ~ quantized * scales`.
+
+    :param kernel: The kernel, of shape `[inputs, units]`.
+    :type kernel: numpy.ndarray
+    :return: The int8 quantized kernel and the float32 scales.
+    :rtype: tuple(numpy.ndarray)
+    """
+    scales = np.maximum(np.abs(kernel).max(axis=0), 1e-12) / 127.
+    quantized = np.clip(np.round(kernel / scales), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class _Int8Dense(Layer):
+    """ Dense layer with an int8 kernel and one float32 scale for each output
+    unit, quantized from a built float32 dense layer by :func:`quantize_weights`.
+    The kernel is dequantized after the matrix multiplication.
+
+    Inherits from :class: `tensorflow.keras.layers.Layer`.
+
+    :param layer: The float32 layer.
+    :type layer: tensorflow.keras.layers.Dense
+    """
+    def __init__(self, layer):
+        """ Constructor method.
+        """
+        super().__init__(name=f"{layer.name}_int8")
+        quantized, scales = quantize_weights(layer.kernel.numpy())
+        self.units = layer.units
+        self.activation = layer.activation
+        self.kernel = self.add_weight(name="kernel", shape=quantized.shape, dtype=int8,
+                                      initializer="zeros", trainable=False)
+        self.scale = self.add_weight(name="scale", shape=scales.shape,
+                                     initializer="zeros", trainable=False)
+        self.bias = self.add_weight(name="bias", shape=[self.units], initializer="zeros")
+        self.kernel.assign(quantized)
+        self.scale.assign(scales)
+        self.bias.assign(layer.bias)
+        self.built = True
+
+    def call(self, units):
+        """ Returns the activation of the dequantized dense transformation.
+
+        :param units: Input tensor.
+        :type units: tensorflow.Tensor
+        :rtype: tensorflow.Tensor
+        """
+        return self.activation(matmul(units, cast(self.kernel, float32)) * self.scale + self.bias)
+
+
+_UniformSplineShared = namedtuple(
+    "_UniformSplineShared", "out_of_bounds x_k y_k d_k d_kp1 h_k w_k s_k")
+
+
+class UniformRationalQuadraticSpline(Bijector):
+    """ Rational quadratic spline whose bins have all the same width on
+    one side, x or y.
+
+    The knots coordinates on the `uniform_side` are evenly spaced in the
+    interval `[range_min, range_min + sum(bin_sizes)]`, those on the other
+    side are given by the cumulative `bin_sizes`. The bin of an input on the
+    uniform side is found with a single division instead of a search over
+    the knots: with `uniform_side="y"` (the default) this is the inverse,
+    which :class:`NeuralSplineFlow` runs to compute latents and log
+    probabilities, with `uniform_side="x"` the forward, which runs when
+    sampling. The other direction still searches the knots. Outside the
+    interval the spline is the identity.
+
+    Inherits from :class: `tensorflow_probability.bijectors.Bijector`.
+
+    :param bin_sizes: Sizes of the bins on the non uniform side (widths for
+        `uniform_side="y"`, heights for `uniform_side="x"`), last dimension
+        is the number of bins.
+    :type bin_sizes: tensorflow.Tensor
+    :param knot_slopes: Slopes at the interior knots, last dimension is
+        the number of bins minus one.
+    :type knot_slopes: tensorflow.Tensor
+    :param range_min: Lower bound of the splines interval.
+    :type range_min: float
+    :param uniform_side: Side of the evenly spaced knots, `"x"` or `"y"`,
+        defaults to `"y"`.
+    :type uniform_side: str, optional
+    :raises: ValueError
+    """
+    def __init__(self,
+                 bin_sizes,
+                 knot_slopes,
+                 range_min=-1,
+                 uniform_side="y",
+                 validate_args=False,
+                 name="uniform_rational_quadratic_spline"):
+        """ Constructor method.
+        """
+        parameters = dict(locals())
+        if uniform_side not in ("x", "y"):
+            raise ValueError(f"uniform_side must be \"x\" or \"y\", not {uniform_side}.")
+        self._bin_sizes = convert_to_tensor(bin_sizes, dtype_hint=float32)
+        self._knot_slopes = convert_to_tensor(knot_slopes, dtype=self._bin_sizes.dtype)
+        self._range_min = convert_to_tensor(range_min, dtype=self._bin_sizes.dtype)
+        self._uniform_side = uniform_side
+        super().__init__(forward_min_event_ndims=0,
+                         validate_args=validate_args,
+                         parameters=parameters,
+                         name=name)
+
+    @classmethod
+    def _parameter_properties(cls, dtype):
+        return dict()
+
+    @classmethod
+    def _is_increasing(cls):
+        return True
+
+    @property
+    def bin_sizes(self):
+        """ Sizes of the bins on the non uniform side
+        """
+        return self._bin_sizes
+
+    @property
+    def knot_slopes(self):
+        """ Slopes at the interior knots
+        """
+        return self._knot_slopes
+
+    @property
+    def range_min(self):
+        """ Lower bound of the splines interval
+        """
+        return self._range_min
+
+    @property
+    def uniform_side(self):
+        """ Side of the evenly spaced knots, `"x"` or `"y"`
+        """
+        return self._uniform_side
+
+    def _compute_shared(self, x=None, y=None):
+        """ Bin quantities shared by forward, inverse and log-det-jacobian.
+        Only one of `x` or `y` should be specified.
+        """
+        x_or_y = x if y is None else y
+        nbins = self._bin_sizes.shape[-1]
+        batch_shape = broadcast_dynamic_shape(shape(x_or_y), shape(self._bin_sizes)[:-1])
+        x_or_y = broadcast_to(x_or_y, batch_shape)
+        sizes = broadcast_to(self._bin_sizes, concat([batch_shape, [nbins]], axis=0))
+        slopes = broadcast_to(self._knot_slopes, concat([batch_shape, [nbins - 1]], axis=0))
+
+        # knots of the non uniform side
+        knots = concat([zeros_like(sizes[..., :1]), cumsum(sizes, axis=-1)], axis=-1)
+        knots = knots + self._range_min
+        kd = concat([ones_like(slopes[..., :1]), slopes, ones_like(slopes[..., :1])], axis=-1)
+        step = (knots[..., -1] - self._range_min) / nbins
+
+        out_of_bounds = (x_or_y <= self._range_min) | (x_or_y >= knots[..., -1])
+        if (y is None) == (self._uniform_side == "x"):
+            indices = cast(floor((x_or_y - self._range_min) / step), int64)
+        else:
+            indices = searchsorted(knots[..., :-1], x_or_y[..., None], side="right",
+                                   out_type=int64)[..., 0] - 1
+        indices = clip_by_value(indices, 0, nbins - 1)[..., None]
+
+        batch_dims = indices.shape.rank - 1
+        take = lambda params, idx: gather(params, idx, axis=-1, batch_dims=batch_dims)[..., 0]
+        uniform_k = self._range_min + cast(indices[..., 0], x_or_y.dtype) * step
+        knot_k, size_k = take(knots, indices), take(sizes, indices)
+        if self._uniform_side == "x":
+            x_k, w_k, y_k, h_k = uniform_k, step, knot_k, size_k
+        else:
+            x_k, w_k, y_k, h_k = knot_k, size_k, uniform_k, step
+        return _UniformSplineShared(out_of_bounds=out_of_bounds,
+                                    x_k=x_k,
+                                    y_k=y_k,
+                                    d_k=take(kd, indices),
+                                    d_kp1=take(kd, indices + 1),
+                                    h_k=h_k,
+                                    w_k=w_k,
+                                    s_k=h_k / w_k)
+
+    def _forward(self, x):
+        d = self._compute_shared(x=x)
+        relx = where(d.out_of_bounds, .5 * ones_like(d.x_k), (x - d.x_k) / d.w_k)
+        spline_val = d.y_k + ((d.h_k * (d.s_k * relx**2 + d.d_k * relx * (1 - relx))) /
+                              (d.s_k + (d.d_kp1 + d.d_k - 2 * d.s_k) * relx * (1 - relx)))
+        return where(d.out_of_bounds, x, spline_val)
+
+    def _relx_from_y(self, d, y):
+        """ Solves the quadratic equation giving the relative position
+        of the inverse in the bin.
+        """
+        rely = where(d.out_of_bounds, zeros_like(d.y_k), y - d.y_k)
+        term2 = rely * (d.d_kp1 + d.d_k - 2 * d.s_k)
+        a = d.h_k * (d.s_k - d.d_k) + term2
+        b = d.h_k * d.d_k - term2
+        c = -d.s_k * rely
+        return where(rely == 0, zeros_like(rely), (2 * c) / (-b - sqrt(b**2 - 4 * a * c)))
+
+    def _inverse(self, y):
+        d = self._compute_shared(y=y)
+        return where(d.out_of_bounds, y, self._relx_from_y(d, y) * d.w_k + d.x_k)
+
+    @staticmethod
+    def _log_derivative(d, relx):
+        """ Log of the spline derivative at the relative position `relx` in the bin.
+        """
+        relx = where(d.out_of_bounds, .5 * ones_like(relx), relx)
+        grad = (2 * log(d.s_k)
+                + log(d.d_kp1 * relx**2 + 2 * d.s_k * relx * (1 - relx) + d.d_k * (1 - relx)**2)
+                - 2 * log((d.d_kp1 + d.d_k - 2 * d.s_k) * relx * (1 - relx) + d.s_k))
+        return where(d.out_of_bounds, zeros_like(grad), grad)
+
+    def _forward_log_det_jacobian(self, x):
+        d = self._compute_shared(x=x)
+        return self._log_derivative(d, (x - d.x_k) / d.w_k)
+
+    def _inverse_log_det_jacobian(self, y):
+        d = self._compute_shared(y=y)
+        return -self._log_derivative(d, self._relx_from_y(d, y))
+
+
 class SplineInitializer(Module):
     """ Creates a rational quadratic spline with trainable parameters.
 
@@ -108,6 +504,15 @@ class SplineInitializer(Module):
     :type min_bin_gap: float, optional
     :param min_slope: Mimimum spline slope in each bin, defaults to `1e-3`.
     :type min_slope: float, optional
+    :param uniform_bins: If `True` or `"y"`, the spline bins have fixed, equal
+        heights, so that the inverse (latents and log probabilities) finds the bin
+        of its inputs without a search; with `"x"` equal widths, for the forward
+        (sampling). A :class:`UniformRationalQuadraticSpline` is then returned,
+        defaults to `False`.
+    :type uniform_bins: bool or str, optional
+    :param precision: Compute precision of the neural network, defaults to `"float32"`.
+        See :meth:`SplineBlock.set_precision`.
+    :type precision: str, optional
 
     .. note::
         For more informations about rational quadratic spline see
@@ -118,7 +523,9 @@ class SplineInitializer(Module):
                  border=4,
                  hidden_layers=[512,512],
                  min_bin_gap=1e-3,
-                 min_slope=1e-3):
+                 min_slope=1e-3,
+                 uniform_bins=False,
+                 precision="float32"):
         """ Constructor method.
         """
         super().__init__()
@@ -127,8 +534,60 @@ class SplineInitializer(Module):
         self._min_bin_gap = min_bin_gap
         self._min_slope = min_slope
         self._hidden_layers = hidden_layers
+        self._uniform_bins = uniform_bins
+        self._precision = precision
         self._built = False
 
+    @property
+    def built(self):
+        """ Whether the spline neural network has been created.
+        """
+        return self._built
+
+    def build(self,
+              input_units,
+              nunits):
+        """ Creates the spline neural network and its variables, if not
+        already done. Variables are placed according to the current
+        `tf.distribute` strategy scope.
+
+        :param input_units: Number of conditioning inputs.
+        :type input_units: int
+        :param nunits: Number of splines.
+        :type nunits: int
+        """
+        if self._built:
+            return
+        self._nn = SplineBlock(nunits,
+                               self._nbins,
+                               self._border,
+                               hidden_layers=self._hidden_layers,
+                               min_bin_gap=self._min_bin_gap,
+                               min_slope=self._min_slope,
+                               uniform_bins=self._uniform_bins,
+                               precision=self._precision)
+        self._nn.build(TensorShape([None, input_units]))
+        self._built = True
+
+    @property
+    def precision(self):
+        """ Compute precision of the neural network
+        """
+        return self._precision
+
+    def set_precision(self, precision):
+        """ Sets the compute precision of the neural network,
+        see :meth:`SplineBlock.set_precision`.
+
+        :param precision: One of `SplineBlock.PRECISIONS`.
+        :type precision: str
+        """
+        if self._built:
+            self._nn.set_precision(precision)
+        elif precision not in SplineBlock.PRECISIONS:
+            raise ValueError(f"precision must be one of {SplineBlock.PRECISIONS}, not {precision}.")
+        self._precision = precision
+
     def __call__(self,
                  x,
                  nunits):
@@ -139,21 +598,246 @@ class SplineInitializer(Module):
         :param nunits: Number of splines.
         :type nunits: int
         :return: Rational quadratic spline with learnable parameters.
-        :rtype: tensorflow_probability.bijectors.RationalQuadraticSpline
-        """
-        if not self._built:
-            self._nn = SplineBlock(nunits,
-                                   self._nbins,
-                                   self._border,
-                                   hidden_layers=self._hidden_layers,
-                                   min_bin_gap=self._min_bin_gap,
-                                   min_slope=self._min_slope)
-            self._built = True
-        widths, heights, slopes = self._nn(x)
-        return RationalQuadraticSpline(widths,
-                                       heights,
-                                       slopes,
-                                       range_min= -self._border)
+        :rtype: tensorflow_probability.bijectors.RationalQuadraticSpline or
+            UniformRationalQuadraticSpline
+        """
+        self.build(x.shape[-1], nunits)
+        with name_scope("conditioner"):
+            params = self._nn(x)
+        return _rational_quadratic_spline(params, self._border, self._uniform_bins)
+
+
+def _rational_quadratic_spline(params, border, uniform_bins):
+    """ Spline with the parameters returned by a :class:`SplineBlock`.
+    """
+    if uniform_bins:
+        sizes, slopes = params
+        return UniformRationalQuadraticSpline(sizes,
+                                              slopes,
+                                              range_min= -border,
+                                              uniform_side="x" if uniform_bins == "x" else "y")
+    widths, heights, slopes = params
+    return RationalQuadraticSpline(widths,
+                                   heights,
+                                   slopes,
+                                   range_min= -border)
+
+
+class SharedSplineTrunk(Module):
+    """ Conditioner network shared by all the coupling layers of a
+    :class:`NeuralSplineFlow`, instead of one network for each layer.
+
+    The input of the network is the whole features vector, with the
+    features transformed by the coupling layer set to zero, concatenated
+    to a learned embedding of the layer. The last dense layer has the spline
+    parameters of every feature as outputs, and only those of the features
+    transformed by the coupling layer are computed. The hidden layers of
+    several coupling layers are evaluated together (see :meth:`params`).
+
+    :param num_layers: Number of coupling layers.
+    :type num_layers: int
+    :param embedding_units: Size of the embedding of each layer, defaults to `8`.
+    :type embedding_units: int, optional
+    :param **spline_params: Parameters of the spline network, as for
+        :class:`SplineInitializer`.
+    :type **spline_params: optional
+    """
+    def __init__(self,
+                 num_layers,
+                 embedding_units=8,
+                 nbins=128,
+                 border=4,
+                 hidden_layers=[512,512],
+                 min_bin_gap=1e-3,
+                 min_slope=1e-3,
+                 uniform_bins=False,
+                 precision="float32"):
+        """ Constructor method.
+        """
+        super().__init__(name="shared_spline_trunk")
+        self._num_layers = num_layers
+        self._embedding_units = embedding_units
+        self._nbins = nbins
+        self._border = border
+        self._hidden_layers = hidden_layers
+        self._min_bin_gap = min_bin_gap
+        self._min_slope = min_slope
+        self._uniform_bins = uniform_bins
+        self._precision = precision
+        self._built = False
+
+    @property
+    def built(self):
+        """ Whether the network has been created.
+        """
+        return self._built
+
+    @property
+    def border(self):
+        """ The border of the splines
+        """
+        return self._border
+
+    @property
+    def uniform_bins(self):
+        """ Whether (and on which side) the spline bins have fixed, equal sizes
+        """
+        return self._uniform_bins
+
+    def build(self, num_features):
+        """ Creates the network and the layer embeddings, if not already done.
+
+        :param num_features: Dimensions of features space.
+        :type num_features: int
+        """
+        if self._built:
+            return
+        self._nn = SplineBlock(num_features,
+                               self._nbins,
+                               self._border,
+                               hidden_layers=self._hidden_layers,
+                               min_bin_gap=self._min_bin_gap,
+                               min_slope=self._min_slope,
+                               uniform_bins=self._uniform_bins,
+                               precision=self._precision)
+        self._nn.build(TensorShape([None, num_features + self._embedding_units]))
+        self._embeddings = Variable(random_normal([self._num_layers, self._embedding_units]),
+                                    name="layer_embeddings")
+        self._built = True
+
+    @property
+    def precision(self):
+        """ Compute precision of the shared network
+        """
+        return self._precision
+
+    def set_precision(self, precision):
+        """ Sets the compute precision of the network,
+        see :meth:`SplineBlock.set_precision`.
+
+        :param precision: One of `SplineBlock.PRECISIONS`.
+        :type precision: str
+        """
+        if self._built:
+            self._nn.set_precision(precision)
+        elif precision not in SplineBlock.PRECISIONS:
+            raise ValueError(f"precision must be one of {SplineBlock.PRECISIONS}, not {precision}.")
+        self._precision = precision
+
+    def params(self, units, indices, splines):
+        """ Spline parameters of several coupling layers: the hidden layers
+        of the network are evaluated once on the inputs of all the layers,
+        the parameters layer only for the features transformed by each layer.
+
+        :param units: Features of each layer, with the transformed ones set to zero.
+        :type units: list[tensorflow.Tensor]
+        :param indices: Index of each layer.
+        :type indices: list[int]
+        :param splines: Features transformed by each layer.
+        :type splines: list[list[int]]
+        :return: The spline parameters (as returned by :class:`SplineBlock`) of each layer.
+        :rtype: list[tuple(tensorflow.Tensor)]
+        """
+        inputs = stack([
+            concat([x, broadcast_to(self._embeddings[index],
+                                    concat([shape(x)[:-1], [self._embedding_units]], axis=0))],
+                   axis=-1)
+            for x, index in zip(units, indices)])
+        hidden = unstack(self._nn.hidden_units(inputs), num=len(units))
+        return [self._nn.spline_params(h, s) for h, s in zip(hidden, splines)]
+
+
+class SharedSplineInitializer(Module):
+    """ Creates the rational quadratic spline of a coupling layer from a
+    :class:`SharedSplineTrunk`, used by :class:`NeuralSplineFlow` in place
+    of :class:`SplineInitializer` when the conditioner is shared.
+
+    :param trunk: The shared network.
+    :type trunk: SharedSplineTrunk
+    :param index: Index of the coupling layer.
+    :type index: int
+    :param reverse: Whether the conditioning features are the last ones
+        (negative masks).
+    :type reverse: bool
+    """
+    def __init__(self, trunk, index, reverse):
+        """ Constructor method.
+        """
+        super().__init__()
+        self._trunk = trunk
+        self._index = index
+        self._reverse = reverse
+
+    @property
+    def index(self):
+        """ Index of the coupling layer.
+        """
+        return self._index
+
+    @property
+    def built(self):
+        """ Whether the shared network has been created.
+        """
+        return self._trunk.built
+
+    def build(self, input_units, nunits):
+        """ Creates the shared network, if not already done.
+
+        :param input_units: Number of conditioning inputs.
+        :type input_units: int
+        :param nunits: Number of splines.
+        :type nunits: int
+        """
+        self._trunk.build(input_units + nunits)
+
+    @property
+    def precision(self):
+        """ Compute precision of the shared network
+        """
+        return self._trunk.precision
+
+    def set_precision(self, precision):
+        """ Sets the compute precision of the shared network.
+
+        :param precision: One of `SplineBlock.PRECISIONS`.
+        :type precision: str
+        """
+        self._trunk.set_precision(precision)
+
+    def trunk_input(self, x, nunits):
+        """ Input of the shared network: the conditioning features `x`
+        at their place in the features vector, zeros elsewhere.
+        """
+        padding = zeros(concat([shape(x)[:-1], [nunits]], axis=0), dtype=x.dtype)
+        return concat([padding, x] if self._reverse else [x, padding], axis=-1)
+
+    def transformed(self, input_units, nunits):
+        """ Indices of the features transformed by the coupling layer.
+        """
+        return list(range(nunits)) if self._reverse else list(range(input_units, input_units + nunits))
+
+    def spline(self, params):
+        """ Spline with the parameters returned by :meth:`SharedSplineTrunk.params`.
+        """
+        return _rational_quadratic_spline(params, self._trunk.border, self._trunk.uniform_bins)
+
+    def __call__(self, x, nunits):
+        """ Returns a rational quadratic spline with learnable parameters.
+
+        :param x: The spline input.
+        :type x: tensorflow.Tensor
+        :param nunits: Number of splines.
+        :type nunits: int
+        :return: Rational quadratic spline with learnable parameters.
+        :rtype: tensorflow_probability.bijectors.RationalQuadraticSpline or
+            UniformRationalQuadraticSpline
+        """
+        self.build(x.shape[-1], nunits)
+        with name_scope("conditioner"):
+            params, = self._trunk.params([self.trunk_input(x, nunits)], [self._index],
+                                         [self.transformed(x.shape[-1], nunits)])
+        return self.spline(params)
+
 
 class NeuralSplineFlow(Chain):
     """ 
@@ -186,37 +870,212 @@ class NeuralSplineFlow(Chain):
     :type masks: list[int]
     :param spline_params: dictionary of parameters for SplineInitializer.
     :type spline_params: dict
+    :param recompute_grad: If `True`, the activations of each coupling layer
+        are not stored on the gradient tape by `inverse_and_log_det_jacobian`
+        but recomputed during the backward pass. Training memory then no longer
+        grows with the number of layers, at the cost of an extra forward pass
+        per layer. Defaults to `False`.
+    :type recompute_grad: bool, optional
+    :param shared_conditioner: If `True`, all the coupling layers share a single
+        conditioner network (see :class:`SharedSplineTrunk`), told apart by a learned
+        embedding of each layer, instead of one network per layer: the number
+        of parameters no longer grows with the number of layers, and
+        `inverse_and_log_det_jacobian` evaluates the network once for each group
+        of consecutive layers whose conditioning features do not depend on each
+        other. Defaults to `False`.
+    :type shared_conditioner: bool, optional
+    :param embedding_units: Size of the layer embeddings of the shared
+        conditioner, defaults to `8`.
+    :type embedding_units: int, optional
+    :param num_features: If given, the variables of all the coupling layers are
+        created by the constructor (see :meth:`build`) instead of at the first call,
+        defaults to `None`.
+    :type num_features: int, optional
     :raises: ValueError
     """
     def __init__(self,
                  splits=None,
                  masks=None,
-                 spline_params = {}
+                 spline_params = {},
+                 recompute_grad=False,
+                 num_features=None,
+                 shared_conditioner=False,
+                 embedding_units=8
                  ):
         """ Default constructor
         """
         self._spline_params = spline_params
+        self._recompute_grad = recompute_grad
+        self._shared_conditioner = shared_conditioner
         self._splits = splits
         self._masks = masks
+        if shared_conditioner and recompute_grad:
+            raise ValueError("`recompute_grad` is not supported with a shared conditioner.")
         if self._splits is not None and self._masks is None:
             if self._splits < 2:
                 raise ValueError("splits must be greater than or equal to 2 ",
                                  "(You must split your feature vec in at least two parts).")
-            realnvp_args = [
-                dict(fraction_masked=i/self._splits, bijector_fn=SplineInitializer(**self._spline_params))
-                for i in range(1-self._splits, self._splits) if i != 0
-            ]
+            masked = [i for i in range(1-self._splits, self._splits) if i != 0]
+            realnvp_args = [dict(fraction_masked=i/self._splits) for i in masked]
         elif self._masks is not None and self._splits is None:
-            realnvp_args = [
-                dict(num_masked=i, bijector_fn=SplineInitializer(**self._spline_params))
-                for i in self._masks
-            ]
+            masked = self._masks
+            realnvp_args = [dict(num_masked=i) for i in masked]
         else:
             raise ValueError("You must specify `splits` OR `masks`, not both.")
+        if shared_conditioner:
+            self._trunk = SharedSplineTrunk(len(masked), embedding_units, **self._spline_params)
+            for i, (args, mask) in enumerate(zip(realnvp_args, masked)):
+                args["bijector_fn"] = SharedSplineInitializer(self._trunk, i, reverse=mask < 0)
+        else:
+            for args in realnvp_args:
+                args["bijector_fn"] = SplineInitializer(**self._spline_params)
 
         self._coupling_layers = [
             RealNVP(**splines, name=f"coupling_layer_{i}")
             for i, splines in enumerate(realnvp_args)
         ]
         super().__init__(bijectors=self._coupling_layers, name="nsf")
+        if num_features is not None:
+            self.build(num_features)
+
+    def build(self, num_features):
+        """ Creates the variables of all the coupling layers for
+        features of size `num_features`, instead of at their first call.
+        Variables are placed according to the current `tf.distribute`
+        strategy scope.
+
+        :param num_features: Dimensions of features space.
+        :type num_features: int
+        """
+        for layer in self._coupling_layers:
+            layer._cache_input_depth(zeros([num_features])) # pylint: disable=protected-access
+            masked_size = abs(layer._masked_size) # pylint: disable=protected-access
+            layer._bijector_fn.build(masked_size, num_features - masked_size) # pylint: disable=protected-access
+
+    def inverse_and_log_det_jacobian(self, y):
+        """ Computes the inverse transformation and its log-det-jacobian
+        with a single pass through the coupling layers.
+
+        Calling `inverse` and `inverse_log_det_jacobian` separately evaluates
+        the neural network of every coupling layer twice (or relies on the
+        bijector cache, which keeps the intermediate tensors alive).
+        Here each spline is built once per layer and used for both quantities.
+
+        :param y: The bijector output (i.e. the features).
+        :type y: tensorflow.Tensor
+        :return: The inverse transformation of `y` and the inverse
+            log-det-jacobian, with `event_ndims=1`.
+        :rtype: tuple(tensorflow.Tensor)
+        :raises: ValueError
+        """
+        y = convert_to_tensor(y, dtype_hint=float32)
+        ildj = zeros(shape(y)[:-1], dtype=y.dtype)
+        if self._shared_conditioner:
+            for group in self._independent_groups(y):
+                splines = None
+                for layer in group:
+                    with name_scope(layer.name):
+                        # the conditioner of the group runs in the scope of its first layer
+                        splines = splines or iter(self._group_splines(group, y))
+                        y, layer_ildj = _coupling_inverse_and_log_det_jacobian(layer, y,
+                                                                               next(splines))
+                    ildj = ildj + layer_ildj
+            return y, ildj
+        # pylint: disable=protected-access
+        if self._recompute_grad and not all(layer._bijector_fn.built
+                                            for layer in self._coupling_layers):
+            # variables must exist before entering a recompute checkpoint,
+            # also when the first call is the one traced by a tf.function
+            if y.shape[-1] is None:
+                raise ValueError("`recompute_grad` needs features of known size, "
+                                 "or a flow built with `num_features`.")
+            self.build(y.shape[-1])
+        for layer in self._coupling_layers:
+            step = lambda y, layer=layer: _coupling_inverse_and_log_det_jacobian(layer, y)
+            if self._recompute_grad:
+                step = recompute_grad(step)
+            with name_scope(layer.name):
+                y, layer_ildj = step(y)
+            ildj = ildj + layer_ildj
+        return y, ildj
+
+    def _independent_groups(self, y):
+        """ Splits the coupling layers in groups of consecutive layers
+        whose conditioning features are not transformed by the previous
+        layers of the group, in the inverse direction.
+        """
+        num_features = y.shape[-1]
+        groups, transformed = [], set()
+        for layer in self._coupling_layers:
+            layer._cache_input_depth(y) # pylint: disable=protected-access
+            masked_size = abs(layer._masked_size) # pylint: disable=protected-access
+            if layer._reverse_mask: # pylint: disable=protected-access
+                conditioning = set(range(num_features - masked_size, num_features))
+            else:
+                conditioning = set(range(masked_size))
+            if not groups or conditioning & transformed:
+                groups.append([])
+                transformed = set()
+            groups[-1].append(layer)
+            transformed |= set(range(num_features)) - conditioning
+        return groups
+
+    def _group_splines(self, group, y):
+        """ Splines of a group of independent coupling layers, with a
+        single evaluation of the shared conditioner.
+        """
+        units, indices, transformed = [], [], []
+        for layer in group:
+            bijector_fn = layer._bijector_fn # pylint: disable=protected-access
+            masked_size = layer._masked_size # pylint: disable=protected-access
+            nunits = layer._bijector_input_units() # pylint: disable=protected-access
+            bijector_fn.build(abs(masked_size), nunits)
+            y0 = y[..., masked_size:] if layer._reverse_mask else y[..., :masked_size] # pylint: disable=protected-access
+            units.append(bijector_fn.trunk_input(y0, nunits))
+            indices.append(bijector_fn.index)
+            transformed.append(bijector_fn.transformed(abs(masked_size), nunits))
+        with name_scope("conditioner"):
+            params = self._trunk.params(units, indices, transformed)
+        return [layer._bijector_fn.spline(p) # pylint: disable=protected-access
+                for layer, p in zip(group, params)]
+
+    @property
+    def precision(self):
+        """ Compute precision of the neural networks of the coupling layers
+        """
+        return self._coupling_layers[0]._bijector_fn.precision # pylint: disable=protected-access
+
+    def set_precision(self, precision):
+        """ Sets the compute precision of the neural networks of all the
+        coupling layers, e.g. `"bfloat16"` or `"int8"` (post-training
+        quantization of the current weights, which releases the float32
+        kernels) for faster or smaller inference.
+        The splines and the log-det-jacobian are always evaluated in float32.
+        See :meth:`SplineBlock.set_precision`.
+
+        :param precision: One of `SplineBlock.PRECISIONS`.
+        :type precision: str
+        """
+        for layer in self._coupling_layers:
+            layer._bijector_fn.set_precision(precision) # pylint: disable=protected-access
+
+
+def _coupling_inverse_and_log_det_jacobian(layer, y, spline=None):
+    """ Inverse of a `RealNVP` coupling layer together with its
+    log-det-jacobian, building the inner bijector only once
+    (or using the given `spline`).
+    """
+    layer._cache_input_depth(y) # pylint: disable=protected-access
+    masked_size = layer._masked_size # pylint: disable=protected-access
+    y0, y1 = y[..., :masked_size], y[..., masked_size:]
+    if layer._reverse_mask: # pylint: disable=protected-access
+        y0, y1 = y1, y0
+    if spline is None:
+        spline = layer._bijector_fn(y0, layer._bijector_input_units()) # pylint: disable=protected-access
+    with name_scope("spline"):
+        x1 = spline.inverse(y1)
+        ildj = spline.inverse_log_det_jacobian(y1, event_ndims=1)
+    if layer._reverse_mask: # pylint: disable=protected-access
+        x1, y0 = y0, x1
+    return concat([y0, x1], axis=-1), ildj
 
@@ -0,0 +1,306 @@
+""" Module with a parallel hyperparameter sweep runner for Diglm models.
+It does not import TensorFlow, which is loaded only by the workers.
+"""
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .config import DiglmConfig
+
+RESULTS = "results.jsonl"
+# DiglmConfig arguments, the other options of `grid` are spline parameters
+_CONFIG_OPTIONS = ("glm", "masks", "splits", "recompute_grad", "shared_conditioner",
+                   "embedding_units")
+
+
+def grid(num_features, **options):
+    """ Configurations of all the combinations of the given options.
+
+    Example::
+
+        configs = grid(7, masks=[[-3, -2, -1, 1, 2, 3], [-5, -4, -3, -2, -1, 1, 2, 3, 4, 5]],
+                       nbins=[16, 32], hidden_layers=[[64, 64], [64, 64, 64]])
+
+    :param num_features: Dimensions of features space.
+    :type num_features: int
+    :param **options: List of the values of each option: arguments of
+        :class:`config.DiglmConfig` (`masks`, `splits`, `glm`, ...) or spline
+        parameters (`nbins`, `border`, `hidden_layers`, ...).
+    :return: The configurations.
+    :rtype: list[config.DiglmConfig]
+    """
+    names = list(options)
+    configs = []
+    for values in itertools.product(*(options[name] for name in names)):
+        arguments, spline_params = {}, {}
+        for name, value in zip(names, values):
+            (arguments if name in _CONFIG_OPTIONS else spline_params)[name] = value
+        if "masks" not in arguments and "splits" not in arguments:
+            arguments["splits"] = 2
+        configs.append(DiglmConfig(num_features, spline_params=spline_params, **arguments))
+    return configs
+
+
+def trial_id(config, settings=None):
+    """ Identifier of the trial of a configuration, stable across runs.
+
+    :param config: The configuration.
+    :type config: config.DiglmConfig
+    :param settings: Training settings (JSON serializable) hashed with the
+        configuration, defaults to `None`.
+    :type settings: dict, optional
+    :rtype: str
+    """
+    digest = hashlib.sha256(config.to_json().encode())
+    if settings is not None:
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def _loss_key(result):
+    """ Sorting key of a result by validation loss, NaN losses last. """
+    return (math.isnan(result["val_loss"]), result["val_loss"])
+
+
+def halving_rungs(max_steps, min_steps=None, eta=3):
+    """ Training steps of the rungs of successive halving: after each rung
+    only the best `1 / eta` of the trials are trained further, up to the
+    steps of the next rung.
+
+    :param max_steps: Training steps of the last rung.
+    :type max_steps: int
+    :param min_steps: Training steps of the first rung, defaults to `None`: a single
+        rung of `max_steps` (no early stopping).
+    :type min_steps: int, optional
+    :param eta: Reduction factor, defaults to `3`.
+    :type eta: int, optional
+    :return: The steps of each rung.
+    :rtype: list[int]
+    """
+    if min_steps is None or min_steps >= max_steps:
+        return [max_steps]
+    rungs = int(math.floor(math.log(max_steps / min_steps, eta) + 1e-9))
+    return [int(round(max_steps / eta**(rungs - i))) for i in range(rungs + 1)]
+
+
+def _init_worker(threads, cores):
+    """ Pins a worker process to its cores and sets the TensorFlow threads,
+    before the TensorFlow runtime is initialized.
+    """
+    # pylint: disable=import-outside-toplevel
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores.get())
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _train_trial(config, paths, start_step, steps, train_dir, validation_dir, settings):
+    """ Trains a trial from `start_step` to `steps`, resuming from the
+    checkpoint of `start_step`, and writes the checkpoint of `steps`
+    (`paths` of both). Runs in a worker.
+    """
+    # pylint: disable=import-outside-toplevel
+    import tensorflow as tf
+    from .checkpoint import load, save
+    from .data import shards_dataset
+    from .trainer import DiglmTrainer
+    start = time.perf_counter()
+    tf.random.set_seed(settings["seed"])
+    model = DiglmConfig.from_dict(config).build()
+    if start_step:
+        load(paths[0], model)
+    dataset = shards_dataset(train_dir, settings["batch_size"], seed=settings["seed"] + start_step)
+    validation = shards_dataset(validation_dir, settings["batch_size"], shuffle_buffer=0)
+    trainer = DiglmTrainer(model,
+                           tf.keras.optimizers.Adam(settings["learning_rate"]),
+                           scaling_const=settings["scaling_const"],
+                           steps_per_execution=settings["steps_per_execution"],
+                           jit_compile=settings["jit_compile"])
+    history = trainer.fit(dataset.repeat().take(steps - start_step),
+                          validation_data=validation,
+                          eval_every=steps - start_step,
+                          verbose=False)
+    save(paths[1] + ".tmp", model, DiglmConfig.from_dict(config))
+    os.replace(paths[1] + ".tmp", paths[1])
+    return dict(val_loss=history["val_loss"][-1],
+                train_loss=history["train_loss"][-1],
+                seconds=time.perf_counter() - start)
+
+
+class SweepRunner:
+    """ Trains many :class:`diglm.Diglm` configurations in a pool of
+    worker processes, with early stopping by successive halving on the
+    validation loss (the mean negative `Diglm.weighted_log_prob`).
+
+    - Each worker runs `threads_per_worker` TensorFlow intra-op threads,
+      pinned (on Linux) to as many cores of its own.
+    - Training and validation data are `.npy` shards (see
+      `data.csv_to_shards` and `data.arrays_to_shards`) that every worker
+      memory-maps: the page cache holds a single copy and nothing is pickled.
+    - Results are appended to `results.jsonl` in the `store` directory,
+      next to a checkpoint (see `checkpoint.save`) of each trial: a sweep
+      that is interrupted and run again skips the rungs already completed.
+      Trials resumed in a later rung restart with fresh optimizer moments.
+      The trial identifiers hash the training settings and the data
+      directories too, so a store reused with other ones trains new trials.
+    - Trials are ranked by validation loss, the diverged ones (NaN loss) last.
+
+    :param store: Directory of the results and of the trial checkpoints.
+    :type store: str
+    :param train_dir: Directory of the training shards.
+    :type train_dir: str
+    :param validation_dir: Directory of the validation shards.
+    :type validation_dir: str
+    :param workers: Number of worker processes, defaults to `None`: the number
+        of cores divided by `threads_per_worker`.
+    :type workers: int, optional
+    :param threads_per_worker: TensorFlow intra-op threads of each worker, defaults to `1`.
+    :type threads_per_worker: int, optional
+    :param pin: Whether each worker is pinned to its own cores, defaults to `True`.
+    :type pin: bool, optional
+    :param batch_size: Training and validation batch size, defaults to `1024`.
+    :type batch_size: int, optional
+    :param learning_rate: Learning rate of the Adam optimizer, defaults to `1e-3`.
+    :type learning_rate: float, optional
+    :param scaling_const: Scaling constant of `Diglm.weighted_log_prob`, defaults to `0.1`.
+    :type scaling_const: float, optional
+    :param steps_per_execution: See `trainer.DiglmTrainer`, defaults to `32`.
+    :type steps_per_execution: int, optional
+    :param jit_compile: See `trainer.DiglmTrainer`, defaults to `False`: the XLA
+        compilation of each trial takes longer than the short rungs of a sweep.
+    :type jit_compile: bool, optional
+    :param seed: Seed of the model initialization and of the data shuffling, defaults to `0`.
+    :type seed: int, optional
+    """
+    def __init__(self,
+                 store,
+                 train_dir,
+                 validation_dir,
+                 workers=None,
+                 threads_per_worker=1,
+                 pin=True,
+                 batch_size=1024,
+                 learning_rate=1e-3,
+                 scaling_const=.1,
+                 steps_per_execution=32,
+                 jit_compile=False,
+                 seed=0):
+        """ Constructor method.
+        """
+        self._store = store
+        self._train_dir = train_dir
+        self._validation_dir = validation_dir
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") \
+            else list(range(os.cpu_count()))
+        self._workers = workers or max(len(cores) // threads_per_worker, 1)
+        self._threads = threads_per_worker
+        self._cores = None
+        if pin and self._workers * threads_per_worker <= len(cores):
+            self._cores = [cores[i * threads_per_worker:(i + 1) * threads_per_worker]
+                           for i in range(self._workers)]
+        self._settings = dict(batch_size=batch_size, learning_rate=learning_rate,
+                              scaling_const=scaling_const, seed=seed,
+                              steps_per_execution=steps_per_execution, jit_compile=jit_compile)
+        os.makedirs(os.path.join(store, "trials"), exist_ok=True)
+
+    @property
+    def workers(self):
+        """ Number of worker processes
+        """
+        return self._workers
+
+    def results(self):
+        """ Results stored so far, one for each trained rung of each trial.
+
+        :return: Dictionaries of `trial`, `config`, `steps`, `val_loss`,
+            `train_loss` and `seconds`.
+        :rtype: list[dict]
+        """
+        path = os.path.join(self._store, RESULTS)
+        if not os.path.isfile(path):
+            return []
+        with open(path, encoding="utf-8") as file:
+            # a line cut by an interruption is skipped, its rung trained again
+            return [json.loads(line) for line in file if line.endswith("\n")]
+
+    def checkpoint_path(self, trial, steps):
+        """ Path of the checkpoint of a trial after `steps` training steps,
+        to be read by `checkpoint.load`.
+
+        :param trial: The trial identifier, see :func:`trial_id`.
+        :type trial: str
+        :param steps: The steps of a completed rung.
+        :type steps: int
+        :rtype: str
+        """
+        return os.path.join(self._store, "trials", f"{trial}_{steps}.diglm")
+
+    def run(self, configs, max_steps, min_steps=None, eta=3, verbose=True):
+        """ Runs the sweep: all the configurations are trained for the steps
+        of the first rung, the best `1 / eta` of each rung for the next one
+        (see :func:`halving_rungs`), up to `max_steps`.
+
+        :param configs: The configurations.
+        :type configs: list[config.DiglmConfig]
+        :param max_steps: Training steps of the best configurations.
+        :type max_steps: int
+        :param min_steps: Training steps of the first rung, defaults to `None`
+            (no early stopping, all the configurations trained for `max_steps`).
+        :type min_steps: int, optional
+        :param eta: Reduction factor of successive halving, defaults to `3`.
+        :type eta: int, optional
+        :param verbose: Whether a line is printed for each completed rung, defaults to `True`.
+        :type verbose: bool, optional
+        :return: The last result of each trial, best first.
+        :rtype: list[dict]
+        """
+        settings = dict(self._settings,
+                        train_dir=os.path.abspath(self._train_dir),
+                        validation_dir=os.path.abspath(self._validation_dir))
+        trials = {trial_id(config, settings): config for config in configs}
+        done = {(result["trial"], result["steps"]): result for result in self.results()}
+        context = multiprocessing.get_context("spawn")
+        cores = None
+        if self._cores is not None:
+            cores = context.Queue()
+            for worker_cores in self._cores:
+                cores.put(worker_cores)
+        survivors, previous = list(trials), 0
+        with ProcessPoolExecutor(self._workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self._threads, cores)) as executor, \
+                open(os.path.join(self._store, RESULTS), "a", encoding="utf-8") as file:
+            for steps in halving_rungs(max_steps, min_steps, eta):
+                futures = {}
+                for trial in survivors:
+                    if (trial, steps) in done:
+                        continue
+                    future = executor.submit(_train_trial, trials[trial].to_dict(),
+                                             (self.checkpoint_path(trial, previous),
+                                              self.checkpoint_path(trial, steps)),
+                                             previous, steps,
+                                             self._train_dir, self._validation_dir,
+                                             self._settings)
+                    futures[future] = trial
+                for future in as_completed(futures):
+                    trial = futures[future]
+                    result = dict(trial=trial, config=trials[trial].to_dict(), steps=steps,
+                                  **future.result())
+                    file.write(json.dumps(result) + "\n")
+                    file.flush()
+                    done[(trial, steps)] = result
+                    if verbose:
+                        print(f"{trial} | steps: {steps} | val_loss: {result['val_loss']:.4g} | "
+                              f"{result['seconds']:.1f} s")
+                ranked = sorted(survivors, key=lambda trial: _loss_key(done[(trial, steps)]))
+                survivors, previous = ranked[:max(len(ranked) // eta, 1)], steps
+        last = {}
+        for (trial, steps), result in done.items():
+            if trial in trials and steps <= max_steps and steps >= last.get(trial, {}).get("steps", 0):
+                last[trial] = result
+        return sorted(last.values(), key=lambda result: (-result["steps"], *_loss_key(result)))
@@ -0,0 +1,262 @@
+""" Module with the compiled training loop for Diglm models """
+import time
+
+import tensorflow as tf
+from tensorflow_probability.python.glm import Bernoulli
+
+
+class DiglmTrainer(tf.Module):
+    """ Compiled training loop for :class:`diglm.Diglm`.
+
+    Training can be data-parallel over the replicas of a `tf.distribute`
+    strategy, e.g. `MirroredStrategy` over (logical) CPU devices or
+    `MultiWorkerMirroredStrategy`: the model and the optimizer must then be
+    created inside `strategy.scope()`. Each replica computes the loss of its
+    part of the batch divided by the global batch size, so that the summed
+    gradients are those of the mean over the global batch.
+
+    The gradient step is compiled with XLA (`jit_compile`) and
+    `steps_per_execution` steps run in a single call of a `tf.function`
+    looping over the dataset iterator in graph, so that Python is entered
+    only once every `steps_per_execution` steps. The training loss is
+    accumulated in device variables and read back only when the model is
+    evaluated, every `eval_every` steps.
+
+    :param model: The model to train.
+    :type model: diglm.Diglm
+    :param optimizer: The optimizer.
+    :type optimizer: tensorflow.keras.optimizers.Optimizer
+    :param scaling_const: Scaling constant of `Diglm.weighted_log_prob`, defaults to `0.1`.
+    :type scaling_const: float, optional
+    :param steps_per_execution: Number of steps run by each compiled call, defaults to `32`.
+    :type steps_per_execution: int, optional
+    :param jit_compile: Whether train and eval steps are compiled with XLA, defaults to `True`.
+    :type jit_compile: bool, optional
+    :param strategy: Distribution strategy, defaults to the current one.
+    :type strategy: tensorflow.distribute.Strategy, optional
+    :param head_weights: Weights of the glm heads of a multi-head model, defaults
+        to `None` (all ones). See `Diglm.weighted_log_prob`.
+    :type head_weights: dict(float), optional
+    :param head_only: Whether only the glm variables are trained, with the bijector
+        frozen, defaults to `False`. The dataset can then be read from the latents
+        cache written by `data.cache_latents`.
+    :type head_only: bool, optional
+    """
+    def __init__(self,
+                 model,
+                 optimizer,
+                 scaling_const=.1,
+                 steps_per_execution=32,
+                 jit_compile=True,
+                 strategy=None,
+                 head_weights=None,
+                 head_only=False):
+        """ Constructor method.
+        """
+        super().__init__(name="diglm_trainer")
+        self._model = model
+        self._optimizer = optimizer
+        self._scaling_const = scaling_const
+        self._steps_per_execution = steps_per_execution
+        self._jit_compile = jit_compile
+        self._strategy = strategy or tf.distribute.get_strategy()
+        self._head_weights = head_weights
+        self._head_only = head_only
+        with self._strategy.scope():
+            self._loss_sum = tf.Variable(0., trainable=False, name="loss_sum")
+            self._loss_steps = tf.Variable(0, trainable=False, dtype=tf.int64, name="loss_steps")
+        self._variables = None
+
+    @property
+    def model(self):
+        """ The model
+        """
+        return self._model
+
+    @property
+    def strategy(self):
+        """ The distribution strategy
+        """
+        return self._strategy
+
+    def _build(self, batch):
+        """ Creates model and optimizer variables, outside of compiled functions.
+        """
+        if self._variables is not None:
+            return
+        with self._strategy.scope():
+            self._weighted_log_prob(batch)
+            self._variables = (self._model.head_variables if self._head_only
+                               else self._model.trainable_variables)
+            if hasattr(self._optimizer, "build"):
+                self._optimizer.build(self._variables)
+        self._train_step = tf.function(self._step, jit_compile=self._jit_compile)
+        self._train_loop = tf.function(self._loop)
+        self._eval_step = tf.function(self._eval_batch, jit_compile=self._jit_compile)
+
+    def _weighted_log_prob(self, batch):
+        return self._model.weighted_log_prob(batch, scaling_const=self._scaling_const,
+                                             head_weights=self._head_weights)
+
+    def _loss(self, batch):
+        # mean over the global batch, i.e. over all the replicas
+        return tf.nn.compute_average_loss(-self._weighted_log_prob(batch))
+
+    def _step(self, batch):
+        with tf.GradientTape() as tape:
+            loss = self._loss(batch)
+        gradients = tape.gradient(loss, self._variables)
+        self._optimizer.apply_gradients(zip(gradients, self._variables))
+        return loss
+
+    def _loop(self, iterator, num_steps):
+        # the step is not placed in a conditional branch (as a `break` would do):
+        # cross-worker collectives inside a `cond` in a `while` fail to run
+        steps = tf.constant(0, dtype=tf.int64)
+        batch = iterator.get_next_as_optional()
+        while steps < num_steps and batch.has_value():
+            loss = self._strategy.run(self._train_step, args=(batch.get_value(),))
+            self._loss_sum.assign_add(
+                self._strategy.reduce(tf.distribute.ReduceOp.SUM, loss, axis=None))
+            steps += 1
+            if steps < num_steps:
+                batch = iterator.get_next_as_optional()
+        self._loss_steps.assign_add(steps)
+        return steps
+
+    def _eval_batch(self, batch):
+        log_prob = self._weighted_log_prob(batch)
+        metrics = {"loss_sum": -tf.reduce_sum(log_prob),
+                   "count": tf.cast(tf.size(log_prob), tf.float32)}
+        if self._model.heads is None:
+            glms, labels = {"": self._model.glm}, {"": batch["labels"]}
+        else:
+            glms, labels = self._model.glm, batch["labels"]
+        if not any(isinstance(glm, Bernoulli) for glm in glms.values()):
+            return metrics
+        if "latents" in batch:
+            eta = self._model.eta_from_latents(batch["latents"])
+        else:
+            eta = self._model.eta_from_features(batch["features"])
+        for (name, glm), head_eta in zip(glms.items(), tf.split(eta, len(glms), axis=-1)):
+            if isinstance(glm, Bernoulli):
+                mean, _, _ = glm(head_eta)
+                correct = tf.equal(tf.cast(mean >= .5, tf.int32),
+                                   tf.cast(labels[name], tf.int32))
+                metrics["correct" + (name and "_" + name)] = tf.reduce_sum(
+                    tf.cast(correct, tf.float32))
+        return metrics
+
+    def evaluate(self, data):
+        """ Evaluates the model on a batch, or on a dataset of batches.
+
+        :param data: Dictionary of features and labels, or a dataset of such dictionaries.
+        :type data: dict(tensorflow.Tensor) or tensorflow.data.Dataset
+        :return: Mean negative weighted log probability (`val_loss`) and,
+            for Bernoulli glm, the binary `accuracy` (`accuracy_<head>` for
+            each Bernoulli head of a multi-head model).
+        :rtype: dict(float)
+        """
+        batches = [data] if isinstance(data, dict) else data
+        totals = {}
+        for batch in batches:
+            self._build(batch)
+            for key, value in self._eval_step(batch).items():
+                totals[key] = totals.get(key, 0.) + value
+        result = {"val_loss": float(totals["loss_sum"] / totals["count"])}
+        for key, value in totals.items():
+            if key.startswith("correct"):
+                result["accuracy" + key[len("correct"):]] = float(value / totals["count"])
+        return result
+
+    def train_loss(self):
+        """ Mean training loss since the last call, which resets it.
+
+        :return: The mean training loss.
+        :rtype: float
+        """
+        loss = float(self._loss_sum / tf.cast(tf.maximum(self._loss_steps, 1), tf.float32))
+        self._loss_sum.assign(0.)
+        self._loss_steps.assign(0)
+        return loss
+
+    def fit(self,
+            dataset,
+            epochs=1,
+            validation_data=None,
+            eval_every=100,
+            verbose=True,
+            profiler=None):
+        """ Trains the model.
+
+        :param dataset: Dataset of dictionaries of features and labels batches.
+            With a distribution strategy, each batch is split among the replicas.
+        :type dataset: tensorflow.data.Dataset
+        :param epochs: Number of passes over the dataset, defaults to `1`.
+        :type epochs: int, optional
+        :param validation_data: Batch or dataset evaluated every `eval_every` steps
+            and at the end of each epoch, defaults to `None`.
+        :type validation_data: dict(tensorflow.Tensor) or tensorflow.data.Dataset, optional
+        :param eval_every: Number of training steps between evaluations, defaults to `100`.
+            It is rounded up to a multiple of `steps_per_execution`.
+        :type eval_every: int, optional
+        :param verbose: Whether a line is printed at each evaluation, defaults to `True`.
+        :type verbose: bool, optional
+        :param profiler: Hook wrapping the compiled calls of the training loop, e.g.
+            a `profiling.StageProfiler` (with `jit_compile=False`), defaults to `None`.
+        :type profiler: profiling.StageProfiler, optional
+        :return: History of `step`, `train_loss`, `steps_per_sec` and of
+            the metrics returned by :meth:`evaluate`.
+        :rtype: dict(list)
+        """
+        history = {"step": [], "train_loss": [], "steps_per_sec": []}
+        step = 0
+        distributed = self._strategy.experimental_distribute_dataset(dataset)
+        # a first batch is read only to create the variables, once
+        if self._variables is None:
+            self._build(next(iter(dataset)))
+        train_loop = self._train_loop
+        if profiler is not None:
+            # a call runs the number of steps it returns
+            train_loop = profiler.wrap(self._train_loop, steps=int)
+        for _ in range(epochs):
+            iterator = iter(distributed)
+            done = False
+            while not done:
+                start, since_report = time.perf_counter(), 0
+                while since_report < eval_every:
+                    executed = int(train_loop(iterator,
+                                              tf.constant(self._steps_per_execution,
+                                                          dtype=tf.int64)))
+                    since_report += executed
+                    if executed < self._steps_per_execution:
+                        done = True
+                        break
+                if since_report == 0:
+                    break
+                step += since_report
+                history["step"].append(step)
+                history["steps_per_sec"].append(since_report / (time.perf_counter() - start))
+                history["train_loss"].append(self.train_loss())
+                if validation_data is not None:
+                    for key, value in self.evaluate(validation_data).items():
+                        history.setdefault(key, []).append(value)
+                if verbose:
+                    print(" | ".join(f"{key}: {values[-1]:.4g}" for key, values in history.items()))
+        return history
+
+
+def logical_cpu_devices(num_devices):
+    """ Splits the physical CPU in `num_devices` logical devices, to be used
+    for data-parallel training with `tf.distribute.MirroredStrategy`.
+    It must be called before TensorFlow initializes its devices.
+
+    :param num_devices: Number of logical devices.
+    :type num_devices: int
+    :return: Names of the logical CPU devices.
+    :rtype: list[str]
+    """
+    cpu = tf.config.list_physical_devices("CPU")[0]
+    tf.config.set_logical_device_configuration(
+        cpu, [tf.config.LogicalDeviceConfiguration() for _ in range(num_devices)])
+    return [device.name for device in tf.config.list_logical_devices("CPU")]
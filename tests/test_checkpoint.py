@@ -0,0 +1,56 @@
+# By Marco Riggirello and Antoine Venturini
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from src import checkpoint
+from src.config import DiglmConfig
+
+config = DiglmConfig(4, masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8]))
+features = tf.random.normal([16, 4])
+
+def randomize(model):
+    for variable in model.variables:
+        variable.assign(tf.random.normal(variable.shape))
+    return model
+
+def test_save_load(tmp_path):
+    model = randomize(config.build())
+    checkpoint.save(tmp_path / "model.diglm", model, config)
+    header = checkpoint.read_header(tmp_path / "model.diglm")
+    assert header["version"] == checkpoint.FORMAT_VERSION
+    assert DiglmConfig.from_dict(header["config"]) == config
+    assert all(entry["offset"] % 64 == 0 for entry in header["variables"])
+    loaded = checkpoint.load(tmp_path / "model.diglm")
+    for a, b in zip(model(features), loaded(features)):
+        assert np.allclose(a, b)
+
+def test_partial_load(tmp_path):
+    model = randomize(config.build())
+    checkpoint.save(tmp_path / "model.diglm", model, config)
+    target = config.build()
+    beta = target.head_variables[0].numpy()
+    checkpoint.load(tmp_path / "model.diglm", target, parts=("flow",))
+    assert np.allclose(target.latent_features(features), model.latent_features(features))
+    assert np.all(target.head_variables[0].numpy() == beta)
+
+def test_mismatch(tmp_path):
+    checkpoint.save(tmp_path / "model.diglm", config.build(), config)
+    other = DiglmConfig(4, masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[16])).build()
+    with pytest.raises(ValueError):
+        checkpoint.load(tmp_path / "model.diglm", other)
+    (tmp_path / "other").write_bytes(b"0" * 64)
+    with pytest.raises(ValueError):
+        checkpoint.read_header(tmp_path / "other")
+
+def test_int8(tmp_path):
+    model = randomize(config.build())
+    model.set_precision("int8")
+    checkpoint.save(tmp_path / "model.diglm", model, config)
+    header = checkpoint.read_header(tmp_path / "model.diglm")
+    assert header["config"]["spline_params"]["precision"] == "int8"
+    loaded = checkpoint.load(tmp_path / "model.diglm")
+    assert loaded.bijector.precision == "int8"
+    assert [v.dtype for v in loaded.bijector.variables] == [v.dtype for v in model.bijector.variables]
+    for a, b in zip(model(features), loaded(features)):
+        assert np.allclose(a, b)
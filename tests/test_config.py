@@ -0,0 +1,30 @@
+# By Marco Riggirello and Antoine Venturini
+import subprocess
+import sys
+
+import pytest
+
+from src.config import DiglmConfig
+
+def test_config_does_not_import_tensorflow():
+    script = ("import sys; from src.config import DiglmConfig; "
+              "DiglmConfig(4, masks=[2,-2]).to_json(); "
+              "assert 'tensorflow' not in sys.modules")
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+def test_json_round_trip():
+    config = DiglmConfig(4, glm={"a": "Bernoulli", "b": "Poisson"}, splits=2,
+                         spline_params=dict(nbins=4, hidden_layers=[8]))
+    assert DiglmConfig.from_json(config.to_json()) == config
+    with pytest.raises(ValueError):
+        DiglmConfig(4, masks=[2], splits=2)
+
+def test_build():
+    d = DiglmConfig(4, masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8])).build()
+    assert d.num_features == 4
+    # all the variables exist before the first call
+    assert len(d.variables) == 2 + 2 * 4
+    assert d([[0., 1., 2., 3.]])[0].shape == [1, 1]
+    shared = DiglmConfig(4, masks=[2,-2], shared_conditioner=True,
+                         spline_params=dict(nbins=4, hidden_layers=[8])).build()
+    assert len(shared.variables) == 2 + 4 + 1
@@ -0,0 +1,130 @@
+# By Marco Riggirello and Antoine Venturini
+import os
+
+import numpy as np
+import pytest
+import tensorflow as tf
+from tensorflow_probability.python.glm import Bernoulli
+
+from src import data
+from src.diglm import Diglm
+from src.spqr import NeuralSplineFlow
+
+def write_csv(path, rows=1000, columns=8):
+    rng = np.random.default_rng(0)
+    table = rng.normal(size=(rows, columns)).astype(np.float32)
+    table[:, 0] = rng.integers(0, 2, size=rows)
+    np.savetxt(path, table, delimiter=',')
+    return table
+
+def test_csv_to_shards(tmp_path):
+    table = write_csv(tmp_path / 'data.csv.gz')
+    manifest = data.csv_to_shards(tmp_path / 'data.csv.gz', tmp_path / 'shards',
+                                  shard_rows=300, chunk_rows=128)
+    assert manifest['num_rows'] == 1000
+    assert [shard['rows'] for shard in manifest['shards']] == [300, 300, 300, 100]
+    shards = data.open_shards(tmp_path / 'shards')
+    features = np.concatenate([f for f, _ in shards])
+    labels = np.concatenate([l for _, l in shards])
+    assert features.dtype == np.float32 and labels.dtype == np.int32
+    assert np.array_equal(features, table[:, 1:])
+    assert np.array_equal(labels[:, 0], table[:, 0])
+
+def test_shards_dataset(tmp_path):
+    table = write_csv(tmp_path / 'data.csv.gz')
+    data.csv_to_shards(tmp_path / 'data.csv.gz', tmp_path / 'shards', shard_rows=300)
+    dataset = data.shards_dataset(tmp_path / 'shards', batch_size=64,
+                                  shuffle_buffer=128, drop_remainder=False)
+    batches = list(dataset)
+    assert max(b['features'].shape[0] for b in batches) == 64
+    assert all(b['features'].shape[1:] == [7] for b in batches)
+    assert all(b['labels'].shape[1:] == [1] for b in batches)
+    features = np.concatenate([b['features'] for b in batches])
+    assert np.array_equal(np.sort(features, axis=0), np.sort(table[:, 1:], axis=0))
+
+def test_shards_dataset_seed(tmp_path):
+    """ Tests if the order of the batches depends only on the seed, with
+    shards read in parallel, and if an empty directory is rejected.
+    """
+    rows = np.arange(4000, dtype=np.float32)[:, None]
+    data.arrays_to_shards({'features': rows, 'labels': rows.astype(np.int32)},
+                          tmp_path / 'shards', shard_rows=500)
+    order = lambda: np.concatenate([b['features'][:, 0] for b in data.shards_dataset(
+        tmp_path / 'shards', batch_size=50, shuffle_buffer=200, seed=0).repeat(2)])
+    first = order()
+    assert all(np.array_equal(first, order()) for _ in range(3))
+    assert not np.array_equal(first[:4000], first[4000:])
+    data.arrays_to_shards({'features': rows[:0], 'labels': rows[:0]}, tmp_path / 'empty')
+    with pytest.raises(ValueError):
+        data.shards_dataset(tmp_path / 'empty', batch_size=50)
+
+def test_cache_latents(tmp_path):
+    model = Diglm(NeuralSplineFlow(masks=[2, -2], spline_params=dict(nbins=4, hidden_layers=[8])),
+                  Bernoulli(), 4)
+    features = np.random.default_rng(0).normal(size=(100, 4)).astype(np.float32)
+    labels = (features[:, :1] > 0).astype(np.int32)
+    dataset = tf.data.Dataset.from_tensor_slices({'features': features,
+                                                  'labels': labels}).batch(32)
+    shard_dir = data.cache_latents(model, dataset, tmp_path, shard_rows=40)
+    assert data.cache_latents(model, dataset, tmp_path) == shard_dir
+    latents, log_det_jacobian, cached_labels = (np.concatenate(column) for column
+                                                in zip(*data.open_shards(shard_dir)))
+    expected, expected_ldj = model.latent_features_and_log_det_jacobian(features)
+    assert np.allclose(latents, expected, atol=1e-5)
+    assert np.allclose(log_det_jacobian, expected_ldj, atol=1e-5)
+    assert np.array_equal(cached_labels, labels)
+    batch = next(iter(data.shards_dataset(shard_dir, batch_size=16, shuffle_buffer=0)))
+    assert np.allclose(model.weighted_log_prob(batch),
+                       model.weighted_log_prob({'features': features[:16], 'labels': labels[:16]}),
+                       atol=1e-4)
+
+    # another dataset with the same weights gets its own cache
+    validation = tf.data.Dataset.from_tensor_slices({'features': -features,
+                                                     'labels': labels}).batch(32)
+    validation_dir = data.cache_latents(model, validation, tmp_path)
+    assert validation_dir != shard_dir
+    assert data.cache_latents(model, validation, tmp_path, name='validation') != validation_dir
+    assert os.path.isdir(shard_dir)
+    validation_latents = np.concatenate([l for l, _, _ in data.open_shards(validation_dir)])
+    assert np.allclose(validation_latents,
+                       model.latent_features_and_log_det_jacobian(-features)[0], atol=1e-5)
+
+    # changing the flow weights invalidates the cache, other directories are kept
+    data.arrays_to_shards({'features': features, 'labels': labels}, tmp_path / 'my_shards')
+    os.makedirs(tmp_path / 'notes')
+    variable = model.bijector.trainable_variables[0]
+    variable.assign(variable + 1.)
+    new_dir = data.cache_latents(model, dataset, tmp_path)
+    assert new_dir != shard_dir
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(new_dir), 'my_shards', 'notes'])
+
+def test_sample_to_shards(tmp_path):
+    model = Diglm(NeuralSplineFlow(masks=[2, -2], spline_params=dict(nbins=4, hidden_layers=[8])),
+                  Bernoulli(), 4)
+    manifest = data.sample_to_shards(model, 1000, tmp_path / 'a', chunk_size=128,
+                                     shard_chunks=3, seed=7)
+    assert [shard['rows'] for shard in manifest['shards']] == [384, 384, 232]
+    features, labels = (np.concatenate(column) for column in zip(*data.open_shards(tmp_path / 'a')))
+    assert features.shape == (1000, 4) and labels.shape == (1000, 1)
+    first = model.sample(128, seed=tf.constant([7, 0]))
+    assert np.allclose(features[:128], first['features'], atol=1e-5)
+
+    # same events with several workers, and after an interruption
+    data.sample_to_shards(model, 1000, tmp_path / 'b', chunk_size=128, shard_chunks=3,
+                          seed=7, num_workers=3)
+    os.remove(tmp_path / 'b' / data.MANIFEST)
+    os.remove(tmp_path / 'b' / manifest['shards'][1]['features'])
+    mtime = os.path.getmtime(tmp_path / 'b' / manifest['shards'][0]['features'])
+    data.sample_to_shards(model, 1000, tmp_path / 'b', chunk_size=128, shard_chunks=3, seed=7)
+    assert os.path.getmtime(tmp_path / 'b' / manifest['shards'][0]['features']) == mtime
+    resumed = np.concatenate([f for f, _ in data.open_shards(tmp_path / 'b')])
+    assert np.array_equal(resumed, features)
+
+    # other parameters or weights are not mixed with the shards on disk
+    with pytest.raises(ValueError):
+        data.sample_to_shards(model, 1000, tmp_path / 'b', chunk_size=128, shard_chunks=3, seed=8)
+    os.remove(tmp_path / 'b' / data.MANIFEST)
+    variable = model.bijector.trainable_variables[0]
+    variable.assign(variable + 1.)
+    with pytest.raises(ValueError):
+        data.sample_to_shards(model, 1000, tmp_path / 'b', chunk_size=128, shard_chunks=3, seed=7)
@@ -1,8 +1,10 @@
 # By Marco Riggirello and Antoine Venturini
-from tensorflow_probability.python.glm import Bernoulli
+import numpy as np
+import pytest
+from tensorflow_probability.python.glm import Bernoulli, Poisson
 
 from src.spqr import NeuralSplineFlow
-from src.diglm import Diglm
+from src.diglm import Diglm, QuantileSketch
 
 d = Diglm(NeuralSplineFlow(splits=4), Bernoulli(), 8)
 
@@ -41,3 +43,80 @@ def test_weighted_log_prob_batched():
     """
     tnsr = d.weighted_log_prob(d.sample([6,3,5]))
     assert tnsr.shape.as_list() == [6,3,5]
+
+def test_log_prob_parts_single_pass():
+    """ Tests if the single pass log_prob_parts matches the
+    transformed distribution and glm log probabilities.
+    """
+    value = d.sample(16)
+    lpp = d.log_prob_parts(value)
+    features_lp = d.model["features"].log_prob(value["features"])
+    labels_lp = d.model["labels"](value["features"]).log_prob(value["labels"])
+    assert np.allclose(lpp["features"], features_lp, atol=1e-4)
+    assert np.allclose(lpp["labels"], labels_lp, atol=1e-4)
+
+def test_trainable_variables():
+    """ Tests if Diglm.trainable_variables includes the bijector variables.
+    """
+    d.weighted_log_prob(d.sample(2))
+    assert len(d.trainable_variables) == 2 + len(d.bijector.trainable_variables)
+    assert len(d.bijector.trainable_variables) > 0
+
+def test_multi_head():
+    """ Tests if the heads of a multi-head Diglm match single head
+    models sharing the same flow.
+    """
+    heads = Diglm(d.bijector, {"signal": Bernoulli(), "counts": Poisson()}, 8)
+    heads._beta.assign(np.random.default_rng(0).normal(size=(8, 2)) / 4)
+    heads._beta_0.assign([.1, -.2])
+    value = heads.sample(5)
+    assert value["labels"]["signal"].shape.as_list() == [5, 1]
+    assert value["labels"]["counts"].shape.as_list() == [5, 1]
+    outputs = heads(value["features"])
+    lps = []
+    for i, (name, glm) in enumerate((("signal", Bernoulli()), ("counts", Poisson()))):
+        single = Diglm(d.bijector, glm, 8)
+        single._beta.assign(heads._beta[:, i])
+        single._beta_0.assign(heads._beta_0[i])
+        lps.append(single.log_prob_parts({"features": value["features"],
+                                          "labels": value["labels"][name]}))
+        assert np.allclose(outputs[name][0], single(value["features"])[0], atol=1e-5)
+    lpp = heads.log_prob_parts(value)
+    assert np.allclose(lpp["features"], lps[0]["features"], atol=1e-4)
+    assert np.allclose(lpp["labels"], lps[0]["labels"] + lps[1]["labels"], atol=1e-4)
+    weighted = heads.weighted_log_prob(value, scaling_const=.5,
+                                       head_weights={"signal": 2., "counts": .5})
+    expected = 2. * lps[0]["labels"] + .5 * lps[1]["labels"] + .5 * lps[0]["features"]
+    assert np.allclose(weighted, expected, atol=1e-4)
+    with pytest.raises(ValueError):
+        heads.weighted_log_prob(value, head_weights={"signal": 2., "cuonts": .5})
+
+def test_quantile_sketch():
+    """ Tests the rank error and the memory of QuantileSketch.
+    """
+    values = np.random.default_rng(0).normal(size=200000)
+    sketch = QuantileSketch(capacity=256, seed=0)
+    for chunk in np.array_split(values, 100):
+        sketch.update(chunk)
+    q = np.array([.01, .1, .5, .9, .99])
+    ranks = np.searchsorted(np.sort(values), sketch.quantile(q)) / len(values)
+    assert np.abs(ranks - q).max() < .01
+    assert sketch.count == len(values)
+    assert sum(len(level) for level in sketch._levels) < 256 * 12
+    empty = QuantileSketch()
+    empty.update(np.empty(0))
+    with pytest.raises(ValueError):
+        empty.quantile(.5)
+
+def test_score_stream():
+    """ Tests score_stream outputs and calibration of the ood flags.
+    """
+    reference = [d.sample(256)["features"] for _ in range(4)]
+    shifted = [features + 20. for features in reference]
+    scores = list(d.score_stream(reference + shifted, reference=reference, quantile=.1))
+    assert len(scores) == 8
+    lpp = d.log_prob_parts({"features": reference[0], "labels": d.sample(256)["labels"]})
+    assert np.allclose(scores[0]["log_prob"], lpp["features"], atol=1e-4)
+    assert np.allclose(scores[0]["mean"], d(reference[0])[0], atol=1e-5)
+    assert abs(np.mean([s["ood"].mean() for s in scores[:4]]) - .1) < .03
+    assert all(s["ood"].all() for s in scores[4:])
@@ -0,0 +1,128 @@
+# By Marco Riggirello and Antoine Venturini
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.download import download_file
+
+DATA = os.urandom(3 * 2**20 + 12345)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """ Serves DATA, honouring `Range` headers only if `accept_ranges`.
+    """
+    accept_ranges = True
+    range_requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send_headers(self, start, end):
+        if start or end < len(DATA):
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(DATA)}')
+        else:
+            self.send_response(200)
+        if self.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+
+    def _bounds(self):
+        header = self.headers.get('Range')
+        if header is None or not self.accept_ranges:
+            return 0, len(DATA)
+        self.range_requests.append(header)
+        start, end = header[len('bytes='):].split('-')
+        return int(start), int(end) + 1 if end else len(DATA)
+
+    def do_HEAD(self): # pylint: disable=invalid-name
+        self._send_headers(0, len(DATA))
+
+    def do_GET(self): # pylint: disable=invalid-name
+        start, end = self._bounds()
+        if start >= len(DATA):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(DATA)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send_headers(start, end)
+        self.wfile.write(DATA[start:end])
+
+
+@pytest.fixture(params=[True, False], ids=['ranges', 'no_ranges'])
+def server(request):
+    handler = type('Handler', (RangeHandler,), {'accept_ranges': request.param,
+                                                'range_requests': []})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/HIGGS.csv.gz', handler
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_download(server, tmp_path):
+    url, _ = server
+    filename = tmp_path / 'data' / 'file.gz'
+    download_file(url, filename, sha256=SHA256)
+    assert filename.read_bytes() == DATA
+    assert not os.path.exists(str(filename) + '.part')
+
+def test_download_segments(server, tmp_path):
+    url, handler = server
+    filename = tmp_path / 'file.gz'
+    download_file(url, filename, sha256=SHA256, num_segments=4, chunk_size=2**16)
+    assert filename.read_bytes() == DATA
+    assert len(handler.range_requests) == (4 if handler.accept_ranges else 0)
+
+def test_resume(server, tmp_path):
+    url, handler = server
+    filename = tmp_path / 'file.gz'
+    (tmp_path / 'file.gz.part').write_bytes(DATA[:2**20])
+    download_file(url, filename, sha256=SHA256)
+    assert filename.read_bytes() == DATA
+    assert handler.range_requests == ([f'bytes={2**20}-'] if handler.accept_ranges else [])
+
+def test_checksum_mismatch(server, tmp_path):
+    url, _ = server
+    filename = tmp_path / 'file.gz'
+    with pytest.raises(ValueError):
+        download_file(url, filename, sha256='0' * 64)
+    assert not filename.exists()
+    assert not (tmp_path / 'file.gz.part').exists()
+
+def test_resume_segments_size_changed(server, tmp_path):
+    """ A partial download of a file that since changed size on the
+    server is restarted, without stale trailing bytes.
+    """
+    url, handler = server
+    if not handler.accept_ranges:
+        pytest.skip('segments need range requests')
+    filename = tmp_path / 'file.gz'
+    (tmp_path / 'file.gz.part').write_bytes(os.urandom(len(DATA) + 5000))
+    (tmp_path / 'file.gz.part.json').write_text(
+        '{"size": %d, "segments": [[0, 1024, %d]]}' % (len(DATA) + 5000, len(DATA) + 5000))
+    download_file(url, filename, num_segments=2)
+    assert filename.read_bytes() == DATA
+
+def test_resume_sequential_larger_part(server, tmp_path):
+    """ A stale partial file larger than the remote one is not installed. """
+    url, _ = server
+    filename = tmp_path / 'file.gz'
+    (tmp_path / 'file.gz.part').write_bytes(os.urandom(len(DATA) + 5000))
+    download_file(url, filename)
+    assert filename.read_bytes() == DATA
+
+def test_resume_sequential_complete(server, tmp_path):
+    """ A complete partial file is only renamed. """
+    url, handler = server
+    filename = tmp_path / 'file.gz'
+    (tmp_path / 'file.gz.part').write_bytes(DATA)
+    download_file(url, filename, sha256=SHA256)
+    assert filename.read_bytes() == DATA
+    assert handler.range_requests == ([f'bytes={len(DATA)}-'] if handler.accept_ranges else [])
@@ -0,0 +1,58 @@
+# By Marco Riggirello and Antoine Venturini
+import numpy as np
+import pytest
+from tensorflow_probability.python.glm import Bernoulli, Poisson
+
+from src.spqr import NeuralSplineFlow
+from src.diglm import Diglm
+from src.ensemble import DiglmEnsemble
+
+spline_params = dict(nbins=4, hidden_layers=[8, 8])
+features = np.random.default_rng(0).normal(size=(16, 4)).astype(np.float32)
+
+def member(glm, seed, uniform_bins=False):
+    model = Diglm(NeuralSplineFlow(masks=[2, -1, 1],
+                                   spline_params=dict(spline_params, uniform_bins=uniform_bins)),
+                  glm, 4)
+    rng = np.random.default_rng(seed)
+    for variable in model.trainable_variables:
+        variable.assign(rng.normal(size=variable.shape) / 2)
+    return model
+
+@pytest.mark.parametrize("uniform_bins", [False, True])
+def test_ensemble_matches_members(uniform_bins):
+    """ Tests if the ensemble outputs match a loop over its members.
+    """
+    members = [member(Bernoulli(), seed, uniform_bins) for seed in range(3)]
+    outputs = DiglmEnsemble(members)(features)
+    means = np.stack([m(features)[0] for m in members])
+    variances = np.stack([m(features)[1] for m in members])
+    log_probs = np.stack([m.log_prob_parts({"features": features,
+                                            "labels": np.zeros((16, 1))})["features"]
+                          for m in members])
+    assert outputs["member_mean"].shape == (3, 16, 1)
+    np.testing.assert_allclose(outputs["member_mean"], means, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(outputs["member_features_log_prob"], log_probs, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(outputs["mean"], means.mean(0), rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(outputs["variance"], variances.mean(0) + means.var(0),
+                               rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(outputs["features_log_prob"],
+                               np.log(np.exp(log_probs).mean(0)), rtol=1e-4, atol=1e-4)
+
+def test_ensemble_heads_and_refresh():
+    """ Tests a multi-head ensemble, the copy of the members weights
+    and the check of their architecture.
+    """
+    heads = lambda seed: member({"signal": Bernoulli(), "counts": Poisson()}, seed)
+    members = [heads(0), heads(1)]
+    ensemble = DiglmEnsemble(members)
+    members[1].head_variables[1].assign([3., -1.])
+    ensemble.refresh()
+    outputs = ensemble(features)
+    for i, m in enumerate(members):
+        expected = m(features)
+        for name in ("signal", "counts"):
+            np.testing.assert_allclose(outputs["member_mean_" + name][i], expected[name][0],
+                                       rtol=1e-4, atol=1e-6)
+    with pytest.raises(ValueError):
+        DiglmEnsemble([heads(0), member(Bernoulli(), 0)])
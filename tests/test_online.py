@@ -0,0 +1,51 @@
+# By Marco Riggirello and Antoine Venturini
+import numpy as np
+import tensorflow as tf
+
+from src.checkpoint import read_header
+from src.config import DiglmConfig
+from src.online import OnlineTrainer, ReservoirBuffer
+
+def stream(batch_size=64, seed=0):
+    rng = np.random.default_rng(seed)
+    while True:
+        features = rng.normal(size=(batch_size, 4)).astype(np.float32)
+        yield {"features": features, "labels": (features[:, :1] > 0).astype(np.int32)}
+
+def test_reservoir_buffer():
+    buffer = ReservoirBuffer(100, seed=0)
+    for start in range(0, 10000, 50):
+        buffer.add({"x": np.arange(start, start + 50)})
+    assert buffer.size == 100 and buffer.seen == 10000
+    # a uniform sample of the stream, not only the last events
+    assert 2500 < buffer.sample(1000)["x"].mean() < 7500
+
+def test_online_trainer(tmp_path):
+    config = DiglmConfig(4, masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8]))
+    model = config.build()
+    flow = [v.numpy() for v in model.bijector.trainable_variables]
+    path = str(tmp_path / "online.diglm")
+    trainer = OnlineTrainer(model, tf.keras.optimizers.Adam(1e-2), buffer_size=256,
+                            replay_size=32, flow_every=4, checkpoint_path=path,
+                            checkpoint_every=5, config=config, seed=0)
+    trainer.update(next(stream()))
+    # the head is updated alone, the flow only every `flow_every` batches
+    flow_after_first = [v.numpy() for v in model.bijector.trainable_variables]
+    trainer.update(next(stream(seed=1)))
+    assert all(np.array_equal(a, b) for a, b in
+               zip(flow_after_first, [v.numpy() for v in model.bijector.trainable_variables]))
+    assert not all(np.array_equal(a, b) for a, b in zip(flow, flow_after_first))
+    assert trainer.fit_stream(stream(seed=2), max_updates=3) == 3
+    assert read_header(path)["config"] == config.to_dict()
+
+def test_online_multi_head():
+    config = DiglmConfig(4, masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8]),
+                         glm={"a": "Bernoulli", "b": "Bernoulli"})
+    trainer = OnlineTrainer(config.build(), tf.keras.optimizers.Adam(1e-2), buffer_size=256,
+                            replay_size=32, flow_every=2, seed=0)
+    for batch in (next(stream(seed=seed)) for seed in range(3)):
+        labels = batch["labels"]
+        assert np.isfinite(trainer.update({"features": batch["features"],
+                                           "labels": {"a": labels, "b": 1 - labels}}))
+    assert set(trainer.buffer.sample(8)["labels"]) == {"a", "b"}
+    assert trainer.buffer.sample(8)["labels"]["b"].shape == (8, 1)
@@ -0,0 +1,34 @@
+# By Marco Riggirello and Antoine Venturini
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+
+from src import plot_utils
+
+def test_animation_writer(tmp_path):
+    output = str(tmp_path / "animation.gif")
+    frames = [np.full((12, 16, 3), 20 * i, dtype=np.uint8) for i in range(6)]
+    with plot_utils.AnimationWriter(output, duration=.1, max_pending=2) as writer:
+        for frame in frames[:3]:
+            writer.append(frame)
+        for frame in frames[3:]:
+            writer.submit(np.copy, frame)
+    assert writer.frames == 6
+    written = [np.asarray(im.convert("RGB")) for im in ImageSequence.Iterator(Image.open(output))]
+    assert len(written) == 6
+    for frame, image in zip(frames, written):
+        assert np.array_equal(frame, image)
+
+def test_animation_writer_frame_size(tmp_path):
+    with pytest.raises(ValueError):
+        with plot_utils.AnimationWriter(str(tmp_path / "animation.gif")) as writer:
+            writer.append(np.zeros((8, 8, 3), dtype=np.uint8))
+            writer.append(np.zeros((4, 8, 3), dtype=np.uint8))
+
+def test_make_gif_missing_frames(tmp_path):
+    frame = str(tmp_path / "frame.png")
+    Image.fromarray(np.zeros((8, 8, 3), dtype=np.uint8)).save(frame)
+    with pytest.raises(OSError):
+        plot_utils.make_gif([frame, str(tmp_path / "missing.png")], str(tmp_path / "a.gif"))
+    plot_utils.make_gif([frame], str(tmp_path / "a.gif"))
+    assert Image.open(str(tmp_path / "a.gif")).n_frames == 1
@@ -0,0 +1,45 @@
+# By Marco Riggirello and Antoine Venturini
+import tensorflow as tf
+from tensorflow_probability.python.glm import Bernoulli
+
+from src import profiling
+from src.spqr import NeuralSplineFlow
+from src.diglm import Diglm
+from src.trainer import DiglmTrainer
+
+def make_model():
+    return Diglm(NeuralSplineFlow(masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8])),
+                 Bernoulli(), 4)
+
+def make_data(n):
+    features = tf.random.normal([n, 4])
+    return {"features": features, "labels": tf.cast(features[:, :1] > 0, tf.int32)}
+
+def test_stage():
+    stats = profiling.StageStats(depth=2)
+    assert stats.stage("flow/coupling_layer_1/conditioner/spline_block/dense/MatMul") == \
+        "flow/coupling_layer_1"
+    assert stats.stage("gradient_tape/glm_1/compute_predicted_linear_response/MatVec") == \
+        "glm (backward)"
+    assert stats.stage("Adam/Pow") == "(other)"
+
+def test_profile_steps():
+    d = make_model()
+    stats = profiling.profile_steps(tf.function(d.log_prob_parts), make_data(64), num_steps=2)
+    summary = stats.summary()
+    assert stats.steps == 2
+    for stage in ("flow/coupling_layer_0/conditioner", "flow/coupling_layer_1/spline",
+                  "glm", "features_log_prob", "labels_log_prob"):
+        assert summary[stage][1] > 0
+    assert "flow/coupling_layer_1/spline" in stats.table()
+
+def test_trainer_profiler():
+    d = make_model()
+    trainer = DiglmTrainer(d, tf.keras.optimizers.Adam(1e-2), steps_per_execution=2,
+                           jit_compile=False)
+    dataset = tf.data.Dataset.from_tensor_slices(make_data(512)).batch(64)
+    profiler = profiling.StageProfiler(every=2)
+    trainer.fit(dataset, eval_every=2, verbose=False, profiler=profiler)
+    # calls 2 and 4 of 4 are profiled, each running steps_per_execution steps
+    assert profiler.stats.steps == 4
+    assert "flow/coupling_layer_0/spline (backward)" in profiler.stats.summary()
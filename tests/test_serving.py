@@ -0,0 +1,102 @@
+# By Marco Riggirello and Antoine Venturini
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import tensorflow as tf
+from tensorflow_probability.python.glm import Bernoulli
+
+from src.spqr import NeuralSplineFlow
+from src.diglm import Diglm
+from src.serving import InferenceEngine
+
+d = Diglm(NeuralSplineFlow(masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8])),
+          Bernoulli(), 4)
+features = np.random.default_rng(0).normal(size=(20, 4)).astype(np.float32)
+
+def expected():
+    mean, variance, grad_mean = d(features)
+    latents, ildj = d.latent_features_and_log_det_jacobian(features)
+    return {"mean": mean, "variance": variance, "grad_mean": grad_mean,
+            "features_log_prob": d.features_log_prob_from_latents(latents, ildj)}
+
+def test_predict():
+    engine = InferenceEngine(d, buckets=(1, 8))
+    engine.warmup()
+    outputs = engine.predict(features)
+    for key, value in expected().items():
+        assert np.allclose(outputs[key], value, atol=1e-5)
+    empty = engine.predict(np.zeros([0, 4]))
+    assert set(empty) == set(outputs) and all(len(value) == 0 for value in empty.values())
+
+def test_micro_batching():
+    with InferenceEngine(d, buckets=(1, 4, 16), max_wait=0.05) as engine:
+        with ThreadPoolExecutor(8) as pool:
+            futures = list(pool.map(engine.submit, features))
+        outputs = [future.result() for future in futures]
+
+        async def gather():
+            return await asyncio.gather(*(engine.predict_async(f) for f in features[:3]))
+        async_outputs = asyncio.run(gather())
+    reference = expected()
+    assert np.allclose([o["mean"] for o in outputs], reference["mean"], atol=1e-5)
+    assert np.allclose([o["mean"] for o in async_outputs], reference["mean"][:3], atol=1e-5)
+
+def test_single_worker():
+    """ Concurrent first submissions start a single micro-batching thread. """
+    engine = InferenceEngine(d, buckets=(1, 4))
+    threads = threading.active_count()
+    with ThreadPoolExecutor(8) as pool:
+        futures = list(pool.map(engine.submit, features))
+    assert threading.active_count() == threads + 1
+    assert all(future.result() for future in futures)
+    engine.close()
+    assert threading.active_count() == threads
+
+def test_cancelled_and_malformed_requests():
+    with InferenceEngine(d, buckets=(1, 4), max_wait=0.5) as engine:
+        cancelled = engine.submit(features[0])
+        # still queued for the micro-batch, so it can be cancelled
+        assert cancelled.cancel()
+        served = engine.submit(features[1])
+        with pytest.raises(ValueError):
+            engine.submit(features[:2])
+        assert np.allclose(served.result()["mean"], expected()["mean"][1], atol=1e-5)
+        # the worker survived the cancelled request
+        assert np.allclose(engine.submit(features[2]).result()["mean"],
+                           expected()["mean"][2], atol=1e-5)
+
+def test_export(tmp_path):
+    InferenceEngine(d, buckets=(1, 8)).export(tmp_path / "model")
+    loaded = tf.saved_model.load(str(tmp_path / "model"))
+    outputs = loaded.signatures["serving_default"](features=tf.constant(features))
+    assert np.allclose(outputs["mean"], expected()["mean"], atol=1e-5)
+    assert "batch_8" in loaded.signatures
+
+def test_load(tmp_path):
+    InferenceEngine(d, buckets=(1, 8)).export(tmp_path / "model")
+    engine = InferenceEngine.load(tmp_path / "model")
+    assert engine.buckets == (1, 8)
+    engine.warmup()
+    outputs = engine.predict(features)
+    for key, value in expected().items():
+        assert np.allclose(outputs[key], value, atol=1e-5)
+    with engine:
+        assert np.allclose(engine.submit(features[0]).result()["mean"], outputs["mean"][0])
+    # the loaded engine has all the state of a constructed one
+    assert set(vars(engine)) == set(vars(InferenceEngine(d, buckets=(1,))))
+
+def test_reload(tmp_path):
+    from src.checkpoint import save
+    from src.config import DiglmConfig
+    config = DiglmConfig(4, masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8]))
+    other = config.build()
+    other.head_variables[1].assign(3.)
+    path = str(tmp_path / "model.diglm")
+    save(path, other, config)
+    served = config.build()
+    engine = InferenceEngine(served, buckets=(8,))
+    assert engine.reload(path) and not engine.reload(path)
+    assert float(served.head_variables[1]) == 3.
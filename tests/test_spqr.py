@@ -1,6 +1,11 @@
 # By Marco Riggirello and Antoine Venturini
+import gc
+import weakref
+
 import numpy as np
+import pytest
 import tensorflow as tf
+from tensorflow_probability import bijectors as tfb
 
 from src import spqr
 
@@ -27,3 +32,127 @@ def test_bijector_bijectivity_masks():
     nsf = spqr.NeuralSplineFlow(masks=[4,3,-2,-4])
     y = nsf.forward(x)
     assert np.all(x == nsf.inverse(y))
+
+def test_inverse_and_log_det_jacobian():
+    x = tf.random.normal([5, 12])
+    nsf = spqr.NeuralSplineFlow(masks=[4,3,-2,-4])
+    z, ildj = nsf.inverse_and_log_det_jacobian(x)
+    assert np.allclose(z, nsf.inverse(x), atol=1e-5)
+    assert np.allclose(ildj, nsf.inverse_log_det_jacobian(x, event_ndims=1), atol=1e-4)
+
+def test_recompute_grad_gradients():
+    x = tf.random.normal([5, 12])
+    nsfs = [spqr.NeuralSplineFlow(masks=[4,-4,6], recompute_grad=rg,
+                                  spline_params=dict(nbins=8, hidden_layers=[16]))
+            for rg in (False, True)]
+    grads = []
+    for nsf in nsfs:
+        nsf.inverse_and_log_det_jacobian(x)
+        if grads:
+            for var, ref in zip(nsf.trainable_variables, nsfs[0].trainable_variables):
+                var.assign(ref)
+        with tf.GradientTape() as tape:
+            z, ildj = nsf.inverse_and_log_det_jacobian(x)
+            loss = tf.reduce_sum(z**2) - tf.reduce_sum(ildj)
+        grads.append(tape.gradient(loss, nsf.trainable_variables))
+    for grad, ref in zip(*grads):
+        assert np.allclose(grad, ref, atol=1e-5)
+
+def test_recompute_grad_first_call(monkeypatch):
+    """ Tests if the first call of an unbuilt flow, e.g. the one traced
+    by a tf.function, already recomputes the coupling layers.
+    """
+    wrapped = []
+    monkeypatch.setattr(spqr, "recompute_grad",
+                        lambda step: wrapped.append(step) or tf.recompute_grad(step))
+    nsf = spqr.NeuralSplineFlow(masks=[4,-4,6], recompute_grad=True,
+                                spline_params=dict(nbins=8, hidden_layers=[16]))
+    x = tf.random.normal([5, 12])
+    with tf.GradientTape() as tape:
+        tape.watch(x)
+        z, ildj = nsf.inverse_and_log_det_jacobian(x)
+        loss = tf.reduce_sum(z**2) - tf.reduce_sum(ildj)
+    assert len(wrapped) == 3
+    assert all(grad is not None for grad in tape.gradient(loss, [x] + nsf.trainable_variables))
+
+def test_fuse_spline_block_weights():
+    nunits, nbins, border = 3, 4, 2.
+    block = spqr.SplineBlock(nunits, nbins, border, hidden_layers=[5])
+    x = tf.random.normal([7, 2])
+    block(x)
+    rng = np.random.default_rng(0)
+    hidden = [rng.normal(size=(2, 5)), rng.normal(size=5)]
+    heads = [rng.normal(size=(5, nunits * n)) for n in (nbins, nbins, nbins - 1)]
+    biases = [rng.normal(size=nunits * n) for n in (nbins, nbins, nbins - 1)]
+    block.set_weights(spqr.fuse_spline_block_weights(
+        hidden + [w for pair in zip(heads, biases) for w in pair]))
+    widths, heights, slopes = block(x)
+    h = np.maximum(x.numpy() @ hidden[0] + hidden[1], 0)
+    w = (h @ heads[0] + biases[0]).reshape(7, nunits, nbins)
+    w = np.exp(w) / np.exp(w).sum(axis=-1, keepdims=True)
+    s = np.log1p(np.exp(h @ heads[2] + biases[2])).reshape(7, nunits, nbins - 1)
+    assert np.allclose(widths, w * (2 * border - nbins * 1e-3) - 1e-3, atol=1e-5)
+    assert np.allclose(slopes, s + 1e-3, atol=1e-5)
+    assert heights.shape == widths.shape
+
+@pytest.mark.parametrize("uniform_side", ["x", "y"])
+def test_uniform_spline_matches_rational_quadratic_spline(uniform_side):
+    sizes = tf.nn.softmax(tf.random.normal([3, 5, 8])) * 8
+    slopes = tf.nn.softplus(tf.random.normal([3, 5, 7])) + 1e-3
+    uniform = spqr.UniformRationalQuadraticSpline(sizes, slopes, range_min=-4,
+                                                  uniform_side=uniform_side)
+    if uniform_side == "x":
+        reference = tfb.RationalQuadraticSpline(tf.ones_like(sizes), sizes, slopes, range_min=-4)
+    else:
+        reference = tfb.RationalQuadraticSpline(sizes, tf.ones_like(sizes), slopes, range_min=-4)
+    x = tf.random.normal([3, 5]) * 3
+    y = reference.forward(x)
+    assert np.allclose(uniform.forward(x), y, atol=1e-5)
+    assert np.allclose(uniform.inverse(y), x, atol=1e-4)
+    assert np.allclose(uniform.forward_log_det_jacobian(x, event_ndims=0),
+                       reference.forward_log_det_jacobian(x, event_ndims=0), atol=1e-4)
+    assert np.allclose(uniform.inverse_log_det_jacobian(y, event_ndims=0),
+                       reference.inverse_log_det_jacobian(y, event_ndims=0), atol=1e-4)
+
+def test_bijector_bijectivity_uniform_bins():
+    x = tf.random.normal([6, 12])
+    for uniform_bins in (True, "x"):
+        nsf = spqr.NeuralSplineFlow(masks=[4,-4], spline_params=dict(nbins=16, uniform_bins=uniform_bins))
+        assert np.allclose(nsf.inverse(nsf.forward(x)), x, atol=1e-4)
+
+def test_quantize_weights():
+    kernel = np.random.default_rng(0).normal(size=(16, 8)).astype(np.float32)
+    quantized, scales = spqr.quantize_weights(kernel)
+    assert quantized.dtype == np.int8 and scales.shape == (8,)
+    assert np.abs(quantized * scales - kernel).max() <= scales.max() / 2 + 1e-6
+
+def test_set_precision():
+    nsf = spqr.NeuralSplineFlow(masks=[3, -3], spline_params=dict(nbins=8, hidden_layers=[32]))
+    nsf.build(6)
+    y = tf.random.normal([64, 6], seed=0)
+    reference = nsf.inverse_and_log_det_jacobian(y)
+    kernels = [weakref.ref(v) for v in nsf.variables if "kernel" in v.name]
+    for precision, atol in (("bfloat16", 5e-2), ("float32", 0.), ("int8", 5e-2)):
+        nsf.set_precision(precision)
+        assert nsf.precision == precision
+        x, ildj = nsf.inverse_and_log_det_jacobian(y)
+        assert x.dtype == ildj.dtype == tf.float32
+        assert np.allclose(x, reference[0], atol=atol)
+        assert np.allclose(ildj, reference[1], atol=10 * atol)
+    # int8 keeps only the quantized kernels (and their scales), and cannot be undone
+    assert sorted(v.dtype.name for v in nsf.variables) == ["float32"] * 8 + ["int8"] * 4
+    gc.collect()
+    assert len(kernels) == 4 and all(kernel() is None for kernel in kernels)
+    with pytest.raises(ValueError):
+        nsf.set_precision("float32")
+
+def test_shared_conditioner():
+    y = tf.random.normal([5, 7])
+    nsf = spqr.NeuralSplineFlow(masks=[3,-3,-2,-1,-5,-4,2], shared_conditioner=True,
+                                spline_params=dict(nbins=8, hidden_layers=[16]), num_features=7)
+    # one hidden and one parameters dense layer, plus the layer embeddings
+    assert len(nsf.trainable_variables) == 5
+    assert [len(group) for group in nsf._independent_groups(y)] == [1, 3, 2, 1]
+    x, ildj = nsf.inverse_and_log_det_jacobian(y)
+    assert np.allclose(nsf.forward(x), y, atol=1e-4)
+    assert np.allclose(ildj, nsf.inverse_log_det_jacobian(y, event_ndims=1), atol=1e-4)
@@ -0,0 +1,38 @@
+# By Marco Riggirello and Antoine Venturini
+import numpy as np
+
+from src import sweep
+from src.checkpoint import read_header
+from src.data import arrays_to_shards
+
+def make_shards(path, rows, seed):
+    features = np.random.default_rng(seed).normal(size=(rows, 4)).astype(np.float32)
+    arrays_to_shards({"features": features, "labels": (features[:, :1] > 0).astype(np.int32)},
+                     str(path))
+    return str(path)
+
+def test_halving_rungs():
+    assert sweep.halving_rungs(81) == [81]
+    assert sweep.halving_rungs(81, 3) == [3, 9, 27, 81]
+    assert sweep.halving_rungs(100, 10, eta=2) == [12, 25, 50, 100]
+
+def test_grid():
+    configs = sweep.grid(4, masks=[[2, -2], [1, -1]], nbins=[4, 8], hidden_layers=[[8]])
+    assert len(configs) == 4
+    assert configs[1].masks == [2, -2] and configs[1].spline_params == {"nbins": 8, "hidden_layers": [8]}
+    assert len({sweep.trial_id(config) for config in configs}) == 4
+    assert sweep.trial_id(configs[0], {"seed": 0}) == sweep.trial_id(configs[0], {"seed": 0})
+    assert sweep.trial_id(configs[0], {"seed": 0}) != sweep.trial_id(configs[0], {"seed": 1})
+
+def test_sweep_runner(tmp_path):
+    runner = sweep.SweepRunner(str(tmp_path / "store"), make_shards(tmp_path / "train", 1024, 0),
+                               make_shards(tmp_path / "val", 256, 1), workers=1, batch_size=128,
+                               steps_per_execution=2)
+    configs = sweep.grid(4, masks=[[2, -2], [1, -1]], nbins=[4], hidden_layers=[[8]])
+    results = runner.run(configs, max_steps=6, min_steps=2, verbose=False)
+    assert [result["steps"] for result in results] == [6, 2]
+    assert results[1]["val_loss"] >= min(r["val_loss"] for r in runner.results() if r["steps"] == 2)
+    assert read_header(runner.checkpoint_path(results[0]["trial"], 6))["config"] == results[0]["config"]
+    # completed rungs are not trained again
+    assert runner.run(configs, max_steps=6, min_steps=2, verbose=False) == results
+    assert len(runner.results()) == 3
@@ -0,0 +1,91 @@
+# By Marco Riggirello and Antoine Venturini
+import os
+import subprocess
+import sys
+
+import tensorflow as tf
+from tensorflow_probability.python.glm import Bernoulli
+
+from src.spqr import NeuralSplineFlow
+from src.diglm import Diglm
+from src.trainer import DiglmTrainer
+
+def make_data(n, num_features=4):
+    features = tf.random.normal([n, num_features])
+    labels = tf.cast(features[:, :1] > 0, tf.int32)
+    return {"features": features, "labels": labels}
+
+def test_fit():
+    d = Diglm(NeuralSplineFlow(masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8])),
+              Bernoulli(), 4)
+    trainer = DiglmTrainer(d, tf.keras.optimizers.Adam(1e-2), steps_per_execution=4)
+    dataset = tf.data.Dataset.from_tensor_slices(make_data(640)).batch(64, drop_remainder=True)
+    history = trainer.fit(dataset, epochs=2, validation_data=make_data(128), eval_every=4,
+                          verbose=False)
+    assert history["step"] == [4, 8, 10, 14, 18, 20]
+    assert len(history["val_loss"]) == len(history["accuracy"]) == 6
+    assert history["train_loss"][-1] < history["train_loss"][0]
+
+MIRRORED_SCRIPT = """
+import numpy as np
+import tensorflow as tf
+from tensorflow_probability.python.glm import Bernoulli
+from src.spqr import NeuralSplineFlow
+from src.diglm import Diglm
+from src.trainer import DiglmTrainer, logical_cpu_devices
+
+strategy = tf.distribute.MirroredStrategy(logical_cpu_devices(2))
+make = lambda: Diglm(NeuralSplineFlow(masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8])),
+                     Bernoulli(), 4)
+with strategy.scope():
+    mirrored, mirrored_opt = make(), tf.keras.optimizers.SGD(.1)
+single, single_opt = make(), tf.keras.optimizers.SGD(.1)
+for var, ref in zip(mirrored.trainable_variables, single.trainable_variables):
+    var.assign(ref)
+features = tf.random.normal([64, 4])
+dataset = tf.data.Dataset.from_tensors({"features": features,
+                                        "labels": tf.cast(features[:, :1] > 0, tf.int32)})
+losses = [DiglmTrainer(model, opt, steps_per_execution=1, jit_compile=False,
+                       strategy=strat).fit(dataset, verbose=False)["train_loss"][0]
+          for model, opt, strat in ((single, single_opt, None), (mirrored, mirrored_opt, strategy))]
+assert np.isclose(*losses, atol=1e-5)
+for var, ref in zip(mirrored.trainable_variables, single.trainable_variables):
+    assert np.allclose(var.numpy(), ref.numpy(), atol=1e-5)
+"""
+
+def test_mirrored_strategy_step():
+    """ A step on two replicas must match the single device one. """
+    subprocess.run([sys.executable, "-c", MIRRORED_SCRIPT], check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def test_head_only_fit():
+    d = Diglm(NeuralSplineFlow(masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8])),
+              Bernoulli(), 4)
+    flow_weights = [v.numpy() for v in d.bijector.trainable_variables]
+    trainer = DiglmTrainer(d, tf.keras.optimizers.Adam(1e-1), steps_per_execution=4,
+                           head_only=True)
+    data = make_data(640)
+    latents, ldj = d.latent_features_and_log_det_jacobian(data["features"])
+    cached = {"latents": latents, "log_det_jacobian": ldj, "labels": data["labels"]}
+    dataset = tf.data.Dataset.from_tensor_slices(cached).batch(64, drop_remainder=True)
+    history = trainer.fit(dataset, epochs=2, validation_data=make_data(128), eval_every=4,
+                          verbose=False)
+    assert history["train_loss"][-1] < history["train_loss"][0]
+    for var, ref in zip(d.bijector.trainable_variables, flow_weights):
+        assert (var.numpy() == ref).all()
+
+def test_multi_head_fit():
+    d = Diglm(NeuralSplineFlow(masks=[2,-2], spline_params=dict(nbins=4, hidden_layers=[8])),
+              {"sign": Bernoulli(), "positive": Bernoulli()}, 4)
+    def make_heads_data(n):
+        data = make_data(n)
+        return {"features": data["features"],
+                "labels": {"sign": data["labels"],
+                           "positive": tf.cast(data["features"][:, 1:2] > 0, tf.int32)}}
+    trainer = DiglmTrainer(d, tf.keras.optimizers.Adam(1e-2), steps_per_execution=4,
+                           head_weights={"sign": 1., "positive": .5})
+    dataset = tf.data.Dataset.from_tensor_slices(make_heads_data(640)).batch(64)
+    history = trainer.fit(dataset, epochs=2, validation_data=make_heads_data(128),
+                          eval_every=10, verbose=False)
+    assert len(history["accuracy_sign"]) == len(history["accuracy_positive"]) == 2
+    assert history["train_loss"][-1] < history["train_loss"][0]